@@ -0,0 +1,326 @@
+import argparse
+import copy
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+import torch.nn as nn
+
+import signals
+
+
+def timeCall(fn, repeats:int=50, warmup:int=5) -> float:
+  """Times a callable, returning the mean wall time of a single call in seconds.
+
+  Args:
+    fn (callable): The zero argument callable to time.
+    repeats (int, optional): The amount of timed calls. Defaults to 50.
+    warmup (int, optional): The amount of untimed calls made first. Defaults to 5.
+
+  Returns:
+    float: The mean seconds per call.
+  """
+  with torch.no_grad():
+    for _ in range(warmup):
+      fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+      fn()
+  return (time.perf_counter() - start) / repeats
+
+
+def loopKnot(curves:nn.ModuleList, regWeights:torch.Tensor, knotRadii:torch.Tensor, x:torch.Tensor) -> torch.Tensor:
+  # The per-curve accumulation that the stacked Knot replaced
+  result = torch.zeros(list(x.size()) + [curves[0].size], dtype=regWeights.dtype)
+  for idx, lissajous in enumerate(curves):
+    result = result + (regWeights[idx] * lissajous.forward(x))
+  return result + knotRadii
+
+
+def benchKnot(depths=(8, 32, 128), knotSize:int=3, samples:int=signals.knot.DEFAULT_FFT_SAMPLES, dtype=torch.float32):
+  print(f'Knot forward, size {knotSize}, {samples} samples, {dtype}')
+  x = torch.rand(samples, dtype=dtype)
+
+  for depth in depths:
+    knot = signals.Knot(knotSize=knotSize, knotDepth=depth).to(dtype)
+    with torch.no_grad():
+      for param in knot.parameters():
+        param.uniform_(-1., 1.)
+    curves = knot.curves().to(dtype)
+
+    # Make sure both paths agree before timing them
+    with torch.no_grad():
+      stacked = knot(x)
+      looped = loopKnot(curves, knot.regWeights, knot.knotRadii, x)
+    drift = torch.max(torch.abs(stacked - looped)).item()
+
+    loopTime = timeCall(lambda: loopKnot(curves, knot.regWeights, knot.knotRadii, x))
+    stackTime = timeCall(lambda: knot(x))
+    print(f'  depth {depth:4d}: loop {loopTime*1e6:9.1f}us, stacked {stackTime*1e6:9.1f}us, '
+      + f'speedup {loopTime/stackTime:5.1f}x, max diff {drift:.2e}')
+
+
+def buildEntangle(knotCount:int, knotSize:int=3, knotDepth:int=8, dtype=torch.float32, **kwargs) -> signals.KnotEntangle:
+  knots = nn.ModuleList([signals.Knot(knotSize=knotSize, knotDepth=knotDepth) for _ in range(knotCount)])
+  entangle = signals.KnotEntangle(knots, **kwargs).to(dtype)
+  with torch.no_grad():
+    for knot in knots:
+      for param in knot.parameters():
+        param.uniform_(-1., 1.)
+  return entangle
+
+
+def benchEntangle(knotCounts=(16, 64, 256), batch:int=4, dtype=torch.float32):
+  print(f'KnotEntangle forward, batch {batch}, {dtype}')
+
+  for knotCount in knotCounts:
+    entangle = buildEntangle(knotCount, dtype=dtype)
+    x = torch.rand(batch, knotCount, dtype=dtype)
+
+    # Compare the full forward against the single batched rfft it is built around
+    smears = torch.rand(batch, knotCount, entangle.samples, entangle.curveSize, dtype=dtype)
+    fftTime = timeCall(lambda: torch.fft.rfft(smears, n=entangle.samples, dim=-2))
+    forwardTime = timeCall(lambda: entangle(x), repeats=10)
+    print(f'  knots {knotCount:5d}: forward {forwardTime*1e3:8.2f}ms, rfft {fftTime*1e3:8.2f}ms')
+
+
+def compareEntangle(entangle:signals.KnotEntangle, x:torch.Tensor, topKs=(1, 4, 16, 64)) -> dict:
+  """Measures how far the sparse entanglement drifts from the exact entanglement.
+
+  Args:
+    entangle (signals.KnotEntangle): The entanglement to compare, its topK is restored afterwards.
+    x (torch.Tensor): The input to push through both modes.
+    topKs (tuple, optional): The partner counts to compare. Defaults to (1, 4, 16, 64).
+
+  Returns:
+    dict: The relative L2 error of the sparse output against the exact output, per partner count.
+  """
+  restoreK = entangle.topK
+  errors = {}
+  with torch.no_grad():
+    entangle.topK = None
+    exact = entangle(x)
+    for topK in topKs:
+      entangle.topK = topK
+      sparse = entangle(x)
+      errors[topK] = (torch.norm(sparse - exact) / torch.norm(exact)).item()
+  entangle.topK = restoreK
+  return errors
+
+
+def benchSparseEntangle(knotCounts=(16, 64, 256, 1024, 4096, 16384), topK:int=8, batch:int=1, exactLimit:int=1024,
+  dtype=torch.float32):
+  """Times the top-k entanglement against the exact one, splitting out the partner search.
+
+  Past SKETCH_BLOCK_SIZE knots the partners come from the projection search rather than
+  the exact scan, so from there on the time per knot of both the forward and the search
+  should stay roughly flat as the knot count grows. The sweep reports both per knot along
+  with the growth of the search against the previous knot count.
+  """
+  print(f'KnotEntangle top-{topK} vs exact forward, batch {batch}, {dtype}')
+
+  lastCount, lastPartnerTime = None, None
+  for knotCount in knotCounts:
+    entangle = buildEntangle(knotCount, dtype=dtype, topK=topK)
+    x = torch.rand(batch, knotCount, dtype=dtype)
+
+    # Time the partner search from inside of the forward pass it is part of
+    partnerTimes = []
+    findPartners = entangle.findPartners
+    def timedPartners(*args):
+      start = time.perf_counter()
+      result = findPartners(*args)
+      partnerTimes.append(time.perf_counter() - start)
+      return result
+    entangle.findPartners = timedPartners
+    sparseTime = timeCall(lambda: entangle(x), repeats=5, warmup=1)
+    del entangle.findPartners
+    partnerTime = sum(partnerTimes[1:]) / max(len(partnerTimes) - 1, 1)
+    search = 'scan' if knotCount <= max(signals.knot.SKETCH_BLOCK_SIZE, 2 * max(topK, signals.knot.SKETCH_WINDOW)) \
+      else 'projected'
+    growth = ''
+    if lastPartnerTime is not None:
+      growth = f', x{partnerTime / lastPartnerTime:5.1f} for x{knotCount / lastCount:.0f} knots'
+    lastCount, lastPartnerTime = knotCount, partnerTime
+    sparseReport = f'sparse {sparseTime*1e6/knotCount:8.2f}us/knot (partners {search} ' \
+      + f'{partnerTime*1e6/knotCount:8.2f}us/knot{growth})'
+
+    # The exact mode is quadratic, so it only runs while it still fits comfortably
+    if knotCount > exactLimit:
+      print(f'  knots {knotCount:5d}: {sparseReport}, exact skipped')
+      continue
+    entangle.topK = None
+    exactTime = timeCall(lambda: entangle(x), repeats=5, warmup=1)
+    entangle.topK = topK
+    error = compareEntangle(entangle, x, topKs=(topK,))[topK]
+    print(f'  knots {knotCount:5d}: {sparseReport}, exact {exactTime*1e6/knotCount:8.2f}us/knot, '
+      + f'relative error {error:.3e}')
+
+
+def benchConv(frameSize=(1080, 1920), windowSize=(32, 32), stepSize:int=4, bankSizes=(4, 16), dtype=torch.float32):
+  print(f'KnotConv {windowSize[0]}x{windowSize[1]} window, step {stepSize}, over a {frameSize[1]}x{frameSize[0]} frame, {dtype}')
+
+  # An 8 bit frame like the cameras give, which lets the windowed mode go through its value table
+  frame = (torch.randint(0, 256, (1, 3, frameSize[0], frameSize[1])) / 255.).to(dtype)
+
+  for bankSize in (None,) + tuple(bankSizes):
+    start = time.perf_counter()
+    conv = signals.KnotConv(windowSize=windowSize, stepSize=stepSize, bankSize=bankSize).to(dtype)
+    buildTime = time.perf_counter() - start
+    with torch.no_grad():
+      forwardTime = timeCall(lambda: conv(frame), repeats=1, warmup=0)
+    name = 'windowed' if bankSize is None else f'bank {bankSize:4d}'
+    print(f'  {name:9s}: build {buildTime*1e3:8.1f}ms, {len(conv.knots):5d} knots, forward {forwardTime:6.2f}s')
+
+
+WARM_EXPORT = '''
+import sys, time
+import torch
+sys.path.insert(0, sys.argv[1])
+import signals
+torch.set_num_threads(int(sys.argv[5]))
+module, example = torch.load(sys.argv[2], weights_only=False)
+start = time.perf_counter()
+_, cached = signals.exportModule(module, example, mode=sys.argv[3], cacheDir=sys.argv[4])
+print(time.perf_counter() - start, cached)
+'''
+
+
+def warmExport(module: nn.Module, example: torch.Tensor, mode: str, cacheDir: str):
+  # A fresh interpreter, so that nothing but the artifacts on disk carries over from the cold start
+  targetPath = os.path.join(cacheDir, 'target.pt')
+  torch.save((module, example), targetPath)
+  brainDir = os.path.dirname(os.path.abspath(__file__))
+  output = subprocess.run([sys.executable, '-c', WARM_EXPORT, brainDir, targetPath, mode, cacheDir,
+    str(torch.get_num_threads())], check=True, capture_output=True, text=True).stdout.split()
+  os.remove(targetPath)
+  return float(output[-2]), output[-1] == 'True'
+
+
+def benchExport(modes=('trace', 'compile'), dtype=torch.float32):
+  print(f'Export cold vs warm start, {dtype}')
+  knotCount = 16
+  knots = buildEntangle(knotCount, dtype=dtype).knots
+  targets = (
+    ('Knot', signals.Knot(knotSize=3, knotDepth=32).to(dtype), torch.rand(signals.knot.DEFAULT_FFT_SAMPLES, dtype=dtype)),
+    ('KnotEntangle', signals.KnotEntangle(knots).to(dtype), torch.rand(4, knotCount, dtype=dtype)),
+    ('KnotConv', signals.KnotConv(windowSize=(8, 8), bankSize=4).to(dtype), torch.rand(1, 3, 64, 64, dtype=dtype)),
+  )
+
+  for mode in modes:
+    if mode == 'compile' and not hasattr(torch, 'compile'):
+      print(f'  {mode}: skipped, needs torch 2.0 or newer')
+      continue
+
+    with tempfile.TemporaryDirectory() as cacheDir:
+      for name, module, example in targets:
+        start = time.perf_counter()
+        _, coldCached = signals.exportModule(module, example, mode=mode, cacheDir=cacheDir)
+        coldTime = time.perf_counter() - start
+
+        # The warm start is what a freshly started container sees
+        warmTime, warmCached = warmExport(module, example, mode, cacheDir)
+
+        assert warmCached and not coldCached
+        print(f'  {mode:8s} {name:13s}: cold {coldTime*1e3:9.1f}ms, warm {warmTime*1e3:9.1f}ms')
+
+
+def benchPrecision(policies=tuple(signals.precision.POLICIES.keys()), knotCount:int=64, batch:int=16):
+  print(f'Precision policies, KnotEntangle with {knotCount} knots, batch {batch}')
+
+  # Everything is compared against the same weights pushed through in double precision
+  reference = signals.PrecisionPolicy(storage=torch.float64, compute=torch.float64, fft=torch.float64)
+  with signals.usePolicy(reference):
+    entangle = buildEntangle(knotCount, dtype=torch.float64)
+    x = torch.rand(batch, knotCount, dtype=torch.float64)
+    with torch.no_grad():
+      expected = entangle(x)
+
+  for name in policies:
+    with signals.usePolicy(name) as policy:
+      module = signals.precision.applyPolicy(copy.deepcopy(entangle))
+      try:
+        with signals.precision.autocast():
+          forwardTime = timeCall(lambda: module(x), repeats=10)
+          with torch.no_grad():
+            result = module(x)
+      except RuntimeError as err:
+        print(f'  {name:5s}: unsupported here ({str(err).splitlines()[0]})')
+        continue
+
+    drift = (torch.norm(result.to(torch.float64) - expected) / torch.norm(expected)).item()
+    print(f'  {name:5s}: {batch/forwardTime:10.1f} samples/s, relative drift {drift:.3e} '
+      + f'(storage {policy.storage}, compute {policy.compute}, fft {policy.fft})')
+
+
+def profileEntangle(traceDir:str, knotCount:int=16, batch:int=1, calls:int=30, dtype=torch.float32):
+  """Profiles the small per-frame KnotEntangle calls of a perception to brain loop, once
+  transforming through torch.fft and once through the cached DFT bases. Both runs are
+  written as Chrome traces into traceDir.
+  """
+  print(f'Profiling KnotEntangle with {knotCount} knots, batch {batch}, {calls} calls')
+  from torch.profiler import profile, ProfilerActivity
+
+  os.makedirs(traceDir, exist_ok=True)
+  x = torch.rand(batch, knotCount, dtype=dtype)
+  for cacheBasis in (False, True):
+    entangle = buildEntangle(knotCount, dtype=dtype, cacheBasis=cacheBasis)
+    perCall = timeCall(lambda: entangle(x), repeats=calls)
+
+    with torch.no_grad(), profile(activities=[ProfilerActivity.CPU]) as prof:
+      for _ in range(calls):
+        entangle(x)
+    tracePath = os.path.join(traceDir, f'entangle-{"basis" if cacheBasis else "fft"}.json')
+    prof.export_chrome_trace(tracePath)
+
+    print(f'  cacheBasis={cacheBasis}: {perCall*1e6:9.1f}us per call, trace at {tracePath}')
+    print(prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=8))
+
+
+def checkStream(depth:int=32, knotSize:int=3, steps:int=10000, start:float=0.25, step:float=1./30):
+  """Checks that a KnotStream stays within its documented tolerance of the batch forward pass
+  over a long run, and times a streamed step against a single sample forward pass.
+  """
+  print(f'KnotStream vs forward, depth {depth}, size {knotSize}, {steps} steps')
+  knot = signals.Knot(knotSize=knotSize, knotDepth=depth)
+  with torch.no_grad():
+    for param in knot.parameters():
+      param.uniform_(-4., 4.)
+
+  stream = signals.KnotStream(knot, start=start, step=step)
+  with torch.no_grad():
+    streamed = stream.steps(steps)
+    positions = start + (torch.arange(1, steps + 1, dtype=torch.float64) * step)
+    with signals.usePolicy(signals.PrecisionPolicy(storage=torch.float64, compute=torch.float64, fft=torch.float64)):
+      expected = knot(positions)
+
+  scale = torch.sum(torch.abs(knot.regWeights.detach().to(torch.float64)), dim=0)
+  error = torch.max(torch.abs(streamed.to(torch.float64) - expected) / scale).item()
+  assert error <= signals.stream.STREAM_TOLERANCE, f'stream drifted {error:.3e} off of forward'
+
+  single = torch.tensor([start], dtype=torch.float32)
+  streamTime = timeCall(stream.step, repeats=1000)
+  forwardTime = timeCall(lambda: knot(single), repeats=1000)
+  print(f'  max relative error {error:.3e} (tolerance {signals.stream.STREAM_TOLERANCE:.0e}), '
+    + f'step {streamTime*1e6:7.1f}us, forward {forwardTime*1e6:7.1f}us')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Microbenchmarks for the knot signal stack.')
+  parser.add_argument('--threads', type=int, default=1, help='Torch intra-op CPU threads.')
+  parser.add_argument('--traces', type=str, default=None, help='Write profiler traces of KnotEntangle here.')
+  args = parser.parse_args()
+
+  torch.set_num_threads(args.threads)
+  benchKnot()
+  benchEntangle()
+  benchSparseEntangle()
+  benchConv()
+  benchExport()
+  benchPrecision()
+  checkStream()
+  if args.traces is not None:
+    profileEntangle(args.traces)
@@ -1 +1,5 @@
-from .knot import irregularGuass
\ No newline at end of file
+from .knot import irregularGauss, LinearGauss, Lissajous, Knot, KnotEntangle, KnotConv
+from . import precision
+from .precision import PrecisionPolicy, getPolicy, setPolicy, usePolicy
+from .stream import LissajousStream, KnotStream, streamFor
+from .export import exportKey, exportModule
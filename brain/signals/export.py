@@ -0,0 +1,135 @@
+import torch
+import torch.nn as nn
+
+import contextlib
+import hashlib
+import os
+from typing import Tuple
+
+from . import precision
+
+EXPORT_MODES = ('trace', 'compile')
+DEFAULT_CACHE_DIR = os.environ.get('MIME_EXPORT_CACHE',
+  os.path.join(os.path.expanduser('~'), '.cache', 'mime', 'signals'))
+
+
+def exportKey(module: nn.Module, example: torch.Tensor, mode: str = 'trace') -> str:
+  """Builds the cache key of an exported module. The key covers the torch version, the
+  precision policy, the module configuration (through its repr), the example input layout and every value held
+  in the state of the module, so a cached artifact is never reused with stale weights.
+
+  Args:
+      module (nn.Module): The module to be exported.
+      example (torch.Tensor): The example input the module is exported with.
+      mode (str, optional): The export mode, one of EXPORT_MODES. Defaults to 'trace'.
+
+  Returns:
+      str: A hex digest naming the exported artifact.
+  """
+  digest = hashlib.sha256()
+  digest.update(f'{torch.__version__}|{mode}|{precision.getPolicy()}|{type(module).__name__}|{repr(module)}'.encode('utf8'))
+  digest.update(f'|{tuple(example.size())}|{example.dtype}'.encode('utf8'))
+
+  for name, value in module.state_dict().items():
+    value = value.detach().cpu().contiguous()
+    digest.update(f'|{name}|{tuple(value.size())}|{value.dtype}|'.encode('utf8'))
+    if value.numel() > 0:
+      digest.update(value.reshape(-1).view(torch.uint8).numpy().tobytes())
+
+  return digest.hexdigest()
+
+
+def exportModule(module: nn.Module, example: torch.Tensor, mode: str = 'trace',
+  cacheDir: str = DEFAULT_CACHE_DIR) -> Tuple[nn.Module, bool]:
+  """Exports a module of the signal stack (Knot, KnotEntangle or KnotConv) into a frozen
+  inference artifact, reusing an artifact cached on disk from a previous run when one
+  matches the module.
+
+  In 'trace' mode the module is traced with the example input, frozen, and saved as a
+  TorchScript archive. The traced graph is specialized to the shape of the example input,
+  which is part of the cache key. In 'compile' mode the module goes through torch.compile
+  with the inductor cache pointed into cacheDir while it compiles (see inductorCache()),
+  so that later runs reuse the compiled kernels. That mode needs torch 2.0 or newer.
+
+  Args:
+      module (nn.Module): The module to export, it is switched into eval mode.
+      example (torch.Tensor): An example input for the module.
+      mode (str, optional): The export mode, one of EXPORT_MODES. Defaults to 'trace'.
+      cacheDir (str, optional): The directory holding the exported artifacts. Defaults to DEFAULT_CACHE_DIR.
+
+  Returns:
+      Tuple[nn.Module, bool]: The exported module, and whether or not it came out of the cache.
+  """
+  assert mode in EXPORT_MODES
+  os.makedirs(cacheDir, exist_ok=True)
+  module = module.eval()
+
+  if mode == 'compile':
+    return compileModule(module, example, cacheDir)
+
+  # Warm start
+  path = os.path.join(cacheDir, exportKey(module, example, mode) + '.pt')
+  if os.path.exists(path):
+    return torch.jit.load(path, map_location=example.device), True
+
+  # Cold start, write to the side first so concurrent containers never load a partial file
+  with torch.no_grad():
+    traced = torch.jit.trace(module, example, check_trace=False)
+  frozen = torch.jit.freeze(traced)
+  partPath = f'{path}.{os.getpid()}.part'
+  torch.jit.save(frozen, partPath)
+  os.replace(partPath, path)
+
+  return frozen, False
+
+
+@contextlib.contextmanager
+def inductorCache(inductorDir: str):
+  """Points the inductor caches into inductorDir and turns its FX graph cache on, only while
+  the context is open. Inductor reads both whenever it looks up or writes a compiled graph,
+  so a compiled module that recompiles later on (on a new input shape) does so against the
+  caches of the process instead.
+  """
+  import torch._inductor.config as inductorConfig
+
+  previous = os.environ.get('TORCHINDUCTOR_CACHE_DIR')
+  os.environ['TORCHINDUCTOR_CACHE_DIR'] = inductorDir
+  try:
+    with inductorConfig.patch(fx_graph_cache=True):
+      yield
+  finally:
+    if previous is None:
+      del os.environ['TORCHINDUCTOR_CACHE_DIR']
+    else:
+      os.environ['TORCHINDUCTOR_CACHE_DIR'] = previous
+
+
+def compileModule(module: nn.Module, example: torch.Tensor, cacheDir: str) -> Tuple[nn.Module, bool]:
+  """Runs a module through torch.compile with the on disk caches living in cacheDir. The
+  example input is pushed through once so that the compilation happens here rather than
+  on the first real call.
+
+  Args:
+      module (nn.Module): The module to compile.
+      example (torch.Tensor): An example input for the module.
+      cacheDir (str): The directory holding the compiled artifacts.
+
+  Returns:
+      Tuple[nn.Module, bool]: The compiled module, and whether or not every graph of it was
+        loaded from the FX graph cache in cacheDir rather than compiled.
+  """
+  assert hasattr(torch, 'compile'), 'torch.compile needs torch 2.0 or newer, use the trace mode'
+  from torch._dynamo.utils import counters
+
+  # Inductor counts its own cache lookups, so the hits and misses of this compile tell whether
+  # the artifacts in the directory were actually used
+  hits = counters['inductor']['fxgraph_cache_hit']
+  misses = counters['inductor']['fxgraph_cache_miss']
+
+  compiled = torch.compile(module)
+  with inductorCache(os.path.join(cacheDir, 'inductor')), torch.no_grad():
+    compiled(example)
+
+  hits = counters['inductor']['fxgraph_cache_hit'] - hits
+  misses = counters['inductor']['fxgraph_cache_miss'] - misses
+  return compiled, hits > 0 and misses == 0
@@ -2,14 +2,25 @@ import torch
 from torch._C import dtype
 from torch.functional import Tensor
 import torch.nn as nn
+import torch.fft
 
 #https://pytorch.org/docs/stable/jit_language_reference.html
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import math
 
 from torch.nn.modules.linear import Identity
 
+from . import precision
+
 DEFAULT_FFT_SAMPLES = 128
+DEFAULT_SKETCH_BINS = 4
+SKETCH_BLOCK_SIZE = 256
+SKETCH_PROJECTIONS = 4
+SKETCH_WINDOW = 8
+SKETCH_SEED = 0x5eed
+DEFAULT_CONV_CHUNK = 1 << 16
+CONV_TABLE_LIMIT = 4096
+DFT_BASIS_LIMIT = 256
 
 
 @torch.jit.script
@@ -28,9 +39,8 @@ def irregularGauss(x: torch.Tensor, mean: torch.Tensor, lowStd: torch.Tensor, hi
   Returns:
       torch.Tensor: A sampled set of values with the same size as the input.
   """
-  # Grab the correct side of the curve
-  if x <= mean: std = lowStd
-  else: std = highStd
+  # Grab the correct side of the curve, elementwise
+  std = torch.where(x <= mean, lowStd, highStd)
 
   # Never hits 0 or inf., easy to take derivative
   std = torch.exp(std)
@@ -54,12 +64,13 @@ class LinearGauss(nn.Module):
     super(LinearGauss, self).__init__()
 
     self.size = size
-    self.mean = nn.Parameter(torch.zeros(size), dtype=torch.float16)
-    self.lowStd = nn.Parameter(torch.zeros(size), dtype=torch.float16)
-    self.highStd = nn.Parameter(torch.zeros(size), dtype=torch.float16)
+    self.mean = nn.Parameter(torch.zeros(size, dtype=precision.storageDtype()))
+    self.lowStd = nn.Parameter(torch.zeros(size, dtype=precision.storageDtype()))
+    self.highStd = nn.Parameter(torch.zeros(size, dtype=precision.storageDtype()))
 
   def forward(self, x: torch.Tensor):
-    return irregularGauss(x=x, mean=self.mean, lowStd=self.lowStd, highStd=self.highStd)
+    return irregularGauss(x=precision.toCompute(x), mean=precision.toCompute(self.mean),
+      lowStd=precision.toCompute(self.lowStd), highStd=precision.toCompute(self.highStd))
 
 
 class Lissajous(nn.Module):
@@ -76,8 +87,8 @@ class Lissajous(nn.Module):
     super(Lissajous, self).__init__()
 
     self.size = size
-    self.frequency = nn.Parameter(torch.zeros([1, size]), dtype=torch.float16)
-    self.phase = nn.Parameter(torch.zeros([1, size]), dtype=torch.float16)
+    self.frequency = nn.Parameter(torch.zeros([1, size], dtype=precision.storageDtype()))
+    self.phase = nn.Parameter(torch.zeros([1, size], dtype=precision.storageDtype()))
 
   def forward(self, x: torch.Tensor) -> torch.Tensor:
     """Gets a sample or batch of samples from the contained curve.
@@ -89,11 +100,11 @@ class Lissajous(nn.Module):
         torch.Tensor: The evaluted samples.
     """
     # Add another dimension to do the batch of encodes
-    xFat = torch.unsqueeze(x, -1)
-    xOnes = torch.ones_like(xFat)
+    xFat = torch.unsqueeze(precision.toCompute(x), -1)
 
-    # Activate inside of the curve's embedding space
-    cosinePosition = (xFat @ self.frequency) + (xOnes @ self.phase)
+    # Activate inside of the curve's embedding space, the [1, size] parameters
+    # broadcast across the new dimension directly
+    cosinePosition = (xFat * precision.toCompute(self.frequency)) + precision.toCompute(self.phase)
     evaluated = torch.cos(cosinePosition)
 
     return evaluated
@@ -105,57 +116,79 @@ class Knot(nn.Module):
     stored in the knot is stored in the form of a multidimensional fourier series,
     which allows the knot to have its parameters later entangled, modulated, and
     transformed through conventional methods.
+
+  The curves are not held as seperate Lissajous modules, but as stacked [depth, size]
+    frequency and phase tensors so that the whole knot evaluates in one broadcasted
+    cosine and weighted sum.
   """
-  def ___init__Helper(self, lissajousCurves: nn.ModuleList):
-    """Does the actual __init__ work for super() call reasons.
+  def __init__(self, knotSize: int, knotDepth: int):
+    """Constructs a Knot for later use generating all weights and storing internally.
 
     Args:
-        lissajousCurves (nn.ModuleList): The curves to add together to create the
-          knot.
+        knotSize (int): The dimensionality of the contained lissajous-like curves.
+        knotDepth (int): The amount of lissajous-like curves to be added together.
     """
-    # Set up the curves for the function
-    self.curves = lissajousCurves
-    self.curveSize = self.curves[0].size
+    super(Knot, self).__init__()
 
-    # Size assertion
-    for curve in self.curves:
-      assert curve.size == self.curveSize
+    self.curveSize = int(knotSize)
+    self.knotDepth = int(knotDepth)
+    paramSize = (self.knotDepth, self.curveSize)
 
-    paramSize = (len(self.curves), self.curveSize)
-    self.regWeights = nn.Parameter(torch.ones(paramSize), dtype=torch.float16)
-    self.knotRadii = nn.Parameter(torch.zeros(self.curveSize), dtype=torch.float16)
+    # Stacked Lissajous parameters, one row per curve
+    self.frequency = nn.Parameter(torch.zeros(paramSize, dtype=precision.storageDtype()))
+    self.phase = nn.Parameter(torch.zeros(paramSize, dtype=precision.storageDtype()))
 
-  def __init__(self, lissajousCurves: nn.ModuleList):
-    """Constructs a Knot for later use from previously constructed Lissajous curves.
+    # Curve weighting and offset
+    self.regWeights = nn.Parameter(torch.ones(paramSize, dtype=precision.storageDtype()))
+    self.knotRadii = nn.Parameter(torch.zeros(self.curveSize, dtype=precision.storageDtype()))
+
+  @classmethod
+  def fromCurves(cls, lissajousCurves: nn.ModuleList):
+    """Constructs a Knot from previously constructed Lissajous curves, copying their
+    parameters into the stacked representation.
 
     Args:
         lissajousCurves (nn.ModuleList): The Lissajous curves to add together to make the knot.
+
+    Returns:
+        Knot: The knot holding the stacked parameters of the provided curves.
     """
-    super(Knot, self).__init__()
+    curveSize = lissajousCurves[0].size
 
-    # Call helper init function
-    self.___init___Helper(lissajousCurves=lissajousCurves)    
+    # Size assertion
+    for curve in lissajousCurves:
+      assert curve.size == curveSize
 
-  def __init__(self, knotSize: int, knotDepth: int):
-    """Constructs a Knot for later use generating all weights and storing internally.
+    knot = cls(knotSize=curveSize, knotDepth=len(lissajousCurves))
+    with torch.no_grad():
+      knot.frequency.copy_(torch.cat([curve.frequency for curve in lissajousCurves], dim=0))
+      knot.phase.copy_(torch.cat([curve.phase for curve in lissajousCurves], dim=0))
 
-    Args:
-        knotSize (int): The dimensionality of the contained lissajous-like curves.
-        knotDepth (int): The amount of lissajous-like curves to be added together.
+    return knot
+
+  def curves(self) -> nn.ModuleList:
+    """Unpacks the stacked parameters back into seperate Lissajous modules.
+
+    Returns:
+        nn.ModuleList: A copy of the curves held in the knot, in order of depth.
     """
-    super(Knot, self).__init__()
+    result = nn.ModuleList([Lissajous(size=self.curveSize) for _ in range(self.knotDepth)])
+    with torch.no_grad():
+      for idx, curve in enumerate(result):
+        curve.frequency.copy_(self.frequency[idx:idx+1])
+        curve.phase.copy_(self.phase[idx:idx+1])
+
+    return result
 
-    # Construct and call helper function
-    curves = nn.ModuleList([Lissajous(size=knotSize) for _ in range(knotDepth)])
-    self.___init___Helper(lissajousCurves=curves)
+  def extra_repr(self) -> str:
+    return f'knotSize={self.curveSize}, knotDepth={self.knotDepth}'
 
   # TODO: Add a method to add more curves, it would be cool to have a hyperparameter
   #   that makes the neural network hold more data in almost the same space
 
-  @torch.jit.script
   def forward(self, x: torch.Tensor) -> torch.Tensor:
     """Pushed forward the same way as the Lissajous module. This is just an array
-    of Lissajous modules summed together in a weighted way.
+    of Lissajous curves summed together in a weighted way.
 
     Args:
         x (torch.Tensor): The points to sample on the curves.
@@ -165,18 +198,66 @@ class Knot(nn.Module):
           activated upon it. There will be one extra dimension that is the same in size
           as the dimensions of the curve.
     """
-    # Create the expanded dimensions required in the output tensor
-    outputSize = torch.Size(list(x.size()).append(self.curveSize))
-    result = torch.Tensor(torch.zeros(outputSize), dtype=torch.float16)
+    # Add the [depth, size] dimensions to evaluate every curve at once
+    xFat = precision.toCompute(x).unsqueeze(-1).unsqueeze(-1)
+    curves = torch.cos((xFat * precision.toCompute(self.frequency)) + precision.toCompute(self.phase))
+
+    # Weight and add all of the curves together
+    return torch.sum(precision.toCompute(self.regWeights) * curves, dim=-2) + precision.toCompute(self.knotRadii)
+
+
+def stackKnots(knots: nn.ModuleList) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+  """Stacks the parameters of equally sized knots so that they can be evaluated together.
+
+  Args:
+      knots (nn.ModuleList): The knots to stack, all sharing the same size and depth.
+
+  Returns:
+      Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]: The frequencies,
+        phases and curve weights as [count, depth, size] tensors followed by the
+        knot radii as a [count, size] tensor, all in the compute dtype.
+  """
+  frequency = precision.toCompute(torch.stack([knot.frequency for knot in knots]))
+  phase = precision.toCompute(torch.stack([knot.phase for knot in knots]))
+  regWeights = precision.toCompute(torch.stack([knot.regWeights for knot in knots]))
+  knotRadii = precision.toCompute(torch.stack([knot.knotRadii for knot in knots]))
+
+  return frequency, phase, regWeights, knotRadii
+
+
+def evaluateStack(stack: Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor], x: torch.Tensor) -> torch.Tensor:
+  """Evaluates previously stacked knot parameters, each knot on its own sampling locations.
+
+  Args:
+      stack (Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]): The knot
+        parameters as returned by stackKnots().
+      x (torch.Tensor): The sampling locations with a [..., count, samples] shape, where
+        count is the amount of knots.
+
+  Returns:
+      torch.Tensor: The evaluated knots with a [..., count, samples, size] shape.
+  """
+  frequency, phase, regWeights, knotRadii = stack
+
+  # Leave room for the samples in the parameters and the [depth, size] in the input
+  xFat = precision.toCompute(x).unsqueeze(-1).unsqueeze(-1)
+  curves = torch.cos((xFat * frequency.unsqueeze(-3)) + phase.unsqueeze(-3))
+
+  return torch.sum(regWeights.unsqueeze(-3) * curves, dim=-2) + knotRadii.unsqueeze(-2)
+
+
+def evaluateKnots(knots: nn.ModuleList, x: torch.Tensor) -> torch.Tensor:
+  """Evaluates a set of knots, each on its own sampling locations, in one batched operation.
+
+  Args:
+      knots (nn.ModuleList): The knots to evaluate, all sharing the same size and depth.
+      x (torch.Tensor): The sampling locations with a [..., count, samples] shape, where
+        count is the amount of knots.
 
-    # Add all of the curves together
-    for idx, lissajous in enumerate(self.curves):
-      # Each lissajous curve-like structure has different weights, and therefore 
-      curve = lissajous.forward(x)
-      curve = self.regWeights[idx] * curve
-      result = result + curve
-    
-    return result + self.knotRadii
+  Returns:
+      torch.Tensor: The evaluated knots with a [..., count, samples, size] shape.
+  """
+  return evaluateStack(stackKnots(knots), x)
 
 
 # TODO: Continue adding size safety from [ HERE MARK SAFETY SIZES ]
@@ -185,7 +266,8 @@ class Knot(nn.Module):
 # Entangle a whole bunch of knots into one singular signal
 class KnotEntangle(nn.Module):
   def __init__(self, knots:nn.ModuleList, samples:int = DEFAULT_FFT_SAMPLES, lowerSmear:float = 1./8,
-    upperSmear:float = 1./8, attn:bool = True, linearPolarization:bool = False, shareSmears:bool = False):
+    upperSmear:float = 1./8, attn:bool = True, linearPolarization:bool = False, shareSmears:bool = False,
+    topK:int = None, sketchBins:int = DEFAULT_SKETCH_BINS, cacheBasis:bool = True):
     """Generates the complex required to entangle two seperate knotted signals together.
 
     Args:
@@ -196,27 +278,42 @@ class KnotEntangle(nn.Module):
         attn (bool, optional): Try to make the input values more represented in the output signal. Defaults to True.
         linearPolarization (bool, optional): Embed a the entangled values with an elementwise knowledgegraph. Defaults to False.
         shareSmears (bool, optional): Share the smear windows between the knots. Defaults to False.
+        topK (int, optional): If set, each knot only entangles with this many of its most correlated
+          partners instead of every other knot. Defaults to None.
+        sketchBins (int, optional): The amount of low frequency bins used to find the partners of
+          each knot when topK is set. Defaults to DEFAULT_SKETCH_BINS.
+        cacheBasis (bool, optional): Hold the DFT bases of the sample count and transform through
+          them rather than planning an FFT per call, used up to DFT_BASIS_LIMIT samples. Defaults to True.
     """
-    super(KnotEntangle, self).__init()
+    super(KnotEntangle, self).__init__()
 
-    # Set up the knots and assert size constraints
+    # Set up the knots and assert size constraints, the depth must match as well
+    # so that all of the knots can be evaluated as one stack
     self.knots = knots
-    tCurveSize = self.knots[0].curveSize
+    self.curveSize = self.knots[0].curveSize
+    tKnotDepth = self.knots[0].knotDepth
     for knot in self.knots:
-      assert knot.curveSize == tCurveSize
+      assert knot.curveSize == self.curveSize
+      assert knot.knotDepth == tKnotDepth
 
-    # Define FFT and IFFT lead up and execution
+    # Define FFT and IFFT lead up and execution, setting the samples builds the grids
+    self.cacheBasis = cacheBasis
     self.samples = samples
     if shareSmears:
       lowerProto = lowerSmear * torch.ones(len(self.knots))
       upperProto = upperSmear * torch.ones(len(self.knots))
-      self.smearWindow = nn.Parameter(torch.Tensor([lowerProto, upperProto]), dtype=torch.float16)
+      self.smearWindow = nn.Parameter(torch.stack([lowerProto, upperProto]).to(precision.storageDtype()))
     else:
-      self.smearWindow = nn.Parameter(torch.Tensor([lowerSmear, upperSmear]), dtype=torch.float16)
+      self.smearWindow = nn.Parameter(torch.tensor([lowerSmear, upperSmear], dtype=precision.storageDtype()))
 
-    # Provide signal entanglement weighting
-    self.entangleActivation = [LinearGauss(1.) for _ in range(self.knots)]
-    self.entanglePolarization = nn.Parameter(torch.zeros(len(self.knots)), dtype=torch.float16)
+    # Sparse entanglement setup
+    self.topK = topK
+    self.sketchBinLimit = sketchBins
+    self.buildSketch()
+
+    # Provide signal entanglement weighting, one activation per target knot
+    self.entangleActivation = LinearGauss(len(self.knots))
+    self.entanglePolarization = nn.Parameter(torch.zeros(len(self.knots), dtype=precision.storageDtype()))
 
     # If defined, this turns the entanglement function into something that is
     # initially, essentially, a dot product. This knowledge graph on the entanglemeant structure is
@@ -224,14 +321,130 @@ class KnotEntangle(nn.Module):
     # local entangled knot).
     self.linPolarization = linearPolarization
     if self.linPolarization:
-      self.polKnowledge = nn.Parameter([torch.eye(self.samples) for _ in self.knots], dtype=torch.complex32)
+      polProto = torch.eye(self.frequencies).repeat(len(self.knots), 1, 1)
+      self.polKnowledge = nn.Parameter(polProto.to(precision.complexDtype(precision.storageDtype())))
 
     # Try to pay attention to the input values more than anything, adding some light weighting
     self.attn = attn
     if self.attn:
-      self.attnWeight = nn.Parameter(torch.ones(len(self.knots)), dtype=torch.float16)
-      self.attnBias = nn.Parameter(torch.zeros(len(self.knots)), dtype=torch.float16)
-      self.attnScope = nn.Parameter(torch.ones(len(self.knots)), dtype=torch.float16)
+      self.attnWeight = nn.Parameter(torch.ones(len(self.knots), dtype=precision.storageDtype()))
+      self.attnBias = nn.Parameter(torch.zeros(len(self.knots), dtype=precision.storageDtype()))
+      self.attnScope = nn.Parameter(torch.ones(len(self.knots), dtype=precision.storageDtype()))
+
+  @property
+  def samples(self) -> int:
+    """The amount of FFT samples taken of each knot.
+    """
+    return self.__samples
+
+  @samples.setter
+  def samples(self, samples: int):
+    frequencies = getattr(self, 'frequencies', None)
+    self.__samples = int(samples)
+    self.frequencies = (self.__samples // 2) + 1
+    self.buildGrids()
+
+    # Once constructed, everything sized by the frequency bins follows the new count
+    if frequencies is not None and frequencies != self.frequencies:
+      self.buildSketch()
+      if self.linPolarization:
+        self.resizePolarization(frequencies)
+
+  def gridLayout(self) -> Tuple[torch.device, torch.dtype]:
+    # The device and dtype the module was moved to, or where a new module starts out
+    sampleGrid = self._buffers.get('sampleGrid')
+    if sampleGrid is None:
+      return torch.device('cpu'), torch.float32
+    return sampleGrid.device, sampleGrid.dtype
+
+  def buildGrids(self):
+    """Builds the sampling grid and, if cached, the DFT bases for the current sample count.
+    Nothing in here depends on the input or the smear window, those only enter as affine
+    terms on top of the grid in forward(), which keeps their gradient path intact.
+    """
+    device, dtype = self.gridLayout()
+
+    # Normalized sampling locations in (0, 1], shared by the smears and the attention
+    sampleGrid = torch.arange(1, self.samples + 1, dtype=torch.float64) / self.samples
+    self.register_buffer('sampleGrid', sampleGrid.to(device=device, dtype=dtype))
+
+    # The real DFT as a pair of [samples, frequencies] cosine and sine bases, the inverse
+    # weighs every bin twice for its missing conjugate except for the DC and Nyquist bins
+    self.useBasis = self.cacheBasis and self.samples <= DFT_BASIS_LIMIT
+    if not self.useBasis:
+      self.register_buffer('dftCos', None, persistent=False)
+      self.register_buffer('dftSin', None, persistent=False)
+      self.register_buffer('idftWeights', None, persistent=False)
+      return
+
+    angles = (2. * math.pi / self.samples) * torch.outer(torch.arange(self.samples, dtype=torch.float64),
+      torch.arange(self.frequencies, dtype=torch.float64))
+    idftWeights = 2. * torch.ones(self.frequencies, dtype=torch.float64)
+    idftWeights[0] = 1.
+    if self.samples % 2 == 0:
+      idftWeights[-1] = 1.
+    self.register_buffer('dftCos', torch.cos(angles).to(device=device, dtype=dtype), persistent=False)
+    self.register_buffer('dftSin', torch.sin(angles).to(device=device, dtype=dtype), persistent=False)
+    self.register_buffer('idftWeights', (idftWeights / self.samples).to(device=device, dtype=dtype), persistent=False)
+
+  def buildSketch(self):
+    """Sizes the sketch the sparse mode finds partners with to the current frequency bins.
+    The random projections the partner search sorts the sketches along are seeded, so
+    that the partners of a module are reproducible.
+    """
+    device, dtype = self.gridLayout()
+    self.sketchBins = min(self.sketchBinLimit, self.frequencies)
+    generator = torch.Generator().manual_seed(SKETCH_SEED)
+    sketchProjections = torch.randn(2 * self.sketchBins * self.curveSize + 1, SKETCH_PROJECTIONS,
+      generator=generator, dtype=torch.float64)
+    self.register_buffer('sketchProjections', sketchProjections.to(device=device, dtype=dtype), persistent=False)
+
+  def resizePolarization(self, frequencies: int):
+    """Resizes the polarization knowledge graph from the provided amount of frequency bins to
+    the current one, keeping what was learned between the bins both sizes share and starting
+    any new bin off as the identity. This replaces the parameter, so an optimizer holding
+    the old one has to be rebuilt.
+
+    Args:
+        frequencies (int): The amount of frequency bins the knowledge graph was built for.
+    """
+    polKnowledge = self.polKnowledge.detach()
+    kept = min(frequencies, self.frequencies)
+    polProto = torch.eye(self.frequencies, device=polKnowledge.device).repeat(len(self.knots), 1, 1)
+    polProto = polProto.to(polKnowledge.dtype)
+    polProto[:, :kept, :kept] = polKnowledge[:, :kept, :kept]
+    self.polKnowledge = nn.Parameter(polProto, requires_grad=self.polKnowledge.requires_grad)
+
+  def rfft(self, x: torch.Tensor) -> torch.Tensor:
+    """Takes the real FFT of the samples dimension (-2) of a real signal.
+
+    Args:
+        x (torch.Tensor): The signal with a [..., samples, channels] shape.
+
+    Returns:
+        torch.Tensor: The spectrum with a [..., frequencies, channels] shape.
+    """
+    if not self.useBasis:
+      return torch.fft.rfft(x, n=self.samples, dim=-2)
+
+    dftCos = self.dftCos.to(x.dtype).t()
+    dftSin = self.dftSin.to(x.dtype).t()
+    return torch.complex(dftCos @ x, -(dftSin @ x))
+
+  def irfft(self, x: torch.Tensor) -> torch.Tensor:
+    """Takes the inverse real FFT of the frequency dimension (-2) of a spectrum.
+
+    Args:
+        x (torch.Tensor): The spectrum with a [..., frequencies, channels] shape.
+
+    Returns:
+        torch.Tensor: The real signal with a [..., samples, channels] shape.
+    """
+    if not self.useBasis:
+      return torch.fft.irfft(x, n=self.samples, dim=-2)
+
+    weights = self.idftWeights.to(x.real.dtype).unsqueeze(-1)
+    return (self.dftCos.to(x.real.dtype) @ (weights * x.real)) - (self.dftSin.to(x.real.dtype) @ (weights * x.imag))
 
   def knotCount(self) -> int:
     """Gets the amount of knots locked into the entanglement structure.
@@ -241,70 +454,237 @@ class KnotEntangle(nn.Module):
     """
     return len(self.knots)
 
+  def extra_repr(self) -> str:
+    return f'samples={self.samples}, attn={self.attn}, linearPolarization={self.linPolarization}, ' \
+      + f'topK={self.topK}, sketchBins={self.sketchBins}, cacheBasis={self.cacheBasis}'
+
+  def entangle(self, knotSignals: torch.Tensor) -> torch.Tensor:
+    """Entangles every knot signal with every other knot signal.
+
+    The pairwise work is done on the stacked spectra as a handful of batched products.
+    As the inverse FFT is linear, the mixing happens entirely in the frequency domain
+    and nothing needs to come back to the time domain per pair.
+
+    Args:
+        knotSignals (torch.Tensor): The rfft of the knot smears with a
+          [..., knots, frequencies, curveSize] shape.
+
+    Returns:
+        torch.Tensor: The entangled spectrum of each knot, in the same shape as the input.
+    """
+    knotCount = self.knotCount()
+
+    # Check signal correlation. The mean of the circular cross-correlation of two
+    # signals is the product of their zero frequency bins over the sample count, so
+    # the full correlation matrix is one small product instead of an irfft per pair.
+    dcBins = knotSignals[..., 0, :].real
+    correlation = (dcBins @ dcBins.transpose(-1, -2)) / (self.samples * self.curveSize)
+
+    # Entangle signals
+    # Note that the weighted activations are tied to each target knot (the last dim)
+    offDiagonal = 1. - torch.eye(knotCount, dtype=correlation.dtype, device=correlation.device)
+    entangleMix = self.entangleActivation.forward(correlation) * offDiagonal
+    classicalMix = (1. - entangleMix) * offDiagonal
+
+    # Basing the entangling process of off the use of a tensor product mixed
+    # with a sum. To collapse each entangled state, the view from each particle is
+    # assessed and the more important one is superimposed into the final signal.
+    polarization = precision.toCompute(self.entanglePolarization)
+    mixCos = (entangleMix * torch.cos(polarization)).to(knotSignals.dtype)
+    mixSin = (entangleMix * torch.sin(polarization)).to(knotSignals.dtype)
+    if self.linPolarization:
+      # Superpositions viewed from the entangling knot need every knot pushed through
+      # every knowledge graph, the entangled knot's view only needs one push per knot
+      polKnowledge = self.polKnowledge.to(knotSignals.dtype)
+      polarized = torch.einsum('jfg,...igc->...jifc', polKnowledge, knotSignals)
+      collapseFirst = torch.einsum('...ij,...jfc,...jifc->...ifc', mixCos, knotSignals, polarized)
+      collapseSecond = knotSignals * torch.einsum('...ij,...jgc->...igc', mixSin,
+        torch.einsum('jfg,...jfc->...jgc', polKnowledge, knotSignals))
+      entangledSignals = collapseFirst + collapseSecond
+    else:
+      # Without a knowledge graph the superposition is elementwise, so both collapsed
+      # views are the same and only need one weighted sum across the knots
+      entangledSignals = knotSignals * torch.einsum('...ij,...jfc->...ifc', mixCos + mixSin, knotSignals)
+
+    # Mix the signals together and ensure normalization for what is entangled.
+    classicalWeight = torch.sum(classicalMix, dim=-1).to(knotSignals.dtype)
+    return entangledSignals + (classicalWeight.unsqueeze(-1).unsqueeze(-1) * knotSignals)
+
+  def findPartners(self, knotSignals: torch.Tensor, partnerCount: int) -> torch.Tensor:
+    """Finds the most correlated partners of each knot from a sketch of its lowest
+    frequency bins, the affinity of two knots being the absolute dot product of their
+    sketches.
+
+    Up to SKETCH_BLOCK_SIZE knots every pair is scored exactly. Past that only a fixed
+    amount of candidates per knot are scored, found by sorting the sketches along a few
+    random projections (see searchPartners()), which keeps the search O(K log K) in time
+    and O(K * k) in memory rather than quadratic.
+
+    Args:
+        knotSignals (torch.Tensor): The rfft of the knot smears with a
+          [..., knots, frequencies, curveSize] shape.
+        partnerCount (int): The amount of partners to find per knot.
+
+    Returns:
+        torch.Tensor: The indices of the partners of each knot with a [..., knots, partnerCount] shape.
+    """
+    # Re(a * conj(b)) summed over the sketch is a plain dot product of the stacked parts
+    sketch = knotSignals[..., :self.sketchBins, :].flatten(-2)
+    sketch = torch.cat([sketch.real, sketch.imag], dim=-1).detach()
+
+    window = max(partnerCount, SKETCH_WINDOW)
+    if self.knotCount() <= max(SKETCH_BLOCK_SIZE, 2 * window):
+      return self.scanPartners(sketch, partnerCount)
+    return self.searchPartners(sketch, partnerCount, window)
+
+  def scanPartners(self, sketch: torch.Tensor, partnerCount: int) -> torch.Tensor:
+    """Scores every pair of sketches, in blocks of knots so that only a block of rows is
+    ever held at once. Exact, but quadratic in the amount of knots.
+    """
+    knotCount = self.knotCount()
+    partners = []
+    for blockStart in range(0, knotCount, SKETCH_BLOCK_SIZE):
+      blockEnd = min(blockStart + SKETCH_BLOCK_SIZE, knotCount)
+      affinity = torch.abs(sketch[..., blockStart:blockEnd, :] @ sketch.transpose(-1, -2))
+
+      # A knot is never its own partner
+      blockRange = torch.arange(blockStart, blockEnd, device=affinity.device)
+      affinity[..., blockRange - blockStart, blockRange] = -1.
+      partners.append(torch.topk(affinity, partnerCount, dim=-1).indices)
+
+    return torch.cat(partners, dim=-2)
+
+  def searchPartners(self, sketch: torch.Tensor, partnerCount: int, window: int) -> torch.Tensor:
+    """Scores each knot against candidates only, the knots that sort next to it along a
+    few random projections of the sketches.
+
+    The affinity ignores sign, so every sketch is first folded onto one side of a random
+    hyperplane. The largest dot products are then turned into the nearest neighbours by
+    giving every sketch an extra coordinate that tops its norm up to the largest one
+    (while the knots looking for partners get a zero there), and near neighbours tend to
+    sort close together along any projection. Each projection contributes the 2 * window
+    knots sorting around a knot, so there are always at least partnerCount candidates
+    other than the knot itself.
+    """
+    knotCount = self.knotCount()
+    batchShape = sketch.shape[:-2]
+    flatSketch = sketch.reshape(-1, knotCount, sketch.size(-1))
+    projections = self.sketchProjections.to(device=sketch.device, dtype=sketch.dtype)
+
+    # Fold the signs, then top every norm up to the largest
+    side = 1. - (2. * (flatSketch @ projections[:-1, 0:1] < 0.).to(sketch.dtype))
+    folded = flatSketch * side
+    squaredNorms = torch.sum(torch.square(folded), dim=-1, keepdim=True)
+    topUp = torch.sqrt(torch.amax(squaredNorms, dim=-2, keepdim=True) - squaredNorms)
+    keys = (folded @ projections[:-1]) + (topUp * projections[-1])
+    queries = folded @ projections[:-1]
+
+    # The window of sorted knots around where each query lands, [batch, projections, knots, 2 * window]
+    sortedKeys, order = torch.sort(keys.transpose(-1, -2).contiguous(), dim=-1)
+    landing = torch.searchsorted(sortedKeys, queries.transpose(-1, -2).contiguous())
+    start = torch.clamp(landing - window, 0, knotCount - (2 * window))
+    offsets = torch.arange(2 * window, device=sketch.device)
+    positions = (start.unsqueeze(-1) + offsets).flatten(-2)
+    candidates = torch.gather(order, -1, positions).reshape(order.shape + (2 * window,))
+    candidates = candidates.permute(0, 2, 1, 3).flatten(-2)
+
+    # Score the candidates, each once and never the knot itself
+    candidates, _ = torch.sort(candidates, dim=-1)
+    batchIdx = torch.arange(flatSketch.size(0), device=sketch.device).view(-1, 1, 1)
+    affinity = torch.abs(torch.einsum('bkd,bkcd->bkc', flatSketch, flatSketch[batchIdx, candidates]))
+    repeated = torch.zeros_like(candidates, dtype=torch.bool)
+    repeated[..., 1:] = candidates[..., 1:] == candidates[..., :-1]
+    itself = candidates == torch.arange(knotCount, device=sketch.device).view(1, -1, 1)
+    affinity = affinity.masked_fill(repeated | itself, -1.)
+
+    best = torch.topk(affinity, partnerCount, dim=-1).indices
+    return torch.gather(candidates, -1, best).reshape(batchShape + (knotCount, partnerCount))
+
+  def entangleSparse(self, knotSignals: torch.Tensor) -> torch.Tensor:
+    """Entangles every knot signal with only its topK most correlated partners, keeping the
+    memory and time of the entanglement linear in the amount of knots. The pairs that are
+    left out are treated as fully classical, keeping the output on the same scale as the
+    exact entanglement.
+
+    Args:
+        knotSignals (torch.Tensor): The rfft of the knot smears with a
+          [..., knots, frequencies, curveSize] shape.
+
+    Returns:
+        torch.Tensor: The entangled spectrum of each knot, in the same shape as the input.
+    """
+    knotCount = self.knotCount()
+    partnerCount = min(self.topK, knotCount - 1)
+    partners = self.findPartners(knotSignals, partnerCount)
+
+    # Flatten out the batch to gather the partners of each knot, [batch, knots, partners, ...]
+    signalSize = knotSignals.size()
+    flatSignals = knotSignals.reshape([-1] + list(signalSize[-3:]))
+    flatPartners = partners.reshape(flatSignals.size(0), knotCount, partnerCount)
+    batchIdx = torch.arange(flatSignals.size(0), device=flatSignals.device).view(-1, 1, 1)
+    partnerSignals = flatSignals[batchIdx, flatPartners]
+
+    # Check signal correlation against the partners only
+    dcBins = flatSignals[..., 0, :].real
+    partnerBins = partnerSignals[..., 0, :].real
+    correlation = torch.sum(dcBins.unsqueeze(-2) * partnerBins, dim=-1) / (self.samples * self.curveSize)
+
+    # Entangle signals, with the activations still tied to each target knot
+    activation = self.entangleActivation
+    entangleMix = irregularGauss(x=precision.toCompute(correlation),
+      mean=precision.toCompute(activation.mean)[flatPartners],
+      lowStd=precision.toCompute(activation.lowStd)[flatPartners],
+      highStd=precision.toCompute(activation.highStd)[flatPartners])
+    classicalMix = 1. - entangleMix
+
+    polarization = precision.toCompute(self.entanglePolarization)[flatPartners]
+    mixCos = (entangleMix * torch.cos(polarization)).to(knotSignals.dtype)
+    mixSin = (entangleMix * torch.sin(polarization)).to(knotSignals.dtype)
+    if self.linPolarization:
+      # Only one partner's knowledge graphs are ever gathered at once
+      polKnowledge = self.polKnowledge.to(knotSignals.dtype)
+      collapseFirst = torch.zeros_like(flatSignals)
+      for pdx in range(partnerCount):
+        polarized = torch.einsum('bifg,bigc->bifc', polKnowledge[flatPartners[..., pdx]], flatSignals)
+        collapseFirst = collapseFirst + (mixCos[..., pdx, None, None] * partnerSignals[..., pdx, :, :] * polarized)
+      pushed = torch.einsum('jfg,...jfc->...jgc', polKnowledge, flatSignals)
+      collapseSecond = flatSignals * torch.einsum('bim,bimgc->bigc', mixSin, pushed[batchIdx, flatPartners])
+      entangledSignals = collapseFirst + collapseSecond
+    else:
+      entangledSignals = flatSignals * torch.einsum('bim,bimfc->bifc', mixCos + mixSin, partnerSignals)
+
+    # Mix the signals together, counting the pairs left out as classical
+    classicalWeight = torch.sum(classicalMix, dim=-1) + (knotCount - 1 - partnerCount)
+    entangledSignals = entangledSignals + (classicalWeight.to(knotSignals.dtype)[..., None, None] * flatSignals)
+    return entangledSignals.reshape(signalSize)
+
   def forward(self, x: torch.Tensor) -> torch.Tensor:
     # Sizing layout
     inputSize = x.size()
     assert inputSize[-1] == 1 or inputSize[-1] == self.knotCount()
     # Shouldn't need to do any squeezing as the knot propogation forces an unsqueeze
+    x = precision.toCompute(x).expand(list(inputSize[:-1]) + [self.knotCount()])
 
     # Create standardized sampling locations
-    lowerSmear = self.smearWindow[0]
-    upperSmear = self.smearWindow[1]
+    smearWindow = precision.toCompute(self.smearWindow)
+    lowerSmear = smearWindow[0]
+    upperSmear = smearWindow[1]
     xRange = (upperSmear - lowerSmear) * x
     xStep = xRange / self.samples
     xLow = ((1 - lowerSmear) * x)
-    xIter = torch.Tensor([(builder + 1) / self.samples for builder in range(self.samples)], dtype=torch.float16).detach()
-
-    # TODO: Somewhere around here
-
-    # Smear input across the constructed sampling ranges
-    knotSmears = []
-    knotSignals = []
-    for idx, knot in enumerate(self.knots):
-      smear = knot.forward((xStep[idx] * xIter) + xLow[idx])
-      knotSmears.append(smear)
-      knotSignals.append(torch.fft.rfft(smear, self.samples))
-
-    # Entangle
-    entangledSmears = []
-    for idx, signal in enumerate(knotSignals):
-      # Find the entanglements
-      smear = knotSmears[idx]
-      signal = knotSignals[idx]
-      resultSmear = torch.zeros_like(smear)
-
-      for jdx in range(len(self.knots)):
-        if idx == jdx: continue
-
-        # Check signal correlation
-        subsig = knotSignals[jdx]
-        subsigConj = torch.conj(subsig)
-        correlation = torch.mean(torch.fft.irfft(signal * subsigConj, self.samples))
-
-        # Entangle signals
-        # Note that the weighted activations are tied to each target knot
-        entangleMix = self.entangleActivation[jdx].forward(correlation)
-        classicalMix = 1 - entangleMix
-
-        # Basing the entangling process of off the use of a tensor product mixed
-        # with a sum. To collapse each entangled state, the view from each particle is
-        # assessed and the more important one is superimposed into the final signal.
-        superposition = (subsig @ torch.transpose(signal)) * self.polKnowledge
-        collapseSignal = (torch.sum(superposition), torch.sum(torch.transpose(superposition)))
-        collapseSmear = (torch.irfft(collapseSignal[0], self.samples), torch.irfft(collapseSignal[1], self.samples))
-        polarization = self.entanglePolarization[jdx]
-        entangledSmear = (torch.cos(polarization) * collapseSmear[0]) \
-          + (torch.sin(polarization) * collapseSmear[1])
-
-        # Mix the signals together and ensure normalization for what is entangled.
-        resultSmear = resultSmear + (entangleMix * entangledSmear)
-        resultSmear = resultSmear + (classicalMix * smear)
-
-      # Push to end of calculation
-      entangledSmears.append(resultSmear)
-
-    # Collapse into a single knotted time-domain signal definition
-    result = torch.sum(entangledSmears)
+    xIter = precision.toCompute(self.sampleGrid)
+
+    # Smear input across the constructed sampling ranges, all knots at once
+    samplePoints = (xStep.unsqueeze(-1) * xIter) + xLow.unsqueeze(-1)
+    knotSmears = evaluateKnots(self.knots, samplePoints)
+    knotSignals = self.rfft(precision.toFFT(knotSmears))
+
+    # Entangle, then collapse into a single knotted time-domain signal definition
+    if self.topK is None:
+      entangledSignals = self.entangle(knotSignals)
+    else:
+      entangledSignals = self.entangleSparse(knotSignals)
+    result = precision.toCompute(self.irfft(torch.sum(entangledSignals, dim=-3)))
 
     # Don't pay attention if that's how you roll
     if not self.attn:
@@ -313,39 +693,163 @@ class KnotEntangle(nn.Module):
     # Mix the signal with a gaussian curve to signify the original importance of x 
     # if obscured. The idea is to use this as a way to pay attention to a specific
     # portion of the curve.
-    allMeans = (x * self.attnWeight) + self.attnBias
-    meansMean = torch.mean(x)
-    allLows = (1. - (lowerSmear * self.attnScope)) * meansMean 
-    allHighs = (1. + (upperSmear * self.attnScope)) * meansMean
+    attnScope = precision.toCompute(self.attnScope)
+    allMeans = (x * precision.toCompute(self.attnWeight)) + precision.toCompute(self.attnBias)
+    meansMean = torch.mean(x, dim=-1, keepdim=True)
+    allLows = ((1. - (lowerSmear * attnScope)) * meansMean).unsqueeze(-1)
+    allHighs = ((1. + (upperSmear * attnScope)) * meansMean).unsqueeze(-1)
     gaussSamples = ((allHighs - allLows) * xIter) + allLows
-    gaussians = []
-    for idx in range(len(self.knots)):
-      # Pull out specific gaussian parameters
-      activeMean = allMeans[idx]
-      activeMeans = activeMean * torch.ones_like(result)
-      gaussians.append(irregularGauss(x=gaussSamples, mean=activeMeans, lowStd=allLows, highStd=allHighs))
-    
+    gaussians = irregularGauss(x=gaussSamples, mean=allMeans.unsqueeze(-1), lowStd=allLows, highStd=allHighs)
+
     # Apply the psuedo-attention and return
-    return torch.sum(gaussians) * result
+    return torch.sum(gaussians, dim=-2).unsqueeze(-1) * result
 
 
 class KnotConv(nn.Module):
-  def __init__(self, knots:nn.ModuleList = None, windowSize:tuple = (32, 32), stepSize:int = 4, samples:int = 128, knotSize:int = 3):
+  def __init__(self, knots:nn.ModuleList = None, windowSize:tuple = (32, 32), stepSize:int = 4, samples:int = 128, knotSize:int = 3,
+    bankSize:int = None, bankIndex:torch.Tensor = None, chunkSize:int = DEFAULT_CONV_CHUNK):
+    """Slides a window of knots across an image, every element of the window activating the
+    pixel below it through its own knot and the window summing the results.
+
+    Args:
+        knots (nn.ModuleList, optional): The knots to use, one per window element or one per bank entry
+          if bankSize is set. Defaults to None, building new knots.
+        windowSize (tuple, optional): The (height, width) of the window. Defaults to (32, 32).
+        stepSize (int, optional): The stride of the window in both directions. Defaults to 4.
+        samples (int, optional): The FFT sample count the knots are built for, sets the knot depth. Defaults to 128.
+        knotSize (int, optional): The dimensionality of the knots, and the output channels. Defaults to 3.
+        bankSize (int, optional): If set, the window elements share this many knots through bankIndex
+          instead of holding one knot each. Defaults to None.
+        bankIndex (torch.Tensor, optional): The bank knot used by each window element, in the flattened
+          window order. Defaults to None, cycling through the bank.
+        chunkSize (int, optional): The amount of knot evaluations done at once per batch entry and
+          channel, bounding the working memory. Defaults to DEFAULT_CONV_CHUNK.
+
+    Without a bank, an input holding at most CONV_TABLE_LIMIT distinct values (such as an 8 bit
+    frame) that does not need a gradient is evaluated through a table of every knot at every
+    distinct value, leaving only a lookup per window element and position.
+    """
     super(KnotConv, self).__init__()
 
-    self.windowSize = torch.Tensor(windowSize)
-    self.stepSize = stepSize * torch.ones_like(self.windowSize)
+    assert len(windowSize) == 2
+    self.windowSize = tuple(windowSize)
+    self.stepSize = (stepSize, stepSize)
     self.samples = samples
     self.knotSize = knotSize
+    self.chunkSize = chunkSize
 
     flatWindow = 1
     for n in windowSize:
       flatWindow = flatWindow * n
 
+    # Window positions either own a knot each, or index into a shared bank
+    self.bankSize = bankSize
+    knotCount = flatWindow if self.bankSize is None else self.bankSize
+    if self.bankSize is not None:
+      if bankIndex is None:
+        bankIndex = torch.arange(flatWindow) % self.bankSize
+      bankIndex = torch.as_tensor(bankIndex, dtype=torch.long).flatten()
+      assert bankIndex.numel() == flatWindow
+      assert int(torch.max(bankIndex)) < self.bankSize
+      self.register_buffer('bankIndex', bankIndex)
+
     self.knots = knots
     if self.knots != None:
-      assert len(self.knots) == flatWindow
+      assert len(self.knots) == knotCount
+      tKnotDepth = self.knots[0].knotDepth
       for knot in self.knots:
         assert knot.curveSize == self.knotSize
+        assert knot.knotDepth == tKnotDepth
+    else:
+      self.knots = nn.ModuleList([Knot(knotSize=knotSize, knotDepth=samples//4) for i in range(knotCount)])
+
+  def outputSize(self, height: int, width: int) -> Tuple[int, int]:
+    """Gets the spatial size of the output for an input of the provided size.
+
+    Args:
+        height (int): The height of the input.
+        width (int): The width of the input.
+
+    Returns:
+        Tuple[int, int]: The height and width of the output.
+    """
+    return ((height - self.windowSize[0]) // self.stepSize[0]) + 1, \
+      ((width - self.windowSize[1]) // self.stepSize[1]) + 1
+
+  def extra_repr(self) -> str:
+    return f'windowSize={self.windowSize}, stepSize={self.stepSize}, knotSize={self.knotSize}, ' \
+      + f'bankSize={self.bankSize}, chunkSize={self.chunkSize}'
+
+  def forward(self, x: torch.Tensor) -> torch.Tensor:
+    """Convolves the knot window across the input.
+
+    Args:
+        x (torch.Tensor): The input images with a [batch, channels, height, width] shape.
+
+    Returns:
+        torch.Tensor: The summed knot activations with a [batch, knotSize, outHeight, outWidth] shape.
+    """
+    x = precision.toCompute(x)
+    if self.bankSize is None:
+      return self.forwardWindowed(x)
+    return self.forwardBanked(x)
+
+  def forwardWindowed(self, x: torch.Tensor) -> torch.Tensor:
+    # Extract every window position at once, [batch, channels, window, positions]
+    batch, channels, height, width = x.size()
+    patches = nn.functional.unfold(x, kernel_size=self.windowSize, stride=self.stepSize)
+    patches = patches.view(batch, channels, len(self.knots), -1)
+
+    # Evaluate the window in chunks of positions, each knot activating its window element
+    stack = stackKnots(self.knots)
+    positionChunk = max(1, self.chunkSize // len(self.knots))
+    result = []
+    table = self.valueTable(stack, x)
+    if table is None:
+      for chunk in torch.split(patches, positionChunk, dim=-1):
+        result.append(torch.sum(evaluateStack(stack, chunk), dim=(1, 2)))
     else:
-      self.knots = nn.ModuleList([Knot(knotSize=knotSize, knotDepth=samples/4.) for i in range(flatWindow)])
+      # Every knot was evaluated once per distinct value, so each window element only looks its
+      # pixel up in the rows of its own knot, [knots * levels, knotSize]
+      values, table = table
+      rowStart = (torch.arange(len(self.knots), device=x.device) * values.numel()).view(1, 1, -1, 1)
+      flatTable = table.flatten(0, 1)
+      for chunk in torch.split(patches, positionChunk, dim=-1):
+        rows = torch.searchsorted(values, chunk.contiguous()) + rowStart
+        result.append(torch.sum(flatTable[rows], dim=(1, 2)))
+
+    outHeight, outWidth = self.outputSize(height, width)
+    result = torch.cat(result, dim=1).transpose(1, 2)
+    return result.reshape(batch, self.knotSize, outHeight, outWidth)
+
+  def valueTable(self, stack: Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor],
+    x: torch.Tensor) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+    # A lookup has no gradient towards the input, and past the limit the table stops paying off
+    if x.requires_grad:
+      return None
+    values = torch.unique(x)
+    if values.numel() > CONV_TABLE_LIMIT:
+      return None
+
+    # The sorted distinct values and every knot evaluated at them, [knots, levels, knotSize]
+    return values, evaluateStack(stack, values.expand(len(self.knots), values.numel()))
+
+  def forwardBanked(self, x: torch.Tensor) -> torch.Tensor:
+    # Every bank knot only needs to see each pixel once, [batch, bank, pixels, knotSize]
+    batch, channels, height, width = x.size()
+    pixels = x.reshape(batch, channels, 1, height * width)
+    stack = stackKnots(self.knots)
+    pixelChunk = max(1, self.chunkSize // self.bankSize)
+    activated = []
+    for chunk in torch.split(pixels, pixelChunk, dim=-1):
+      chunk = chunk.expand(batch, channels, self.bankSize, chunk.size(-1))
+      activated.append(torch.sum(evaluateStack(stack, chunk), dim=1))
+    activated = torch.cat(activated, dim=-2)
+
+    # The window then just sums the activations of the knot each element points to, which is
+    # a grouped convolution per knot dimension with a one-hot mask of the bank as the kernel
+    activated = activated.permute(0, 3, 1, 2).reshape(batch, self.knotSize * self.bankSize, height, width)
+    bankMask = nn.functional.one_hot(self.bankIndex, self.bankSize).t().to(activated.dtype)
+    bankMask = bankMask.reshape(1, self.bankSize, self.windowSize[0], self.windowSize[1])
+    bankMask = bankMask.expand(self.knotSize, self.bankSize, self.windowSize[0], self.windowSize[1]).contiguous()
+    return nn.functional.conv2d(activated, bankMask, stride=self.stepSize, groups=self.knotSize)
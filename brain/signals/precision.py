@@ -0,0 +1,148 @@
+import torch
+
+import contextlib
+from typing import NamedTuple, Union
+
+
+class PrecisionPolicy(NamedTuple):
+  """
+  Describes the dtypes used throughout the signals package. Parameters are held in the
+    storage dtype (the master weights), cast into the compute dtype when pushed forward,
+    and the FFTs of the entanglement are taken in the FFT dtype.
+  """
+  storage: torch.dtype
+  compute: torch.dtype
+  fft: torch.dtype
+
+
+POLICIES = {
+  'fp32': PrecisionPolicy(storage=torch.float32, compute=torch.float32, fft=torch.float32),
+  'bf16': PrecisionPolicy(storage=torch.float32, compute=torch.bfloat16, fft=torch.float32),
+  'fp16': PrecisionPolicy(storage=torch.float32, compute=torch.float16, fft=torch.float32),
+  'half': PrecisionPolicy(storage=torch.float16, compute=torch.float16, fft=torch.float16),
+}
+DEFAULT_POLICY = 'fp32'
+
+# The complex counterparts of the real dtypes, bfloat16 has none and widens
+COMPLEX_DTYPES = {
+  torch.float16: torch.complex32,
+  torch.bfloat16: torch.complex64,
+  torch.float32: torch.complex64,
+  torch.float64: torch.complex128,
+}
+
+__policy = POLICIES[DEFAULT_POLICY]
+
+
+def getPolicy() -> PrecisionPolicy:
+  """Gets the precision policy currently used by the signals package.
+
+  Returns:
+      PrecisionPolicy: The active policy.
+  """
+  return __policy
+
+
+def setPolicy(policy: Union[str, PrecisionPolicy]) -> PrecisionPolicy:
+  """Sets the precision policy used by the signals package. The storage dtype applies to
+  modules constructed after this call, use applyPolicy() to move existing modules over.
+
+  Args:
+      policy (Union[str, PrecisionPolicy]): The policy, or the name of one of the POLICIES.
+
+  Returns:
+      PrecisionPolicy: The previously active policy.
+  """
+  global __policy
+  if isinstance(policy, str):
+    policy = POLICIES[policy]
+
+  previous = __policy
+  __policy = policy
+  return previous
+
+
+@contextlib.contextmanager
+def usePolicy(policy: Union[str, PrecisionPolicy]):
+  """Temporarily sets the precision policy of the signals package.
+
+  Args:
+      policy (Union[str, PrecisionPolicy]): The policy, or the name of one of the POLICIES.
+  """
+  previous = setPolicy(policy)
+  try:
+    yield getPolicy()
+  finally:
+    setPolicy(previous)
+
+
+def complexDtype(dtype: torch.dtype) -> torch.dtype:
+  """Gets the complex dtype holding two of the provided real dtype.
+
+  Args:
+      dtype (torch.dtype): The real dtype.
+
+  Returns:
+      torch.dtype: The complex dtype.
+  """
+  return COMPLEX_DTYPES[dtype]
+
+
+def storageDtype() -> torch.dtype:
+  return getPolicy().storage
+
+
+def toCompute(x: torch.Tensor) -> torch.Tensor:
+  """Casts a real tensor into the compute dtype of the active policy.
+  """
+  return x.to(getPolicy().compute)
+
+
+def toFFT(x: torch.Tensor) -> torch.Tensor:
+  """Casts a real tensor into the FFT dtype of the active policy.
+  """
+  return x.to(getPolicy().fft)
+
+
+def applyPolicy(module: torch.nn.Module, policy: Union[str, PrecisionPolicy] = None) -> torch.nn.Module:
+  """Moves the parameters and buffers of an existing module into the storage dtype of
+  a policy, real values into the storage dtype and complex values into its complex
+  counterpart.
+
+  Args:
+      module (torch.nn.Module): The module to cast in place.
+      policy (Union[str, PrecisionPolicy], optional): The policy to use. Defaults to None,
+        using the active policy.
+
+  Returns:
+      torch.nn.Module: The provided module.
+  """
+  if policy is None:
+    policy = getPolicy()
+  elif isinstance(policy, str):
+    policy = POLICIES[policy]
+
+  def cast(x: torch.Tensor) -> torch.Tensor:
+    if x.is_complex():
+      return x.to(complexDtype(policy.storage))
+    if x.is_floating_point():
+      return x.to(policy.storage)
+    return x
+
+  return module._apply(cast)
+
+
+def autocast(deviceType: str = 'cpu'):
+  """Builds an autocast context running in the compute dtype of the active policy. Older
+  torch builds without a generic autocast get a context that does nothing.
+
+  Args:
+      deviceType (str, optional): The device type to autocast on. Defaults to 'cpu'.
+
+  Returns:
+      A context manager enabling autocast for the surrounding operations.
+  """
+  policy = getPolicy()
+  if not hasattr(torch, 'autocast') or policy.compute == torch.float32:
+    return contextlib.ExitStack()
+  return torch.autocast(device_type=deviceType, dtype=policy.compute)
@@ -0,0 +1,178 @@
+import torch
+
+from typing import Union
+
+from .knot import Lissajous, Knot
+
+DEFAULT_RENORM_INTERVAL = 64
+DEFAULT_RESYNC_INTERVAL = 1024
+
+# The documented worst case deviation of a float32 stream from the batch forward pass,
+# relative to the sum of the absolute curve weights (1 per curve for a Lissajous stream)
+STREAM_TOLERANCE = 1e-4
+
+
+class LissajousStream(object):
+  """
+  Evaluates a Lissajous-like curve on sample positions advancing by a fixed step. The
+    cosine and sine of every curve angle are cached and rotated forward by the angle
+    addition identities, so each new sample costs a handful of multiply-adds rather
+    than a transcendental call per curve.
+
+  Rounding slowly pulls the cached pair off of the unit circle and away from the true
+    angle. The pair is renormalized every renormInterval steps, which holds the amplitude,
+    and recomputed exactly from the position every resyncInterval steps, which bounds the
+    phase drift. With the default intervals and float32 state the stream stays within
+    STREAM_TOLERANCE of the batch forward pass (relative to the summed curve weights).
+
+  The parameters are copied when the stream is built, rebuild the stream after training.
+  """
+  def __init__(self, curve: Lissajous, start: float, step: float, dtype: torch.dtype = torch.float32,
+    renormInterval: int = DEFAULT_RENORM_INTERVAL, resyncInterval: int = DEFAULT_RESYNC_INTERVAL):
+    """Builds a stream over a Lissajous curve.
+
+    Args:
+        curve (Lissajous): The curve to evaluate.
+        start (float): The first sample position.
+        step (float): The distance between consecutive sample positions.
+        dtype (torch.dtype, optional): The dtype of the stream state. Defaults to torch.float32.
+        renormInterval (int, optional): Steps between renormalizations. Defaults to DEFAULT_RENORM_INTERVAL.
+        resyncInterval (int, optional): Steps between exact recomputations. Defaults to DEFAULT_RESYNC_INTERVAL.
+    """
+    self.setup(frequency=curve.frequency, phase=curve.phase, start=start, step=step, dtype=dtype,
+      renormInterval=renormInterval, resyncInterval=resyncInterval)
+
+  def setup(self, frequency: torch.Tensor, phase: torch.Tensor, start: float, step: float, dtype: torch.dtype,
+    renormInterval: int, resyncInterval: int):
+    """Copies the curve parameters and builds the rotation of a single step.
+    """
+    assert renormInterval > 0 and resyncInterval > 0
+
+    self.dtype = dtype
+    self.start = float(start)
+    self.stepSize = float(step)
+    self.renormInterval = renormInterval
+    self.resyncInterval = resyncInterval
+    with torch.no_grad():
+      self.frequency = frequency.detach().to(dtype).clone()
+      self.phase = phase.detach().to(dtype).clone()
+      # Rounding in the step rotation accumulates every step, so build it as exactly as possible
+      stepAngle = frequency.detach().to(torch.float64) * self.stepSize
+      self.stepCos = torch.cos(stepAngle).to(dtype)
+      self.stepSin = torch.sin(stepAngle).to(dtype)
+    self.resync(count=0)
+
+  @property
+  def position(self) -> float:
+    """The sample position the stream currently sits on.
+    """
+    # Always rebuilt from the count so the position itself never drifts
+    return self.start + (self.count * self.stepSize)
+
+  def resync(self, count: int = None):
+    """Recomputes the cached angles exactly.
+
+    Args:
+        count (int, optional): Jump to this amount of steps past the start. Defaults to None,
+          staying on the current step.
+    """
+    if count is not None:
+      self.count = count
+    with torch.no_grad():
+      angle = (torch.tensor(self.position, dtype=torch.float64) * self.frequency.to(torch.float64)) \
+        + self.phase.to(torch.float64)
+      self.cos = torch.cos(angle).to(self.dtype)
+      self.sin = torch.sin(angle).to(self.dtype)
+
+  def renormalize(self):
+    """Pulls the cached cosine and sine pairs back onto the unit circle.
+    """
+    radius = torch.rsqrt(torch.square(self.cos) + torch.square(self.sin))
+    self.cos.mul_(radius)
+    self.sin.mul_(radius)
+
+  def value(self) -> torch.Tensor:
+    """Gets the curve at the current position.
+
+    Returns:
+        torch.Tensor: The same value as the curve's forward pass on the current position.
+    """
+    return self.cos.clone()
+
+  def step(self) -> torch.Tensor:
+    """Advances the stream by one step.
+
+    Returns:
+        torch.Tensor: The value at the new position.
+    """
+    self.count = self.count + 1
+    if self.count % self.resyncInterval == 0:
+      self.resync()
+    else:
+      cos = (self.cos * self.stepCos) - (self.sin * self.stepSin)
+      self.sin = (self.sin * self.stepCos) + (self.cos * self.stepSin)
+      self.cos = cos
+      if self.count % self.renormInterval == 0:
+        self.renormalize()
+
+    return self.value()
+
+  def steps(self, count: int) -> torch.Tensor:
+    """Advances the stream by multiple steps.
+
+    Args:
+        count (int): The amount of steps to take.
+
+    Returns:
+        torch.Tensor: The values at every new position, stacked on a new leading dimension.
+    """
+    return torch.stack([self.step() for _ in range(count)])
+
+
+class KnotStream(LissajousStream):
+  """
+  Evaluates a Knot on sample positions advancing by a fixed step, rotating every curve of
+    the knot the same way as a LissajousStream and summing them with the knot weights.
+    Each step costs O(depth * size) multiply-adds.
+  """
+  def __init__(self, knot: Knot, start: float, step: float, dtype: torch.dtype = torch.float32,
+    renormInterval: int = DEFAULT_RENORM_INTERVAL, resyncInterval: int = DEFAULT_RESYNC_INTERVAL):
+    """Builds a stream over a Knot.
+
+    Args:
+        knot (Knot): The knot to evaluate.
+        start (float): The first sample position.
+        step (float): The distance between consecutive sample positions.
+        dtype (torch.dtype, optional): The dtype of the stream state. Defaults to torch.float32.
+        renormInterval (int, optional): Steps between renormalizations. Defaults to DEFAULT_RENORM_INTERVAL.
+        resyncInterval (int, optional): Steps between exact recomputations. Defaults to DEFAULT_RESYNC_INTERVAL.
+    """
+    with torch.no_grad():
+      self.regWeights = knot.regWeights.detach().to(dtype).clone()
+      self.knotRadii = knot.knotRadii.detach().to(dtype).clone()
+    self.setup(frequency=knot.frequency, phase=knot.phase, start=start, step=step, dtype=dtype,
+      renormInterval=renormInterval, resyncInterval=resyncInterval)
+
+  def value(self) -> torch.Tensor:
+    """Gets the knot at the current position.
+
+    Returns:
+        torch.Tensor: The same value as the knot's forward pass on the current position.
+    """
+    return torch.sum(self.regWeights * self.cos, dim=0) + self.knotRadii
+
+
+def streamFor(module: Union[Lissajous, Knot], start: float, step: float, **kwargs) -> LissajousStream:
+  """Builds the matching stream for a Lissajous curve or a Knot.
+
+  Args:
+      module (Union[Lissajous, Knot]): The curve or knot to stream.
+      start (float): The first sample position.
+      step (float): The distance between consecutive sample positions.
+
+  Returns:
+      LissajousStream: The stream over the module.
+  """
+  if isinstance(module, Knot):
+    return KnotStream(module, start=start, step=step, **kwargs)
+  return LissajousStream(module, start=start, step=step, **kwargs)
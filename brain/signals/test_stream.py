@@ -0,0 +1,98 @@
+# Run from brain/ with: python -m unittest signals.test_stream
+
+import unittest
+
+import torch
+
+from signals import Knot, Lissajous, KnotStream, LissajousStream, PrecisionPolicy, usePolicy
+from signals.stream import STREAM_TOLERANCE, DEFAULT_RESYNC_INTERVAL
+
+EXACT = PrecisionPolicy(storage=torch.float64, compute=torch.float64, fft=torch.float64)
+START = 0.25
+STEP = 1. / 30
+
+
+def randomize(module: torch.nn.Module, seed: int, bound: float = 4.):
+  generator = torch.Generator().manual_seed(seed)
+  with torch.no_grad():
+    for param in module.parameters():
+      param.copy_((torch.rand(param.shape, generator=generator, dtype=torch.float64) * 2. - 1.) * bound)
+  return module
+
+def direct(module: torch.nn.Module, steps: int, start: float = START, step: float = STEP) -> torch.Tensor:
+  # The forward pass in float64 on the positions the stream steps onto
+  positions = start + (torch.arange(1, steps + 1, dtype=torch.float64) * step)
+  with torch.no_grad(), usePolicy(EXACT):
+    return module(positions)
+
+
+class LissajousStreamTest(unittest.TestCase):
+  def drift(self, stream: LissajousStream, curve: Lissajous, steps: int) -> float:
+    with torch.no_grad():
+      streamed = stream.steps(steps).to(torch.float64)
+    expected = direct(curve, steps).reshape(streamed.shape)
+    return torch.max(torch.abs(streamed - expected)).item()
+
+  def test_matches_forward_across_resyncs(self):
+    curve = randomize(Lissajous(size=8), seed=0)
+    stream = LissajousStream(curve, start=START, step=STEP)
+    self.assertLessEqual(self.drift(stream, curve, 3 * DEFAULT_RESYNC_INTERVAL + 17), STREAM_TOLERANCE)
+
+  def test_matches_forward_with_short_intervals(self):
+    curve = randomize(Lissajous(size=8), seed=1)
+    stream = LissajousStream(curve, start=START, step=STEP, renormInterval=3, resyncInterval=50)
+    self.assertLessEqual(self.drift(stream, curve, 1000), STREAM_TOLERANCE)
+
+  def test_renormalize_restores_unit_circle(self):
+    curve = randomize(Lissajous(size=8), seed=2)
+    stream = LissajousStream(curve, start=START, step=STEP, renormInterval=16, resyncInterval=1 << 20)
+    for _ in range(4):
+      with torch.no_grad():
+        stream.steps(16)
+      radius = torch.square(stream.cos.to(torch.float64)) + torch.square(stream.sin.to(torch.float64))
+      self.assertLessEqual(torch.max(torch.abs(radius - 1.)).item(), 1e-6)
+
+  def test_resync_is_exact(self):
+    curve = randomize(Lissajous(size=8), seed=3)
+    stream = LissajousStream(curve, start=START, step=STEP, renormInterval=4, resyncInterval=100)
+    with torch.no_grad():
+      stream.steps(100)
+    reference = LissajousStream(curve, start=START, step=STEP)
+    reference.resync(count=100)
+    self.assertEqual(stream.count, 100)
+    self.assertAlmostEqual(stream.position, START + 100 * STEP)
+    self.assertTrue(torch.equal(stream.cos, reference.cos))
+    self.assertTrue(torch.equal(stream.sin, reference.sin))
+
+
+class KnotStreamTest(unittest.TestCase):
+  def drift(self, stream: KnotStream, knot: Knot, steps: int) -> float:
+    # Relative to the summed curve weights, the scale STREAM_TOLERANCE is documented against
+    with torch.no_grad():
+      streamed = stream.steps(steps).to(torch.float64)
+    expected = direct(knot, steps)
+    scale = torch.sum(torch.abs(knot.regWeights.detach().to(torch.float64)), dim=0)
+    return torch.max(torch.abs(streamed - expected) / scale).item()
+
+  def test_matches_forward_across_resyncs(self):
+    knot = randomize(Knot(knotSize=3, knotDepth=32), seed=4)
+    stream = KnotStream(knot, start=START, step=STEP)
+    self.assertLessEqual(self.drift(stream, knot, 3 * DEFAULT_RESYNC_INTERVAL + 17), STREAM_TOLERANCE)
+
+  def test_matches_forward_with_short_intervals(self):
+    knot = randomize(Knot(knotSize=3, knotDepth=32), seed=5)
+    stream = KnotStream(knot, start=START, step=STEP, renormInterval=5, resyncInterval=64)
+    self.assertLessEqual(self.drift(stream, knot, 1000), STREAM_TOLERANCE)
+
+  def test_value_before_stepping(self):
+    knot = randomize(Knot(knotSize=3, knotDepth=8), seed=6)
+    stream = KnotStream(knot, start=START, step=STEP)
+    with torch.no_grad(), usePolicy(EXACT):
+      expected = knot(torch.tensor([START], dtype=torch.float64))[0]
+    scale = torch.sum(torch.abs(knot.regWeights.detach().to(torch.float64)), dim=0)
+    error = torch.max(torch.abs(stream.value().to(torch.float64) - expected) / scale).item()
+    self.assertLessEqual(error, STREAM_TOLERANCE)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,36 @@
 import os
-import wget
+import binascii
+import hashlib
+import http.client
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Tuple
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 2
+DEFAULT_TIMEOUT = 30.
+DEFAULT_RETRIES = 3
+CHUNK_SIZE = 1 << 20
+PART_SUFFIX = '.part'
+CHECKSUM_ALGORITHMS = ('md5', 'sha1', 'sha256', 'sha512')
+
+
+class SourceResult(NamedTuple):
+    """The outcome of retrieving a single source file.
+
+    status is one of 'downloaded', 'resumed', 'skipped' (already complete on disk) or
+    'failed', in which case error describes why.
+    """
+    link: str
+    path: str
+    status: str
+    size: int
+    error: str = None
+
 
 def loadSourcesBundle(path):
     """Load Sources to a Bundle
@@ -7,6 +38,9 @@ def loadSourcesBundle(path):
     Loads the full set of links needed to download a bundled set of sources into
     a tuple described by the return section. This does not retrieve the sources.
 
+    A source line is a link, optionally followed by whitespace and a checksum of
+    the file in the form 'algorithm:hexdigest' (for example 'sha256:9f86...').
+
     Args:
         path (string): The path to the bundle of data.
 
@@ -38,26 +72,203 @@ def loadSourcesBundle(path):
                 or line.replace(' ', '').strip() == '':
                 continue
 
-            # Found source
+            # Found source, links are case sensitive (drive ids) so only the checksum is lowered
             else:
-                sources[recentLabel].append(line.strip().lower())
+                fields = line.split()
+                if len(fields) > 1:
+                    fields[1] = fields[1].lower()
+                sources[recentLabel].append(' '.join(fields))
 
     return (path, sources)
 
-def retrieveSources(bundle, verbose=True):
-    """Retrieve the bundled Sources using wget.
+def splitSource(source):
+    """Split a source line of a bundle into its link and optional checksum.
+
+    Args:
+        source (string): The source line, as stored by loadSourcesBundle().
+
+    Returns:
+        Tuple(string, string, string): The link, the checksum algorithm and the
+            expected hex digest. The last two are None without a checksum.
+
+    Raises:
+        ValueError: The checksum algorithm is not one of CHECKSUM_ALGORITHMS.
+    """
+    fields = source.split()
+    if len(fields) < 2:
+        return (fields[0], None, None)
+
+    algorithm, _, digest = fields[1].partition(':')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ValueError(f'Unknown checksum \"{fields[1]}\" for {fields[0]}')
+    return (fields[0], algorithm, digest)
+
+def sourceFilename(link):
+    """Name the local file of a link.
+
+    Uses the last component of the link path. Links carrying a query (which often
+    all share the same path) get a short hash of the full link appended to stay unique.
+
+    Args:
+        link (string): The link to be downloaded.
+
+    Returns:
+        string: The filename to store the link under.
+    """
+    parsed = urllib.parse.urlparse(link)
+    name = os.path.basename(urllib.parse.unquote(parsed.path)) or parsed.netloc
+    if parsed.query:
+        name = f'{name}-{binascii.crc32(link.encode("utf8")):08x}'
+    return name
+
+def fileDigest(path, algorithm):
+    """Hash a file on disk in chunks.
+
+    Args:
+        path (string): The file to hash.
+        algorithm (string): One of CHECKSUM_ALGORITHMS.
+
+    Returns:
+        string: The hex digest of the file.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def contentTotal(contentRange, default=None):
+    """Read the full length of a file out of a Content-Range header.
+
+    Args:
+        contentRange (string): The header, as in 'bytes 100-199/500' or 'bytes */500'.
+        default (int, optional): Returned when the length is missing or unknown ('*').
+
+    Returns:
+        int: The full length of the file in bytes.
+    """
+    if contentRange is None:
+        return default
+    _, _, length = contentRange.rpartition('/')
+    return int(length) if length.strip().isdigit() else default
+
+def retrieveFile(source, dumpDir, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    """Retrieve a single source into a directory, resuming a previous partial download.
+
+    The file is streamed into a '.part' file next to its final path and only renamed
+    once it is complete (the full length the server advertised through Content-Length
+    or Content-Range, and its checksum if it has one), so a file at the final path is
+    always complete. Interrupted downloads, including connections closed early, keep
+    their '.part' file and continue from its end through an HTTP Range request.
+
+    Args:
+        source (string): The source line, a link with an optional checksum.
+        dumpDir (string): The directory to download into.
+        timeout (float, optional): Socket timeout in seconds. Defaults to DEFAULT_TIMEOUT.
+        retries (int, optional): Attempts made after the first failure. Defaults to DEFAULT_RETRIES.
+
+    Returns:
+        SourceResult: The outcome of the retrieval.
+    """
+    try:
+        link, algorithm, expected = splitSource(source)
+    except ValueError as err:
+        link = source.split()[0]
+        return SourceResult(link, os.path.join(dumpDir, sourceFilename(link)), 'failed', 0, str(err))
+    path = os.path.join(dumpDir, sourceFilename(link))
+    partPath = path + PART_SUFFIX
+
+    # Already complete on disk
+    if os.path.exists(path):
+        if algorithm is None or fileDigest(path, algorithm) == expected:
+            return SourceResult(link, path, 'skipped', os.path.getsize(path))
+        os.remove(path)
+
+    error = None
+    resumed = False
+    total = None
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(min(2 ** attempt, 30))
+
+        offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+        request = urllib.request.Request(link)
+        if offset > 0:
+            request.add_header('Range', f'bytes={offset}-')
+
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                # Servers ignoring the range send everything again
+                if offset > 0 and response.status == 206:
+                    resumed = True
+                    mode = 'ab'
+                    total = contentTotal(response.headers.get('Content-Range'), total)
+                else:
+                    mode = 'wb'
+                    length = response.headers.get('Content-Length')
+                    total = int(length) if length is not None and length.isdigit() else total
+                with open(partPath, mode) as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        f.write(chunk)
+        except urllib.error.HTTPError as err:
+            # The partial file may already hold everything the server has
+            if err.code == 416 and offset > 0:
+                resumed = True
+                total = contentTotal(err.headers.get('Content-Range'), total)
+            else:
+                error = f'HTTP {err.code}: {err.reason}'
+                if 400 <= err.code < 500 and err.code not in (408, 429):
+                    break
+                continue
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as err:
+            error = str(getattr(err, 'reason', err)) or type(err).__name__
+            continue
+
+        # A connection closed early leaves the '.part' file behind to resume from
+        size = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+        if total is not None and size != total:
+            error = f'incomplete: {size} of {total} bytes'
+            if size > total:
+                os.remove(partPath)
+                resumed = False
+            continue
+
+        # Check integrity before publishing the file, a mismatch never reaches the final path
+        if algorithm is not None:
+            actual = fileDigest(partPath, algorithm)
+            if actual != expected:
+                os.remove(partPath)
+                resumed = False
+                total = None
+                error = f'{algorithm} mismatch: expected {expected}, got {actual}'
+                continue
+
+        os.replace(partPath, path)
+        return SourceResult(link, path, 'resumed' if resumed else 'downloaded', size)
+
+    return SourceResult(link, path, 'failed', os.path.getsize(partPath) if os.path.exists(partPath) else 0, error)
+
+def retrieveSources(bundle, verbose=True, workers=DEFAULT_WORKERS, perHost=DEFAULT_PER_HOST,
+    timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    """Retrieve the bundled Sources concurrently.
 
     Using the bundle type described, optionally display, and download all files
-    provided using the wget python plugin.
+    provided through a pool of worker threads. No more than perHost downloads run
+    against the same host at once. Files already complete on disk are skipped and
+    partial files are resumed.
 
     Args:
         bundle (Tuple(string, Dict(string, List(string)))): The bundle of sources
             that needs to be downloaded.
         verbose (bool, optional): Display what is being done. Defaults to True.
+        workers (int, optional): Downloads running at once. Defaults to DEFAULT_WORKERS.
+        perHost (int, optional): Downloads running at once per host. Defaults to DEFAULT_PER_HOST.
+        timeout (float, optional): Socket timeout in seconds. Defaults to DEFAULT_TIMEOUT.
+        retries (int, optional): Attempts made per file after its first failure. Defaults to DEFAULT_RETRIES.
 
     Returns:
-        Dict(string, List(string)): A dictionary of the downloaded dataset names
-            and the paths of the files that were downloaded.
+        Dict(string, List(SourceResult)): A manifest of the dataset names and the
+            outcome of each of their files, in bundle order.
     """
     if verbose:
         print('Retrieving sources...')
@@ -66,46 +277,58 @@ def retrieveSources(bundle, verbose=True):
     path, sources = bundle
     dumpPath = os.path.dirname(path)
 
-    # Prepare result
-    downloadPaths = {}
-    
-    # Download each source file
-    for source in sources.keys():
-        downloadPaths[source] = []
-
-        # Gain access to directory if not already present
-        subDump = os.path.join(dumpPath, source).upper()
-        if not os.path.exists(subDump):
-            os.makedirs(subDump)
-        
-        # Download using wget
-        for link in sources[source]:
-            print(link)
-            try:
-                downloadPaths[source].append( \
-                    wget.download(link, out=os.path.join(subDump, '.'), \
-                    bar=wget.bar_adaptive if verbose else None))
-            except Exception:
-                print(".Fuck.")
-
-            print('')
-
-    return downloadPaths
-
-def downloadAll(verbose=True):
-    # Get the topmost path to search
-    top = os.path.dirname(__file__)
-
-    # Walk through the directory tree
-    for dirname, _, files in os.walk(top):
-        for file in files:
-            if file[-5:].lower() != '.srcs': continue
-
-            # Display match if required
-            if verbose:
-                print(f'Sources found at: \"{file}\"')
-
-            # Download associated files
-            srcBundle = loadSourcesBundle(os.path.join(dirname, file))
-            _ = retrieveSources(srcBundle, verbose=verbose)
+    # One connection limit per host, built as hosts show up
+    hostLimits = {}
+    hostLock = threading.Lock()
+    def limitedRetrieve(source, subDump):
+        host = urllib.parse.urlparse(source.split()[0]).netloc
+        with hostLock:
+            if host not in hostLimits:
+                hostLimits[host] = threading.BoundedSemaphore(perHost)
+        with hostLimits[host]:
+            result = retrieveFile(source, subDump, timeout=timeout, retries=retries)
+        if verbose:
+            print(f'[{result.status}] {result.link}' + (f': {result.error}' if result.error else ''))
+        return result
+
+    # Queue every source file
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for source in sources.keys():
+            # Gain access to directory if not already present
+            subDump = os.path.join(dumpPath, source.upper())
+            if not os.path.exists(subDump):
+                os.makedirs(subDump)
+
+            futures[source] = [pool.submit(limitedRetrieve, link, subDump) for link in sources[source]]
+
+    return {source: [future.result() for future in results] for source, results in futures.items()}
+
+def downloadAll(verbose=True, registry=None, **kwargs):
+    """Download every bundle found below this directory.
+
+    Args:
+        verbose (bool, optional): Display what is being done. Defaults to True.
+        registry (DatasetRegistry, optional): The registry to take the bundles from.
+            Defaults to None, opening the registry of this directory.
+        **kwargs: Passed on to retrieveSources().
+
+    Returns:
+        Dict(string, Dict(string, List(SourceResult))): The manifest of each bundle by its path.
+    """
+    # The registry knows every bundle without walking the tree
+    if registry is None:
+        from registry import DatasetRegistry
+        registry = DatasetRegistry(top=os.path.dirname(os.path.abspath(__file__)))
+    manifests = {}
+
+    for bundlePath in registry.bundles():
+        # Display match if required
+        if verbose:
+            print(f'Sources found at: \"{os.path.basename(bundlePath)}\"')
+
+        # Download associated files
+        srcBundle = loadSourcesBundle(bundlePath)
+        manifests[srcBundle[0]] = retrieveSources(srcBundle, verbose=verbose, **kwargs)
 
+    return manifests
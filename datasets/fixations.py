@@ -0,0 +1,221 @@
+import argparse
+import functools
+import math
+import time
+
+import cv2
+import numpy as np
+
+DEFAULT_SIGMA = 8.
+DEFAULT_TRUNCATE = 3.
+FFT_SIGMA_THRESHOLD = 16.
+KERNEL_CACHE_SIZE = 32
+EMOD_IMAGES = 1019
+
+
+@functools.lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def gaussianKernel(sigma, length, truncate=DEFAULT_TRUNCATE):
+    """Build the 1D Gaussian kernel blurring an axis of the given length, cached by
+    (sigma, length). The radius is cut to truncate sigmas, or to the length of the axis.
+
+    Args:
+        sigma (float): The standard deviation in pixels.
+        length (int): The length of the axis being blurred.
+        truncate (float, optional): The radius in sigmas. Defaults to DEFAULT_TRUNCATE.
+
+    Returns:
+        np.ndarray: A read only float32 kernel summing to 1.
+    """
+    radius = min(int(math.ceil(truncate * sigma)), length - 1)
+    offsets = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = np.exp(-0.5 * np.square(offsets / sigma))
+    kernel = (kernel / np.sum(kernel)).astype(np.float32)
+    kernel.setflags(write=False)
+    return kernel
+
+@functools.lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def gaussianTransfer(sigma, size, truncate=DEFAULT_TRUNCATE):
+    """Build the frequency response of the separable Gaussian blur of a map, cached by
+    (sigma, size). The maps are zero padded by the kernel radius so the FFT blur does
+    not wrap around the edges.
+
+    Args:
+        sigma (float): The standard deviation in pixels.
+        size (Tuple(int, int)): The (height, width) of the maps.
+        truncate (float, optional): The radius in sigmas. Defaults to DEFAULT_TRUNCATE.
+
+    Returns:
+        Tuple(np.ndarray, Tuple(int, int)): The read only rfft2 of the kernel and the padded
+            (height, width) it was taken at.
+    """
+    kernels = [gaussianKernel(sigma, length, truncate) for length in size]
+    padded = tuple(cv2.getOptimalDFTSize(length + len(kernel)) for length, kernel in zip(size, kernels))
+
+    # Place the kernels with their centers on the origin so the blur does not shift the map
+    responses = []
+    for kernel, length in zip(kernels, padded):
+        radius = len(kernel) // 2
+        centered = np.zeros(length, dtype=np.float64)
+        centered[:radius + 1] = kernel[radius:]
+        centered[length - radius:] = kernel[:radius]
+        responses.append(centered)
+    transfer = np.fft.fft(responses[0])[:, None] * np.fft.rfft(responses[1])[None, :]
+    transfer = transfer.astype(np.complex64)
+    transfer.setflags(write=False)
+    return transfer, padded
+
+
+def scatterFixations(fixations, originalShapes, size):
+    """Scatter-add the fixations of a batch of images into a grid, weighted by duration.
+
+    Args:
+        fixations (List(Tuple(np.ndarray, np.ndarray, np.ndarray))): The 1 based X, Y and
+            Duration of the fixations of each image, in original image pixels.
+        originalShapes (List(Tuple(int, int))): The (height, width) of each original
+            image, or a single shape shared by all of them.
+        size (Tuple(int, int)): The (height, width) of the grid.
+
+    Returns:
+        np.ndarray: A float32 [images, height, width] grid of summed durations.
+    """
+    count = len(fixations)
+    height, width = size
+    if len(originalShapes) == 2 and np.isscalar(originalShapes[0]):
+        originalShapes = [originalShapes] * count
+
+    # Flatten the whole batch into one set of fixations tagged with their image
+    lengths = [np.size(duration) for _, _, duration in fixations]
+    imageIdx = np.repeat(np.arange(count), lengths)
+    x = np.concatenate([np.ravel(x) for x, _, _ in fixations]).astype(np.float64) if count else np.zeros(0)
+    y = np.concatenate([np.ravel(y) for _, y, _ in fixations]).astype(np.float64) if count else np.zeros(0)
+    duration = np.concatenate([np.ravel(d) for _, _, d in fixations]).astype(np.float64) if count else np.zeros(0)
+
+    shapes = np.asarray(originalShapes, dtype=np.float64)[imageIdx]
+    cols = np.floor((x - 1) * width / shapes[:, 1]).astype(np.int64)
+    rows = np.floor((y - 1) * height / shapes[:, 0]).astype(np.int64)
+    valid = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width) & np.isfinite(duration)
+
+    flat = ((imageIdx * height) + rows) * width + cols
+    grid = np.bincount(flat[valid], weights=duration[valid], minlength=count * height * width)
+    return grid.astype(np.float32).reshape(count, height, width)
+
+def blurMaps(maps, sigma):
+    """Blur a batch of maps with a separable Gaussian, through the FFT for large sigmas.
+
+    Args:
+        maps (np.ndarray): A float32 [images, height, width] batch of maps.
+        sigma (float): The standard deviation in pixels.
+
+    Returns:
+        np.ndarray: The blurred maps, zero padded at the edges.
+    """
+    count, height, width = maps.shape
+    if count == 0:
+        return maps
+
+    if sigma > FFT_SIGMA_THRESHOLD:
+        transfer, padded = gaussianTransfer(sigma, (height, width))
+        spectrum = np.fft.rfft2(maps, s=padded) * transfer
+        return np.fft.irfft2(spectrum, s=padded)[:, :height, :width].astype(np.float32)
+
+    # Every row of every map is independent along x, so the batch is one tall image for
+    # a single filtering call, and the same goes for the columns once transposed
+    rowKernel = gaussianKernel(sigma, width).reshape(1, -1)
+    colKernel = gaussianKernel(sigma, height).reshape(1, -1)
+    blurred = cv2.filter2D(np.ascontiguousarray(maps).reshape(count * height, width), -1, rowKernel,
+        borderType=cv2.BORDER_CONSTANT)
+    blurred = np.ascontiguousarray(blurred.reshape(count, height, width).transpose(0, 2, 1))
+    blurred = cv2.filter2D(blurred.reshape(count * width, height), -1, colKernel, borderType=cv2.BORDER_CONSTANT)
+    return blurred.reshape(count, width, height).transpose(0, 2, 1)
+
+def rasterizeBatch(fixations, originalShapes, size, sigma=DEFAULT_SIGMA, normalize=True):
+    """Turn the fixations of a batch of images into saliency target maps.
+
+    Args:
+        fixations (List(Tuple(np.ndarray, np.ndarray, np.ndarray))): The 1 based X, Y and
+            Duration of the fixations of each image, in original image pixels.
+        originalShapes (List(Tuple(int, int))): The (height, width) of each original
+            image, or a single shape shared by all of them.
+        size (Tuple(int, int)): The (height, width) of the maps.
+        sigma (float, optional): The blur in map pixels. Defaults to DEFAULT_SIGMA.
+        normalize (bool, optional): Scale every map to a peak of 1. Defaults to True.
+
+    Returns:
+        np.ndarray: A float32 [images, height, width] batch of maps.
+    """
+    maps = blurMaps(scatterFixations(fixations, originalShapes, tuple(size)), float(sigma))
+    if normalize:
+        peaks = np.max(maps, axis=(1, 2), keepdims=True)
+        maps = np.divide(maps, peaks, out=np.zeros_like(maps), where=peaks > 0)
+    return maps
+
+
+def loadEMOdFixations(path):
+    """Load the fixations of every EMOd image out of its tracking .mat file, merging
+    the fixations of all of the subjects of an image.
+
+    Args:
+        path (string): The path of the tracking .mat file.
+
+    Returns:
+        List(Tuple(np.ndarray, np.ndarray, np.ndarray)): The X, Y and Duration of the
+            fixations of each image.
+    """
+    from scipy.io import loadmat
+    records = loadmat(path)['fixations1019']
+
+    result = []
+    for i in range(records.shape[0]):
+        subjects = records[i][0][0][0][1]
+        sets = [subjects[j][0][0][0] for j in range(subjects.shape[0])]
+        result.append(tuple(np.concatenate([np.ravel(fixset[k][0]) for fixset in sets]) for k in range(3)))
+    return result
+
+def rasterizeLoop(fixations, originalShape, size, sigma=DEFAULT_SIGMA):
+    # The per fixation approach being replaced, every fixation stamps its own Gaussian
+    maps = np.zeros((len(fixations),) + tuple(size), dtype=np.float32)
+    rows, cols = np.mgrid[0:size[0], 0:size[1]]
+    for idx, (x, y, duration) in enumerate(fixations):
+        for fx, fy, fd in zip(np.ravel(x), np.ravel(y), np.ravel(duration)):
+            col = (fx - 1) * size[1] / originalShape[1]
+            row = (fy - 1) * size[0] / originalShape[0]
+            maps[idx] += fd * np.exp(-0.5 * (np.square(rows - row) + np.square(cols - col)) / (sigma * sigma))
+        peak = np.max(maps[idx])
+        if peak > 0:
+            maps[idx] /= peak
+    return maps
+
+def benchRasterize(fixations, originalShape, size=(256, 256), sigmas=(4., 8., 32.), loopImages=32):
+    print(f'Rasterizing {len(fixations)} images, {sum(np.size(d) for _, _, d in fixations)} fixations, into {size}')
+    for sigma in sigmas:
+        gaussianKernel.cache_clear()
+        gaussianTransfer.cache_clear()
+        start = time.perf_counter()
+        rasterizeBatch(fixations, originalShape, size, sigma)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        rasterizeBatch(fixations, originalShape, size, sigma)
+        warm = time.perf_counter() - start
+
+        # The loop is far too slow for the whole set, so time a slice and scale it up
+        start = time.perf_counter()
+        rasterizeLoop(fixations[:loopImages], originalShape, size, sigma)
+        loop = (time.perf_counter() - start) * len(fixations) / loopImages
+        path = 'fft' if sigma > FFT_SIGMA_THRESHOLD else 'separable'
+        print(f'  sigma {sigma:5.1f} ({path:9s}): batch {cold:7.3f}s cold, {warm:7.3f}s cached, '
+            + f'per fixation loop ~{loop:8.2f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the fixation rasterizer.')
+    parser.add_argument('--mat', type=str, default=None, help='The EMOd tracking .mat file, synthetic fixations if not given.')
+    parser.add_argument('--shape', type=int, nargs=2, default=(768, 1024), help='The original (height, width) of the images.')
+    args = parser.parse_args()
+
+    if args.mat is not None:
+        fixations = loadEMOdFixations(args.mat)
+    else:
+        rng = np.random.RandomState(0)
+        fixations = [(rng.uniform(1, args.shape[1], 300), rng.uniform(1, args.shape[0], 300), rng.uniform(100, 500, 300))
+            for _ in range(EMOD_IMAGES)]
+    benchRasterize(fixations, tuple(args.shape))
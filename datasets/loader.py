@@ -0,0 +1,421 @@
+import os
+import argparse
+import multiprocessing as mp
+import queue
+import time
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+from fixations import rasterizeBatch, DEFAULT_SIGMA
+from shards import ShardReader, DEFAULT_IMAGE_SIZE
+
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_PREFETCH = 4
+DEFAULT_FIXATION_SIGMA = DEFAULT_SIGMA
+WORKER_POLL = 0.1
+
+
+class ArraySpec(NamedTuple):
+    """The per sample shape and dtype of one named output of a sample source.
+    """
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class ShardSource(object):
+    """Samples out of a set of shards written by shards.ShardWriter, as float32 images
+    in [0, 255] and fixation maps in [0, 1].
+    """
+    def __init__(self, shardDir):
+        self.shardDir = shardDir
+        self.reader = None
+        reader = ShardReader(shardDir)
+        self.count = len(reader)
+        self.imageShape = reader.imageShape
+        self.mapShape = reader.mapShape
+
+    def __len__(self):
+        return self.count
+
+    def spec(self):
+        return {
+            'image': ArraySpec(self.imageShape, 'float32'),
+            'map': ArraySpec(self.mapShape, 'float32'),
+        }
+
+    def load(self, idx):
+        # Each worker maps the shards for itself, after it has been forked
+        if self.reader is None:
+            self.reader = ShardReader(self.shardDir)
+        image, fixationMap, _ = self.reader[idx]
+        return {
+            'image': image.astype(np.float32),
+            'map': fixationMap.astype(np.float32) / 255.,
+        }
+
+
+class FileSource(object):
+    """Samples decoded from image files on disk, the way the attention notebook lays its
+    data out. Targets come from fixation map image files or are rasterized from raw
+    (X, Y, Duration) fixation records, and any extra per sample arrays (like the
+    emotion annotations) are passed through.
+    """
+    def __init__(self, imagePaths, size=DEFAULT_IMAGE_SIZE, mapPaths=None, fixations=None,
+        extras=None, sigma=DEFAULT_FIXATION_SIGMA):
+        """Describe the samples, nothing is decoded until a sample is loaded.
+
+        Args:
+            imagePaths (List(string)): The image of each sample.
+            size (Tuple(int, int), optional): The (height, width) to resize to. Defaults to DEFAULT_IMAGE_SIZE.
+            mapPaths (List(string), optional): The fixation map image of each sample. Defaults to None.
+            fixations (List(Tuple(np.ndarray, np.ndarray, np.ndarray)), optional): The X, Y and
+                Duration of the fixations of each sample in original image pixels, used when
+                mapPaths is not given. Defaults to None.
+            extras (Dict(string, np.ndarray), optional): Extra outputs, indexed by sample on
+                their first dimension. Defaults to None.
+            sigma (float, optional): The blur of rasterized fixations in output pixels.
+                Defaults to DEFAULT_FIXATION_SIGMA.
+        """
+        self.imagePaths = list(imagePaths)
+        self.size = tuple(size)
+        self.mapPaths = mapPaths
+        self.fixations = fixations
+        self.extras = {} if extras is None else extras
+        self.sigma = sigma
+
+        for values in (self.mapPaths, self.fixations):
+            assert values is None or len(values) == len(self.imagePaths)
+        for values in self.extras.values():
+            assert len(values) == len(self.imagePaths)
+
+    def __len__(self):
+        return len(self.imagePaths)
+
+    def spec(self):
+        result = {'image': ArraySpec(self.size + (3,), 'float32')}
+        if self.mapPaths is not None or self.fixations is not None:
+            result['map'] = ArraySpec(self.size, 'float32')
+        for name, values in self.extras.items():
+            result[name] = ArraySpec(tuple(values.shape[1:]), 'float32')
+        return result
+
+    def load(self, idx):
+        image = cv2.imread(self.imagePaths[idx], cv2.IMREAD_COLOR)
+        originalShape = image.shape[:2]
+        image = cv2.resize(image, (self.size[1], self.size[0]), interpolation=cv2.INTER_AREA)
+        sample = {'image': cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32)}
+
+        if self.mapPaths is not None:
+            fixationMap = cv2.imread(self.mapPaths[idx], cv2.IMREAD_GRAYSCALE)
+            fixationMap = cv2.resize(fixationMap, (self.size[1], self.size[0]), interpolation=cv2.INTER_AREA)
+            sample['map'] = fixationMap.astype(np.float32) / 255.
+        elif self.fixations is not None:
+            x, y, duration = self.fixations[idx]
+            sample['map'] = rasterizeBatch([(x, y, duration)], originalShape, self.size, self.sigma)[0]
+
+        for name, values in self.extras.items():
+            sample[name] = np.nan_to_num(np.asarray(values[idx], dtype=np.float32))
+        return sample
+
+
+def flipAugment(sample, rng):
+    """Mirror a sample horizontally half of the time, the image and map together.
+
+    Args:
+        sample (Dict(string, np.ndarray)): The loaded sample.
+        rng (np.random.RandomState): The random state of the worker.
+
+    Returns:
+        Dict(string, np.ndarray): The augmented sample.
+    """
+    if rng.rand() < 0.5:
+        for name in ('image', 'map'):
+            if name in sample:
+                sample[name] = sample[name][:, ::-1]
+    return sample
+
+
+class BatchSlots(object):
+    """A fixed set of batch buffers in shared memory, one array per output of the source.
+    They are allocated before the workers are forked so both sides see the same memory.
+    """
+    def __init__(self, spec, batchSize, slotCount, context):
+        self.spec = spec
+        self.batchSize = batchSize
+        self.slotCount = slotCount
+        self.buffers = {}
+        for name, (shape, dtype) in spec.items():
+            nbytes = slotCount * batchSize * int(np.prod(shape)) * np.dtype(dtype).itemsize
+            self.buffers[name] = context.RawArray('b', max(nbytes, 1))
+        self.views = None
+
+    def arrays(self):
+        # Views are built lazily so each process builds its own after the fork
+        if self.views is None:
+            self.views = {
+                name: np.frombuffer(self.buffers[name], dtype=dtype, count=self.slotCount * self.batchSize * int(np.prod(shape)))
+                    .reshape((self.slotCount, self.batchSize) + tuple(shape))
+                for name, (shape, dtype) in self.spec.items()
+            }
+        return self.views
+
+
+def fillSlot(source, slots, slot, indices, augment, rng):
+    arrays = slots.arrays()
+    for position, idx in enumerate(indices):
+        sample = source.load(idx)
+        if augment is not None:
+            sample = augment(sample, rng)
+        for name in slots.spec.keys():
+            arrays[name][slot, position] = sample[name]
+
+def workerLoop(source, slots, tasks, done, augment, seed):
+    rng = np.random.RandomState(seed)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        epoch, batchNum, slot, indices = task
+        try:
+            fillSlot(source, slots, slot, indices, augment, rng)
+            done.put((epoch, batchNum, slot, len(indices), None))
+        except Exception as err:
+            done.put((epoch, batchNum, slot, len(indices), f'{type(err).__name__}: {err}'))
+
+
+class PrefetchLoader(object):
+    """Loads batches of samples in a pool of worker processes ahead of their use.
+
+    Workers decode, rasterize and augment samples straight into a bounded ring of
+    shared memory batch buffers, so no more than `prefetch` batches are ever waiting
+    and nothing is pickled on the way back. Batches come out in order as dictionaries
+    of numpy arrays, which are views into the ring that stay valid until the next
+    batch is requested (pass copy=True to keep them longer). asKeras() and asTorch()
+    adapt the batches for model.fit and for PyTorch code.
+
+    With zero workers the samples are loaded inline, which is handy for debugging.
+    """
+    def __init__(self, source, batchSize=DEFAULT_BATCH_SIZE, workers=None, prefetch=DEFAULT_PREFETCH,
+        shuffle=True, augment=None, dropLast=False, copy=False, seed=None):
+        """Set up the loader, workers are started on the first iteration.
+
+        Args:
+            source: A sample source (ShardSource, FileSource or anything with __len__,
+                spec() and load(idx)).
+            batchSize (int, optional): Samples per batch. Defaults to DEFAULT_BATCH_SIZE.
+            workers (int, optional): Worker processes. Defaults to None, one per CPU.
+            prefetch (int, optional): Batches prepared ahead of time. Defaults to DEFAULT_PREFETCH.
+            shuffle (bool, optional): Shuffle the samples every epoch. Defaults to True.
+            augment (callable, optional): Called as augment(sample, rng) in the workers. Defaults to None.
+            dropLast (bool, optional): Drop the last batch if it is short. Defaults to False.
+            copy (bool, optional): Hand out copies instead of views of the ring. Defaults to False.
+            seed (int, optional): The seed of the shuffling and augmentation. Defaults to None.
+        """
+        self.source = source
+        self.batchSize = batchSize
+        self.workers = os.cpu_count() if workers is None else workers
+        self.prefetch = max(1, prefetch)
+        self.shuffle = shuffle
+        self.augment = augment
+        self.dropLast = dropLast
+        self.copy = copy
+        self.rng = np.random.RandomState(seed)
+        self.seed = self.rng.randint(1 << 31)
+
+        self.context = mp.get_context('fork')
+        self.spec = source.spec()
+        self.slots = BatchSlots(self.spec, batchSize, self.prefetch, self.context)
+        self.processes = []
+        self.epoch = 0
+        self.inFlight = 0
+
+    def __len__(self):
+        if self.dropLast:
+            return len(self.source) // self.batchSize
+        return (len(self.source) + self.batchSize - 1) // self.batchSize
+
+    def start(self):
+        if self.processes or self.workers == 0:
+            return
+        self.tasks = self.context.Queue()
+        self.done = self.context.Queue()
+        for workerNum in range(self.workers):
+            process = self.context.Process(target=workerLoop, daemon=True,
+                args=(self.source, self.slots, self.tasks, self.done, self.augment, self.seed + workerNum))
+            process.start()
+            self.processes.append(process)
+
+    def close(self):
+        """Stop the worker processes.
+        """
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=1.)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.inFlight = 0
+
+    def __del__(self):
+        if getattr(self, 'processes', None):
+            self.close()
+
+    def batches(self):
+        """Split one epoch into batches of sample indices.
+        """
+        order = self.rng.permutation(len(self.source)) if self.shuffle else np.arange(len(self.source))
+        return [order[start:start + self.batchSize] for start in range(0, len(self) * self.batchSize, self.batchSize)]
+
+    def slotBatch(self, slot, count):
+        batch = {name: array[slot, :count] for name, array in self.slots.arrays().items()}
+        if self.copy:
+            batch = {name: np.array(array) for name, array in batch.items()}
+        return batch
+
+    def __iter__(self):
+        """Iterate over one epoch of batches.
+
+        Yields:
+            Dict(string, np.ndarray): The outputs of the source for each batch.
+        """
+        batches = self.batches()
+        if self.workers == 0:
+            rng = np.random.RandomState(self.seed)
+            for indices in batches:
+                fillSlot(self.source, self.slots, 0, indices, self.augment, rng)
+                yield self.slotBatch(0, len(indices))
+            return
+
+        self.start()
+
+        # An epoch that was left early can still have workers writing into the ring
+        while self.inFlight > 0:
+            self.nextDone()
+        self.epoch += 1
+
+        freeSlots = list(range(self.prefetch))
+        ready = {}
+        nextQueued = 0
+        for batchNum in range(len(batches)):
+            # Keep the ring full, the slot of the previous batch is free again by now
+            while freeSlots and nextQueued < len(batches):
+                self.tasks.put((self.epoch, nextQueued, freeSlots.pop(), batches[nextQueued]))
+                self.inFlight += 1
+                nextQueued += 1
+
+            # Batches finish out of order, hold on to them until their turn
+            while batchNum not in ready:
+                epoch, doneNum, slot, count, error = self.nextDone()
+                if error is not None:
+                    raise RuntimeError(f'Loading batch {doneNum} failed: {error}')
+                ready[doneNum] = (slot, count)
+
+            slot, count = ready.pop(batchNum)
+            yield self.slotBatch(slot, count)
+            freeSlots.append(slot)
+
+    def nextDone(self):
+        # Wait on the next finished batch while making sure the workers are still around
+        while True:
+            try:
+                result = self.done.get(timeout=WORKER_POLL)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    self.close()
+                    raise RuntimeError('A loader worker died')
+                continue
+            self.inFlight -= 1
+            return result
+
+    def asKeras(self, inputs=('image',), targets=('map',), epochs=None):
+        """Adapt the batches for model.fit, as (inputs, targets) tuples over endless epochs.
+        Pass len(loader) as the steps_per_epoch of the fit.
+
+        Args:
+            inputs (Tuple(string), optional): The outputs fed to the model. Defaults to ('image',).
+            targets (Tuple(string), optional): The outputs the model is fit to. Defaults to ('map',).
+            epochs (int, optional): Stop after this many epochs. Defaults to None, never stopping.
+
+        Yields:
+            Tuple: The inputs and targets, unwrapped when there is only one of either.
+        """
+        unwrap = lambda names, batch: batch[names[0]] if len(names) == 1 else tuple(batch[name] for name in names)
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            for batch in self:
+                yield unwrap(inputs, batch), unwrap(targets, batch)
+            epoch += 1
+
+    def asTorch(self, device=None):
+        """Adapt the batches for PyTorch as dictionaries of tensors sharing the batch memory.
+
+        Args:
+            device (torch.device, optional): Move the batches onto this device. Defaults to None.
+
+        Yields:
+            Dict(string, torch.Tensor): The outputs of the source for each batch.
+        """
+        import torch
+        for batch in self:
+            tensors = {name: torch.from_numpy(np.ascontiguousarray(array)) for name, array in batch.items()}
+            if device is not None:
+                tensors = {name: tensor.to(device, non_blocking=True) for name, tensor in tensors.items()}
+            yield tensors
+
+
+class EncodedSource(object):
+    """A synthetic source of JPEG encoded noise images with random fixations, giving the
+    benchmark the same decode, resize and rasterization work as real data.
+    """
+    def __init__(self, count=256, originalShape=(768, 1024), size=DEFAULT_IMAGE_SIZE, fixationCount=40):
+        rng = np.random.RandomState(0)
+        noise = rng.randint(0, 256, size=originalShape + (3,), dtype=np.uint8)
+        self.encoded = cv2.imencode('.jpg', cv2.GaussianBlur(noise, (0, 0), 3))[1]
+        self.fixations = [(rng.uniform(1, originalShape[1], fixationCount), rng.uniform(1, originalShape[0], fixationCount),
+            rng.uniform(100, 500, fixationCount)) for _ in range(count)]
+        self.originalShape = originalShape
+        self.size = tuple(size)
+
+    def __len__(self):
+        return len(self.fixations)
+
+    def spec(self):
+        return {'image': ArraySpec(self.size + (3,), 'float32'), 'map': ArraySpec(self.size, 'float32')}
+
+    def load(self, idx):
+        image = cv2.imdecode(self.encoded, cv2.IMREAD_COLOR)
+        image = cv2.resize(image, (self.size[1], self.size[0]), interpolation=cv2.INTER_AREA)
+        x, y, duration = self.fixations[idx]
+        return {
+            'image': cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32),
+            'map': rasterizeBatch([(x, y, duration)], self.originalShape, self.size)[0],
+        }
+
+
+def benchLoader(source, workerCounts=(0, 1, 2, 4, 8), batchSize=DEFAULT_BATCH_SIZE, epochs=2):
+    """Report the throughput of the loader over a range of worker counts.
+    """
+    print(f'PrefetchLoader over {len(source)} samples, batch {batchSize}')
+    for workers in workerCounts:
+        loader = PrefetchLoader(source, batchSize=batchSize, workers=workers, augment=flipAugment, seed=0)
+        samples = 0
+        start = time.perf_counter()
+        for _ in range(epochs):
+            for batch in loader:
+                samples += len(batch['image'])
+        elapsed = time.perf_counter() - start
+        loader.close()
+        print(f'  workers {workers:2d}: {samples/elapsed:9.1f} samples/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the prefetching loader.')
+    parser.add_argument('--shards', type=str, default=None, help='Benchmark on a shard directory instead of synthetic data.')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH_SIZE, help='Samples per batch.')
+    args = parser.parse_args()
+
+    source = EncodedSource() if args.shards is None else ShardSource(args.shards)
+    benchLoader(source, batchSize=args.batch)
@@ -0,0 +1,244 @@
+import os
+import json
+import threading
+
+from datadingsItr import loadSourcesBundle, splitSource, sourceFilename, PART_SUFFIX
+
+REGISTRY_DIR = '.registry'
+REGISTRY_NAME = 'registry.json'
+REGISTRY_VERSION = 2
+SHARD_INDEX = os.path.join('shards', 'index.json')
+
+
+class DatasetRegistry(object):
+    """A persistent index of the source bundles below a directory and the local state
+    of every dataset they describe.
+
+    Bundles are parsed once and kept in a registry file along with their mtimes and
+    the mtimes of every directory that can hold one. A lookup only stats the files it
+    depends on (the bundle directories, a bundle, a download directory) and rescans or
+    reparses just what changed, so it never walks the tree. A full walk only happens
+    when the registry is first built or on an explicit rescan.
+
+    The registry file lives in its own directory, so saving it never changes the
+    mtime of a directory it watches.
+    """
+    def __init__(self, top=os.path.dirname(os.path.abspath(__file__)), path=None):
+        """Open the registry of a directory, building it if there is none yet.
+
+        Args:
+            top (string, optional): The directory holding the bundles. Defaults to the
+                directory of this file.
+            path (string, optional): The registry file. Defaults to REGISTRY_NAME in
+                the REGISTRY_DIR of top.
+        """
+        self.top = top
+        self.path = os.path.join(top, REGISTRY_DIR, REGISTRY_NAME) if path is None else path
+        self.lock = threading.RLock()
+        self.state = None
+
+        # Made before anything is scanned, the directory only ever changes top's mtime once
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            if state.get('version') == REGISTRY_VERSION and state.get('top') == self.top:
+                self.state = state
+        if self.state is None:
+            self.rescan()
+
+    def save(self):
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.state, f)
+            os.replace(self.path + '.tmp', self.path)
+
+            # A registry file kept in a watched directory must not flag it as changed
+            registryDir = os.path.dirname(self.path)
+            if registryDir in self.state['dirs']:
+                self.state['dirs'][registryDir] = os.stat(registryDir).st_mtime
+
+    def rescan(self):
+        """Walk the whole tree for bundles, dropping every cached dataset state.
+        """
+        with self.lock:
+            self.state = {
+                'version': REGISTRY_VERSION,
+                'top': self.top,
+                'dirs': {},
+                'bundles': {},
+                'datasets': {},
+                'keys': self.state['keys'] if self.state is not None else {},
+            }
+            self.scan(self.top)
+            self.save()
+
+    def scan(self, dirname):
+        # The mtime is taken before listing, so a change made during the listing shows next time
+        self.state['dirs'][dirname] = os.stat(dirname).st_mtime
+        for entry in os.scandir(dirname):
+            if entry.is_dir():
+                # Download directories only ever hold data, never bundles
+                if not entry.name.isupper() and entry.name not in ('shards', REGISTRY_DIR):
+                    self.scan(entry.path)
+            elif entry.name[-5:].lower() == '.srcs':
+                bundle = self.state['bundles'].get(entry.path)
+                if bundle is None or entry.stat().st_mtime != bundle['mtime']:
+                    self.loadBundle(entry.path)
+
+    def loadBundle(self, bundlePath):
+        # Parse a bundle and point each of its datasets back at it
+        self.dropBundle(bundlePath)
+        _, sources = loadSourcesBundle(bundlePath)
+        self.state['bundles'][bundlePath] = {
+            'mtime': os.stat(bundlePath).st_mtime,
+            'sources': sources,
+        }
+        for source in sources.keys():
+            self.state['datasets'][source.lower()] = {
+                'name': source,
+                'bundle': bundlePath,
+                'dir': os.path.join(os.path.dirname(bundlePath), source.upper()),
+                'dirMtime': None,
+            }
+
+    def dropBundle(self, bundlePath):
+        self.state['bundles'].pop(bundlePath, None)
+        for key, dataset in list(self.state['datasets'].items()):
+            if dataset['bundle'] == bundlePath:
+                del self.state['datasets'][key]
+
+    def refresh(self):
+        """Bring the registry up to date with the bundles on disk, only rescanning the
+        directories and reparsing the bundles that changed since they were last read.
+
+        Returns:
+            bool: True if anything changed.
+        """
+        with self.lock:
+            changed = False
+            for dirname, mtime in list(self.state['dirs'].items()):
+                if not os.path.isdir(dirname):
+                    del self.state['dirs'][dirname]
+                    changed = True
+                elif os.stat(dirname).st_mtime != mtime:
+                    self.scan(dirname)
+                    changed = True
+
+            for bundlePath, bundle in list(self.state['bundles'].items()):
+                if not os.path.exists(bundlePath):
+                    self.dropBundle(bundlePath)
+                    changed = True
+                elif os.stat(bundlePath).st_mtime != bundle['mtime']:
+                    self.loadBundle(bundlePath)
+                    changed = True
+
+            if changed:
+                self.save()
+            return changed
+
+    def bundles(self):
+        """Get the paths of all of the known bundles.
+
+        Returns:
+            List(string): The bundle paths.
+        """
+        self.refresh()
+        return list(self.state['bundles'].keys())
+
+    def datasets(self):
+        """Get the names of all of the known datasets.
+
+        Returns:
+            List(string): The dataset names as written in their bundles.
+        """
+        self.refresh()
+        return [dataset['name'] for dataset in self.state['datasets'].values()]
+
+    def dataset(self, name):
+        """Look up a dataset by name (case insensitive) along with its local state.
+
+        Returns a dictionary holding the 'name', 'bundle' and download 'dir' of the
+        dataset, plus a 'files' dictionary of the state of each of its links ('complete',
+        'partial' or 'missing') and whether or not it has been 'sharded'. The state is
+        only recomputed when the download directory changed since it was last checked.
+
+        Args:
+            name (string): The name of the dataset.
+
+        Returns:
+            dict: The record of the dataset, None if no bundle describes it.
+        """
+        with self.lock:
+            dataset = self.state['datasets'].get(name.lower())
+            if dataset is None:
+                return None
+
+            # A bundle edit can change the links of the dataset
+            bundle = self.state['bundles'].get(dataset['bundle'])
+            if bundle is None or not os.path.exists(dataset['bundle']) \
+                or os.stat(dataset['bundle']).st_mtime != bundle['mtime']:
+                self.refresh()
+                return self.dataset(name)
+
+            dirMtime = os.stat(dataset['dir']).st_mtime if os.path.isdir(dataset['dir']) else None
+            if 'files' not in dataset or dirMtime != dataset['dirMtime']:
+                self.updateState(dataset, bundle['sources'][dataset['name']], dirMtime)
+                self.save()
+
+            return dict(dataset)
+
+    def updateState(self, dataset, sources, dirMtime):
+        files = {}
+        for source in sources:
+            link = splitSource(source)[0]
+            path = os.path.join(dataset['dir'], sourceFilename(link))
+            if os.path.exists(path):
+                files[link] = 'complete'
+            elif os.path.exists(path + PART_SUFFIX):
+                files[link] = 'partial'
+            else:
+                files[link] = 'missing'
+
+        dataset['files'] = files
+        dataset['sharded'] = os.path.exists(os.path.join(dataset['dir'], SHARD_INDEX))
+        dataset['dirMtime'] = dirMtime
+
+    def missing(self):
+        """Get everything that still needs fetching.
+
+        Returns:
+            Dict(string, List(string)): The links that are not complete on disk, by dataset name.
+        """
+        result = {}
+        for name in self.datasets():
+            links = [link for link, state in self.dataset(name)['files'].items() if state != 'complete']
+            if links:
+                result[name] = links
+        return result
+
+    def locate(self, key, roots=('/',)):
+        """Find the directory holding a marker file, like the 'EMOd.key' of a dataset kept
+        outside of this tree. The answer is cached in the registry, so only the first
+        lookup (or one after the marker moved) walks the roots.
+
+        Args:
+            key (string): The name of the marker file.
+            roots (Tuple(string), optional): Where to search for the marker. Defaults to ('/',).
+
+        Returns:
+            string: The directory holding the marker, None if it could not be found.
+        """
+        with self.lock:
+            cached = self.state['keys'].get(key)
+            if cached is not None and os.path.exists(os.path.join(cached, key)):
+                return cached
+
+            for root in roots:
+                for dirname, _, files in os.walk(root):
+                    if key in files:
+                        self.state['keys'][key] = dirname
+                        self.save()
+                        return dirname
+
+            return None
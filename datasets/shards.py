@@ -0,0 +1,436 @@
+import os
+import json
+import zipfile
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from datadingsItr import loadSourcesBundle
+from fixations import rasterizeBatch
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 2
+DEFAULT_SHARD_SIZE = 1024
+DEFAULT_IMAGE_SIZE = (256, 256)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# Archive member paths containing these are continuous fixation maps or fixation points
+MAP_MARKERS = ('fixationmap', 'fixation_map', 'fixmap', 'continuous_map')
+POINT_MARKERS = ('fixpts', 'fixationloc', 'fixlocs')
+MAP_SUFFIXES = ('_fixmap', '_fixationmap', '_map', '_fixpts', '_fixlocs')
+POINT_THRESHOLD = 127
+
+
+class ShardWriter(object):
+    """Writes fixed-size binary shards of resized images, fixation maps and fixation points.
+
+    Every shard holds up to shardSize samples as two raw uint8 files, one of images
+    and one of fixation maps, that can be memory mapped as arrays, and a raw float32
+    file of the (x, y) fixation points of all of its samples. The index holding the
+    layout of the shards and one annotation record per sample is written on a clean
+    close only, so a set of shards with an index is always complete.
+    """
+    def __init__(self, shardDir, imageShape=DEFAULT_IMAGE_SIZE + (3,), shardSize=DEFAULT_SHARD_SIZE):
+        """Start a new set of shards, removing any index already in the directory.
+
+        Args:
+            shardDir (string): The directory to write the shards into.
+            imageShape (Tuple(int, int, int), optional): The (height, width, channels) of
+                the stored images. Defaults to DEFAULT_IMAGE_SIZE with 3 channels.
+            shardSize (int, optional): Samples per shard. Defaults to DEFAULT_SHARD_SIZE.
+        """
+        os.makedirs(shardDir, exist_ok=True)
+        self.shardDir = shardDir
+
+        # The old index describes shards about to be overwritten
+        indexPath = os.path.join(shardDir, INDEX_NAME)
+        if os.path.exists(indexPath):
+            os.remove(indexPath)
+
+        self.imageShape = tuple(imageShape)
+        self.mapShape = self.imageShape[:2]
+        self.shardSize = shardSize
+        self.shards = []
+        self.records = []
+        self.imageFile = None
+        self.mapFile = None
+        self.pointFile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, *args):
+        # A failed write leaves the shards without an index, unreadable rather than partial
+        if excType is None:
+            self.close()
+        else:
+            self.closeShard()
+
+    def add(self, image, fixationMap, record, points=None):
+        """Append a sample.
+
+        Args:
+            image (np.ndarray): A uint8 image of the writer's image shape.
+            fixationMap (np.ndarray): A uint8 fixation map of the writer's map shape.
+            record (dict): A JSON serializable annotation record of the sample.
+            points (np.ndarray, optional): The float32 [count, 2] (x, y) fixation points of
+                the sample in stored image pixels. Defaults to None, for no points.
+        """
+        assert image.shape == self.imageShape and image.dtype == np.uint8
+        assert fixationMap.shape == self.mapShape and fixationMap.dtype == np.uint8
+        points = np.zeros((0, 2), dtype=np.float32) if points is None else np.asarray(points, dtype=np.float32)
+        assert points.ndim == 2 and points.shape[1] == 2
+
+        # Roll over to a new shard
+        if not self.shards or self.shards[-1]['count'] == self.shardSize:
+            self.closeShard()
+            shardNum = len(self.shards)
+            self.shards.append({
+                'images': f'images-{shardNum:05d}.u8',
+                'maps': f'maps-{shardNum:05d}.u8',
+                'points': f'points-{shardNum:05d}.f32',
+                'count': 0,
+                'pointCount': 0,
+            })
+            self.imageFile = open(os.path.join(self.shardDir, self.shards[-1]['images']), 'wb')
+            self.mapFile = open(os.path.join(self.shardDir, self.shards[-1]['maps']), 'wb')
+            self.pointFile = open(os.path.join(self.shardDir, self.shards[-1]['points']), 'wb')
+
+        shard = self.shards[-1]
+        self.imageFile.write(np.ascontiguousarray(image).tobytes())
+        self.mapFile.write(np.ascontiguousarray(fixationMap).tobytes())
+        self.pointFile.write(np.ascontiguousarray(points).tobytes())
+        record = dict(record, points=[shard['pointCount'], len(points)])
+        shard['count'] += 1
+        shard['pointCount'] += len(points)
+        self.records.append(record)
+
+    def closeShard(self):
+        for f in (self.imageFile, self.mapFile, self.pointFile):
+            if f is not None:
+                f.close()
+        self.imageFile = None
+        self.mapFile = None
+        self.pointFile = None
+
+    def close(self):
+        """Finish the last shard and write the index, which makes the shards readable.
+        """
+        self.closeShard()
+        index = {
+            'version': INDEX_VERSION,
+            'imageShape': list(self.imageShape),
+            'mapShape': list(self.mapShape),
+            'shardSize': self.shardSize,
+            'count': len(self.records),
+            'shards': self.shards,
+            'records': self.records,
+        }
+
+        indexPath = os.path.join(self.shardDir, INDEX_NAME)
+        with open(indexPath + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(indexPath + '.tmp', indexPath)
+
+
+class ShardReader(object):
+    """Random access to the samples of a set of shards.
+
+    Shards are memory mapped the first time one of their samples is read, so opening
+    a reader is instant and samples only take up memory while the page cache holds them.
+    """
+    def __init__(self, shardDir):
+        """Open a set of shards written by a ShardWriter.
+
+        Args:
+            shardDir (string): The directory holding the shards and their index.
+        """
+        with open(os.path.join(shardDir, INDEX_NAME)) as f:
+            index = json.load(f)
+        assert index['version'] == INDEX_VERSION
+
+        self.shardDir = shardDir
+        self.imageShape = tuple(index['imageShape'])
+        self.mapShape = tuple(index['mapShape'])
+        self.shardSize = index['shardSize']
+        self.shards = index['shards']
+        self.records = index['records']
+        self.maps = [None] * len(self.shards)
+        self.pointMaps = [None] * len(self.shards)
+
+    def __len__(self):
+        return len(self.records)
+
+    def shard(self, shardNum):
+        """Map a shard into memory.
+
+        Args:
+            shardNum (int): The shard to map.
+
+        Returns:
+            Tuple(np.memmap, np.memmap): The read only image and fixation map arrays of the shard.
+        """
+        if self.maps[shardNum] is None:
+            shard = self.shards[shardNum]
+            self.maps[shardNum] = (
+                np.memmap(os.path.join(self.shardDir, shard['images']), dtype=np.uint8, mode='r',
+                    shape=(shard['count'],) + self.imageShape),
+                np.memmap(os.path.join(self.shardDir, shard['maps']), dtype=np.uint8, mode='r',
+                    shape=(shard['count'],) + self.mapShape),
+            )
+        return self.maps[shardNum]
+
+    def __getitem__(self, idx):
+        """Read a sample without copying it.
+
+        Args:
+            idx (int): The sample to read.
+
+        Returns:
+            Tuple(np.ndarray, np.ndarray, dict): Views of the image and fixation map, and the
+                annotation record of the sample.
+        """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'Sample {idx} is out of range for {len(self)} samples')
+
+        images, maps = self.shard(idx // self.shardSize)
+        return images[idx % self.shardSize], maps[idx % self.shardSize], self.records[idx]
+
+    def points(self, idx):
+        """Read the fixation points of a sample without copying them.
+
+        Args:
+            idx (int): The sample to read.
+
+        Returns:
+            np.ndarray: A float32 [count, 2] view of the (x, y) fixation points of the sample
+                in stored image pixels, empty if its dataset had none.
+        """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'Sample {idx} is out of range for {len(self)} samples')
+
+        shardNum = idx // self.shardSize
+        shard = self.shards[shardNum]
+        if self.pointMaps[shardNum] is None:
+            # Zero length files can't be mapped
+            path = os.path.join(self.shardDir, shard['points'])
+            self.pointMaps[shardNum] = np.zeros((0, 2), dtype=np.float32) if shard['pointCount'] == 0 \
+                else np.memmap(path, dtype=np.float32, mode='r', shape=(shard['pointCount'], 2))
+        offset, count = self.records[idx]['points']
+        return self.pointMaps[shardNum][offset:offset + count]
+
+
+def memberKind(member):
+    """Classify an archive member as an 'image', a fixation 'map', fixation 'points' or None.
+
+    Args:
+        member (string): The path of the member in its archive.
+
+    Returns:
+        string: The kind of the member, None if it is not an image at all.
+    """
+    lowered = member.lower()
+    if not lowered.endswith(IMAGE_EXTENSIONS) or os.path.basename(lowered).startswith('.'):
+        return None
+    if any(marker in lowered for marker in POINT_MARKERS):
+        return 'points'
+    if any(marker in lowered for marker in MAP_MARKERS):
+        return 'map'
+    return 'image'
+
+def memberKey(member):
+    """Get the stem that pairs an image with its fixation map, and the directories leading to it.
+
+    Args:
+        member (string): The path of the member in its archive.
+
+    Returns:
+        Tuple(string, List(string)): The lowered stem with any map suffix removed, and the
+            lowered directories of the member from the innermost outwards.
+    """
+    parts = member.lower().replace('\\', '/').split('/')
+    stem = os.path.splitext(parts[-1])[0]
+    for suffix in MAP_SUFFIXES:
+        if stem.endswith(suffix):
+            stem = stem[:-len(suffix)]
+            break
+    return stem, parts[-2::-1]
+
+def pairMembers(archives):
+    """Pair every image of a set of archives with its fixation map and fixation points.
+
+    Images, maps and points are paired by stem. Stems shared by multiple maps (like the
+    per category numbering of CAT2000) go to the map sharing the most trailing directories.
+
+    Args:
+        archives (List(string)): Paths of the zip archives of one dataset.
+
+    Returns:
+        List(Tuple(Tuple(string, string), Tuple(string, string), Tuple(string, string))): The
+            (archive, member) of each image, of its map and of its points, the last two being
+            None if there are none.
+    """
+    images = []
+    maps = {}
+    points = {}
+    for archive in archives:
+        with zipfile.ZipFile(archive) as zf:
+            for member in zf.namelist():
+                kind = memberKind(member)
+                if kind == 'image':
+                    images.append((archive, member))
+                elif kind in ('map', 'points'):
+                    stem, dirs = memberKey(member)
+                    (maps if kind == 'map' else points).setdefault(stem, []).append((dirs, (archive, member)))
+
+    def shared(a, b):
+        count = 0
+        for x, y in zip(a, b):
+            if x != y: break
+            count += 1
+        return count
+
+    def closest(candidates, dirs):
+        best = max(candidates, key=lambda candidate: shared(dirs, candidate[0]), default=None)
+        return None if best is None else best[1]
+
+    pairs = []
+    for image in sorted(images):
+        stem, dirs = memberKey(image[1])
+        pairs.append((image, closest(maps.get(stem, []), dirs), closest(points.get(stem, []), dirs)))
+    return pairs
+
+def decodeMember(zf, member, size, flags):
+    """Decode and resize one image straight out of an open archive.
+    """
+    raw = np.frombuffer(zf.read(member), dtype=np.uint8)
+    decoded = cv2.imdecode(raw, flags)
+    if decoded is None:
+        return None, None
+    original = decoded.shape[:2]
+    return cv2.resize(decoded, (size[1], size[0]), interpolation=cv2.INTER_AREA), original
+
+def decodePoints(zf, member, size):
+    """Read the fixated pixels of a fixation point image, the binary kind like the fixPts
+    of MIT1003, at its full resolution.
+
+    Returns:
+        Tuple(np.ndarray, Tuple(int, int)): The float32 [count, 2] (x, y) points scaled to
+            a (height, width) image of size, and the original shape. Both None if the
+            member could not be decoded.
+    """
+    decoded = cv2.imdecode(np.frombuffer(zf.read(member), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if decoded is None:
+        return None, None
+    rows, cols = np.nonzero(decoded > POINT_THRESHOLD)
+    scale = np.array([size[1] / decoded.shape[1], size[0] / decoded.shape[0]], dtype=np.float32)
+    points = (np.stack([cols, rows], axis=1).astype(np.float32) + 0.5) * scale
+    return points, decoded.shape[:2]
+
+def shardSource(sourceDir, shardDir=None, size=DEFAULT_IMAGE_SIZE, shardSize=DEFAULT_SHARD_SIZE, verbose=True):
+    """Stream the downloaded archives of one dataset into shards.
+
+    Every image is decoded straight out of its archive, converted to RGB, resized, and
+    written out next to its resized fixation map and its fixation points before the next
+    image is read. Images with points but no map get a map rasterized from their points.
+    Images with neither get an all zero map and None for the 'map' of their record.
+
+    Only image members are read. Fixations kept in .mat files (the FIXATIONLOCS of
+    CAT2000, the per subject eye tracking DATA of MIT1003) have a layout of their own
+    per dataset and are not carried into the shards.
+
+    Args:
+        sourceDir (string): The download directory of the dataset.
+        shardDir (string, optional): Where to write the shards. Defaults to None, using a
+            'shards' directory inside of sourceDir.
+        size (Tuple(int, int), optional): The (height, width) to resize to. Defaults to DEFAULT_IMAGE_SIZE.
+        shardSize (int, optional): Samples per shard. Defaults to DEFAULT_SHARD_SIZE.
+        verbose (bool, optional): Display what is being done. Defaults to True.
+
+    Returns:
+        int: The amount of samples written.
+    """
+    if shardDir is None:
+        shardDir = os.path.join(sourceDir, 'shards')
+
+    archives = sorted(os.path.join(sourceDir, name) for name in os.listdir(sourceDir)
+        if zipfile.is_zipfile(os.path.join(sourceDir, name)))
+    pairs = pairMembers(archives)
+    if verbose:
+        print(f'Sharding {len(pairs)} images from {len(archives)} archives in \"{sourceDir}\"')
+
+    openArchives = {}
+    try:
+        with ShardWriter(shardDir, imageShape=tuple(size) + (3,), shardSize=shardSize) as writer:
+            for (imageArchive, imageMember), mapSource, pointSource in pairs:
+                for source in ((imageArchive, imageMember), mapSource, pointSource):
+                    if source is not None and source[0] not in openArchives:
+                        openArchives[source[0]] = zipfile.ZipFile(source[0])
+
+                image, original = decodeMember(openArchives[imageArchive], imageMember, size, cv2.IMREAD_COLOR)
+                if image is None:
+                    if verbose:
+                        print(f'Could not decode \"{imageMember}\", skipping')
+                    continue
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+                fixationMap = None
+                if mapSource is not None:
+                    fixationMap, _ = decodeMember(openArchives[mapSource[0]], mapSource[1], size, cv2.IMREAD_GRAYSCALE)
+                points = None
+                if pointSource is not None:
+                    points, _ = decodePoints(openArchives[pointSource[0]], pointSource[1], size)
+
+                mapMember = None if fixationMap is None else mapSource[1]
+                if fixationMap is None and points is not None and len(points) > 0:
+                    # Rasterized in stored pixels, the points are already scaled but 0 based
+                    rasterized = rasterizeBatch([(points[:, 0] + 1, points[:, 1] + 1, np.ones(len(points)))],
+                        tuple(size), tuple(size))[0]
+                    fixationMap = np.round(rasterized * 255.).astype(np.uint8)
+                    mapMember = pointSource[1]
+
+                writer.add(image, np.zeros(size, dtype=np.uint8) if fixationMap is None else fixationMap, {
+                    'archive': os.path.basename(imageArchive),
+                    'member': imageMember,
+                    'map': mapMember,
+                    'pointMember': None if points is None else pointSource[1],
+                    'originalShape': list(original),
+                }, points=points)
+            count = len(writer.records)
+    finally:
+        for zf in openArchives.values():
+            zf.close()
+
+    return count
+
+def shardBundle(bundlePath, size=DEFAULT_IMAGE_SIZE, shardSize=DEFAULT_SHARD_SIZE, verbose=True):
+    """Shard every downloaded dataset of a bundle, see shardSource().
+
+    Args:
+        bundlePath (string): The path of the .srcs bundle the datasets were downloaded from.
+        size (Tuple(int, int), optional): The (height, width) to resize to. Defaults to DEFAULT_IMAGE_SIZE.
+        shardSize (int, optional): Samples per shard. Defaults to DEFAULT_SHARD_SIZE.
+        verbose (bool, optional): Display what is being done. Defaults to True.
+
+    Returns:
+        Dict(string, string): The shard directory of each dataset that had archives.
+    """
+    path, sources = loadSourcesBundle(bundlePath)
+    dumpPath = os.path.dirname(path)
+
+    shardDirs = {}
+    for source in sources.keys():
+        sourceDir = os.path.join(dumpPath, source.upper())
+        if not os.path.isdir(sourceDir):
+            continue
+
+        shardDir = os.path.join(sourceDir, 'shards')
+        shardSource(sourceDir, shardDir, size=size, shardSize=shardSize, verbose=verbose)
+        shardDirs[source] = shardDir
+
+    return shardDirs
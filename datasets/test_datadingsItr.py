@@ -0,0 +1,180 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import datadingsItr
+
+FIXTURE_SIZE = 500000
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves the fixture files of the stand-in server with Range support.
+
+    The path picks the behaviour: '/ok' serves normally, '/truncated' closes after
+    1000 bytes the first time, '/flaky' answers 503 the first time, '/slow' stalls
+    past the client timeout the first time, '/norange' ignores Range headers and
+    '/missing' is a 404.
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        name = self.path.split('?')[0].strip('/')
+        hits = self.server.hits
+        hits[name] = hits.get(name, 0) + 1
+        first = hits[name] == 1
+        data = self.server.data
+
+        if name == 'missing':
+            self.send_error(404)
+            return
+        if name == 'flaky' and first:
+            self.send_error(503)
+            return
+        if name == 'slow' and first:
+            time.sleep(self.server.stall)
+
+        start = 0
+        rangeHeader = self.headers.get('Range')
+        if rangeHeader is not None and name != 'norange':
+            start = int(rangeHeader.split('=')[1].split('-')[0])
+            self.server.ranges.append((name, start))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+
+        body = data[start:]
+        if name == 'truncated' and first:
+            body = body[:1000]
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+class RetrieveTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        cls.server.daemon_threads = True
+        cls.server.data = os.urandom(FIXTURE_SIZE)
+        cls.server.stall = 1.
+        cls.digest = hashlib.sha256(cls.server.data).hexdigest()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.host = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.hits = {}
+        self.server.ranges = []
+        self.dump = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dump)
+
+    def retrieve(self, source, **kwargs):
+        kwargs.setdefault('timeout', 5.)
+        kwargs.setdefault('retries', 1)
+        return datadingsItr.retrieveFile(source, self.dump, **kwargs)
+
+    def assertComplete(self, result):
+        self.assertEqual(result.size, FIXTURE_SIZE)
+        with open(result.path, 'rb') as f:
+            self.assertEqual(f.read(), self.server.data)
+        self.assertFalse(os.path.exists(result.path + datadingsItr.PART_SUFFIX))
+
+    def test_download_then_skip(self):
+        result = self.retrieve(f'{self.host}/ok sha256:{self.digest}')
+        self.assertEqual(result.status, 'downloaded')
+        self.assertComplete(result)
+        self.assertEqual(self.retrieve(f'{self.host}/ok sha256:{self.digest}').status, 'skipped')
+        self.assertEqual(self.server.hits['ok'], 1)
+
+    def test_truncated_resumes(self):
+        result = self.retrieve(f'{self.host}/truncated')
+        self.assertEqual(result.status, 'resumed')
+        self.assertComplete(result)
+        self.assertEqual(self.server.ranges, [('truncated', 1000)])
+
+    def test_truncated_without_retries_keeps_part(self):
+        result = self.retrieve(f'{self.host}/truncated', retries=0)
+        self.assertEqual(result.status, 'failed')
+        self.assertIn('incomplete', result.error)
+        self.assertFalse(os.path.exists(result.path))
+        self.assertEqual(os.path.getsize(result.path + datadingsItr.PART_SUFFIX), 1000)
+
+        # The next run picks up where the last one stopped instead of skipping
+        result = self.retrieve(f'{self.host}/truncated', retries=0)
+        self.assertEqual(result.status, 'resumed')
+        self.assertComplete(result)
+
+    def test_complete_part_is_published(self):
+        with open(os.path.join(self.dump, 'ok' + datadingsItr.PART_SUFFIX), 'wb') as f:
+            f.write(self.server.data)
+        result = self.retrieve(f'{self.host}/ok')
+        self.assertEqual(result.status, 'resumed')
+        self.assertComplete(result)
+
+    def test_range_ignored(self):
+        with open(os.path.join(self.dump, 'norange' + datadingsItr.PART_SUFFIX), 'wb') as f:
+            f.write(self.server.data[:1000])
+        result = self.retrieve(f'{self.host}/norange')
+        self.assertEqual(result.status, 'downloaded')
+        self.assertComplete(result)
+
+    def test_flaky_retries(self):
+        result = self.retrieve(f'{self.host}/flaky')
+        self.assertEqual(result.status, 'downloaded')
+        self.assertComplete(result)
+        self.assertEqual(self.server.hits['flaky'], 2)
+
+    def test_slow_times_out_then_retries(self):
+        result = self.retrieve(f'{self.host}/slow', timeout=self.server.stall / 4)
+        self.assertEqual(result.status, 'downloaded')
+        self.assertComplete(result)
+
+    def test_missing_is_not_retried(self):
+        result = self.retrieve(f'{self.host}/missing', retries=3)
+        self.assertEqual(result.status, 'failed')
+        self.assertIn('404', result.error)
+        self.assertEqual(self.server.hits['missing'], 1)
+
+    def test_checksum_mismatch_is_not_published(self):
+        result = self.retrieve(f'{self.host}/ok sha256:{"0" * 64}', retries=0)
+        self.assertEqual(result.status, 'failed')
+        self.assertIn('mismatch', result.error)
+        self.assertFalse(os.path.exists(result.path))
+        self.assertFalse(os.path.exists(result.path + datadingsItr.PART_SUFFIX))
+
+    def test_unknown_checksum_fails_alone(self):
+        path = os.path.join(self.dump, 'bundle.srcs')
+        with open(path, 'w') as f:
+            f.write(f'[good]:\n{self.host}/ok\n[bad]:\n{self.host}/ok?bad crc32:abcd\n')
+        manifest = datadingsItr.retrieveSources(datadingsItr.loadSourcesBundle(path), verbose=False, retries=0)
+        self.assertEqual(manifest['good'][0].status, 'downloaded')
+        self.assertEqual(manifest['bad'][0].status, 'failed')
+        self.assertIn('crc32', manifest['bad'][0].error)
+
+
+if __name__ == '__main__':
+    unittest.main()
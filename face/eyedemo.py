@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 import os
 
+from eyerender import EyeRenderer
+from occupancy import OccupancyIndex
+
 # CONFIG
 OUTER_IRIS_RATIO = 1
 INNER_IRIS_RATIO = 0.666
@@ -10,8 +13,9 @@ Y_STRIDE = 16
 X_STRIDE = 2
 
 __path__ = os.path.dirname(os.path.abspath(__file__))
-occupancy = np.genfromtxt(__path__+os.path.sep+'maskOccupancy.csv', delimiter=',').transpose()
+occupancy = OccupancyIndex.forMask(__path__+os.path.sep+'mask.png').occupancy
 mask = cv2.imread(__path__+os.path.sep+'mask.png')
+renderer = EyeRenderer(mask)
 
 enditer = False
 for i in range(occupancy.shape[0]):
@@ -22,15 +26,12 @@ for i in range(occupancy.shape[0]):
     for j in range(occupancy.shape[1]):
         if j % X_STRIDE != 0: continue
         
-        #img = np.zeros((occupancy.shape[0], occupancy.shape[1], 3), np.uint8)
-        img = (np.copy(mask)*0.25).astype(np.uint8)
         maxRadius = occupancy[i][j]-IRIS_PADDING
         if maxRadius < 0: continue
 
-        img = cv2.circle(img, (j,i), int(maxRadius*OUTER_IRIS_RATIO), (255,255,255), thickness=-1)
-        img = cv2.circle(img, (j,i), int(maxRadius*INNER_IRIS_RATIO), (0,0,0), thickness=-1)
+        renderer.render((j,i), maxRadius)
 
-        cv2.imshow('iris', img)
+        cv2.imshow('iris', renderer.canvas)
         if cv2.waitKey(1) & 0xFF == ord('q'):
             enditer = True
             break
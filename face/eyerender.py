@@ -0,0 +1,190 @@
+import cv2
+import math
+import numpy as np
+import os
+import time
+
+# CONFIG
+OUTER_IRIS_RATIO = 1
+INNER_IRIS_RATIO = 0.666
+MASK_DIM = 0.25
+RADIUS_BUCKET = None
+
+PIXEL_BGR888 = 'bgr888'
+PIXEL_RGB565 = 'rgb565'
+PIXEL_SIZES = {PIXEL_BGR888: 3, PIXEL_RGB565: 2}
+
+
+def encodePixels(region:np.ndarray, pixelFormat:str) -> np.ndarray:
+    # Panels over SPI take RGB565 most significant byte first
+    if pixelFormat == PIXEL_RGB565:
+        packed = cv2.cvtColor(region, cv2.COLOR_BGR2BGR565)
+        return np.ascontiguousarray(packed[..., ::-1])
+    return np.ascontiguousarray(region)
+
+def decodePixels(data:np.ndarray, pixelFormat:str) -> np.ndarray:
+    if pixelFormat == PIXEL_RGB565:
+        return cv2.cvtColor(np.ascontiguousarray(data[..., ::-1]), cv2.COLOR_BGR5652BGR)
+    return data
+
+
+class MemoryFramebuffer(object):
+    """A stand-in for the panel, taking windowed writes of native pixels into memory.
+    """
+    def __init__(self, width:int, height:int, pixelFormat:str=PIXEL_RGB565):
+        self.width = width
+        self.height = height
+        self.pixelFormat = pixelFormat
+        self.pixels = np.zeros((height, width, PIXEL_SIZES[pixelFormat]), dtype=np.uint8)
+        self.bytesWritten = 0
+        self.writes = 0
+
+    def write(self, x:int, y:int, width:int, height:int, data:bytes):
+        # The same shape of call as setting the address window then streaming the pixels
+        region = np.frombuffer(data, dtype=np.uint8).reshape(height, width, -1)
+        self.pixels[y:y+height, x:x+width] = region
+        self.bytesWritten += len(data)
+        self.writes += 1
+
+    def snapshot(self) -> np.ndarray:
+        return decodePixels(self.pixels, self.pixelFormat)
+
+
+class EyeRenderer(object):
+    """Draws the iris over the dimmed mask, touching only what moved.
+
+    The dimmed mask is made once and the iris sprites once per pair of drawn circle
+    radii. Every frame restores the old iris rectangle from the base, blits the new
+    sprite, and pushes only the union of the two rectangles to the framebuffer.
+
+    Without a radiusBucket every frame is pixel for pixel what renderFull() draws for
+    the same radius. A bucket rounds radii down to its multiples first, trading that
+    for fewer sprites.
+    """
+    def __init__(self, mask:np.ndarray, framebuffer=None, pixelFormat:str=PIXEL_RGB565, dim:float=MASK_DIM,
+        radiusBucket:float=RADIUS_BUCKET):
+        self.base = (mask.astype(np.float32) * dim).astype(np.uint8)
+        self.canvas = np.copy(self.base)
+        self.height, self.width = self.base.shape[:2]
+        self.pixelFormat = pixelFormat
+        self.framebuffer = framebuffer
+        self.radiusBucket = radiusBucket
+        self.sprites = {}
+        self.lastRect = None
+
+        if framebuffer is not None:
+            framebuffer.write(0, 0, self.width, self.height, encodePixels(self.canvas, pixelFormat).tobytes())
+
+    def circleSprite(self, outer:int, inner:int):
+        # Keyed by the radii actually drawn, the same truncation renderFull() applies
+        key = (outer, inner)
+        if key not in self.sprites:
+            side = 2 * outer + 1
+            color = np.zeros((side, side, 3), dtype=np.uint8)
+            cover = np.zeros((side, side), dtype=np.uint8)
+            cv2.circle(color, (outer, outer), outer, (255, 255, 255), thickness=-1)
+            cv2.circle(color, (outer, outer), inner, (0, 0, 0), thickness=-1)
+            cv2.circle(cover, (outer, outer), outer, 255, thickness=-1)
+            self.sprites[key] = (color, cover.astype(bool))
+        return outer, self.sprites[key]
+
+    def sprite(self, radius:float):
+        if self.radiusBucket is not None:
+            radius = radius // self.radiusBucket * self.radiusBucket
+        return self.circleSprite(int(radius * OUTER_IRIS_RATIO), int(radius * INNER_IRIS_RATIO))
+
+    def prerender(self, maxRadius:float):
+        if self.radiusBucket is not None:
+            for radius in np.arange(0, maxRadius + self.radiusBucket, self.radiusBucket):
+                self.sprite(radius)
+            return
+
+        # Every inner radius reachable from the radii that draw each outer one
+        for outer in range(0, int(maxRadius * OUTER_IRIS_RATIO) + 1):
+            low, high = outer / OUTER_IRIS_RATIO, (outer + 1) / OUTER_IRIS_RATIO
+            for inner in range(int(low * INNER_IRIS_RATIO), math.ceil(high * INNER_IRIS_RATIO)):
+                self.circleSprite(outer, inner)
+
+    def clip(self, x0:int, y0:int, x1:int, y1:int):
+        return max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height)
+
+    def render(self, center, radius:float):
+        """Move the iris and push the changed region.
+
+        Returns the (x0, y0, x1, y1) rectangle that was pushed, None if nothing was.
+        """
+        half, (color, cover) = self.sprite(max(radius, 0))
+        cx, cy = int(center[0]), int(center[1])
+        rect = self.clip(cx - half, cy - half, cx + half + 1, cy + half + 1)
+        if rect[0] >= rect[2] or rect[1] >= rect[3]:
+            rect = None
+
+        # Wipe the old iris back to the base, then lay the new one down
+        old = self.lastRect
+        if old is not None:
+            self.canvas[old[1]:old[3], old[0]:old[2]] = self.base[old[1]:old[3], old[0]:old[2]]
+        if rect is not None:
+            sx, sy = rect[0] - (cx - half), rect[1] - (cy - half)
+            area = self.canvas[rect[1]:rect[3], rect[0]:rect[2]]
+            spriteCover = cover[sy:sy + rect[3] - rect[1], sx:sx + rect[2] - rect[0]]
+            spriteColor = color[sy:sy + rect[3] - rect[1], sx:sx + rect[2] - rect[0]]
+            np.copyto(area, spriteColor, where=spriteCover[..., None])
+        self.lastRect = rect
+
+        rects = [r for r in (old, rect) if r is not None]
+        if len(rects) == 0:
+            return None
+        dirty = (min(r[0] for r in rects), min(r[1] for r in rects), max(r[2] for r in rects), max(r[3] for r in rects))
+        if self.framebuffer is not None:
+            region = encodePixels(self.canvas[dirty[1]:dirty[3], dirty[0]:dirty[2]], self.pixelFormat)
+            self.framebuffer.write(dirty[0], dirty[1], dirty[2] - dirty[0], dirty[3] - dirty[1], region.tobytes())
+        return dirty
+
+
+def renderFull(mask:np.ndarray, center, radius:float) -> np.ndarray:
+    # How every frame used to be made, kept to compare against
+    img = (np.copy(mask)*MASK_DIM).astype(np.uint8)
+    img = cv2.circle(img, center, int(radius*OUTER_IRIS_RATIO), (255,255,255), thickness=-1)
+    return cv2.circle(img, center, int(radius*INNER_IRIS_RATIO), (0,0,0), thickness=-1)
+
+def benchRenderer(mask:np.ndarray, positions, pixelFormat:str=PIXEL_RGB565):
+    height, width = mask.shape[:2]
+    pixelSize = PIXEL_SIZES[pixelFormat]
+
+    start = time.perf_counter()
+    for center, radius in positions:
+        encodePixels(renderFull(mask, center, radius), pixelFormat).tobytes()
+    full = time.perf_counter() - start
+    print(f'full frame : {len(positions)/full:9.1f} frames/s, {width*height*pixelSize:8d} bytes/frame')
+
+    framebuffer = MemoryFramebuffer(width, height, pixelFormat)
+    renderer = EyeRenderer(mask, framebuffer, pixelFormat=pixelFormat)
+    renderer.prerender(max(radius for _, radius in positions))
+    initial = framebuffer.bytesWritten
+    start = time.perf_counter()
+    for center, radius in positions:
+        renderer.render(center, radius)
+    incremental = time.perf_counter() - start
+    pushed = (framebuffer.bytesWritten - initial) / max(len(positions), 1)
+    print(f'incremental: {len(positions)/incremental:9.1f} frames/s, {pushed:8.0f} bytes/frame')
+
+    # The panel should hold exactly what a full redraw gives, checked along the way too
+    renderer = EyeRenderer(mask, MemoryFramebuffer(width, height, pixelFormat), pixelFormat=pixelFormat)
+    step = max(len(positions) // 64, 1)
+    for idx, (center, radius) in enumerate(positions):
+        renderer.render(center, radius)
+        if idx % step == 0 or idx == len(positions) - 1:
+            expected = decodePixels(encodePixels(renderFull(mask, center, radius), pixelFormat), pixelFormat)
+            assert np.array_equal(renderer.framebuffer.snapshot(), expected), f"mismatch at {center}, radius {radius}"
+
+
+if __name__ == '__main__':
+    from occupancy import OccupancyIndex
+    path = os.path.dirname(os.path.abspath(__file__))
+    mask = cv2.imread(path+os.path.sep+'mask.png')
+    occupancy = OccupancyIndex.forMask(path+os.path.sep+'mask.png').occupancy - 10
+
+    # The same sweep over the rows as eyedemo's
+    positions = [((j, i), occupancy[i, j]) for i in range(0, mask.shape[0], 16)
+        for j in range(0, mask.shape[1], 2) if occupancy[i, j] > 0]
+    benchRenderer(mask, positions)
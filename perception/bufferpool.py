@@ -0,0 +1,125 @@
+import numpy as np
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, List
+
+DEFAULT_MAX_FREE = 8
+
+
+class BufferPool(object):
+    """Hands out and takes back image buffers keyed by (shape, format, backend), so a
+    steady pipeline allocates once per distinct buffer and then only recycles.
+
+    A buffer that's never released is simply collected, the pool holds no reference
+    to anything it has handed out.
+    """
+    def __init__(self, maxFree:int=DEFAULT_MAX_FREE):
+        self.maxFree = maxFree
+        self.free: Dict[Hashable, List[Any]] = {}
+        self.lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+
+    def key(self, shape, format, backend) -> Hashable:
+        return (tuple(shape), format, backend)
+
+    def keyOf(self, buffer, backend) -> Hashable:
+        raise NotImplementedError
+
+    def allocate(self, shape, format, backend):
+        raise NotImplementedError
+
+    def acquire(self, shape, format, backend=None):
+        key = self.key(shape, format, backend)
+        with self.lock:
+            stack = self.free.get(key)
+            if stack:
+                self.reuses += 1
+                return stack.pop()
+            self.allocations += 1
+        return self.allocate(shape, format, backend)
+
+    def release(self, buffer, backend=None):
+        key = self.keyOf(buffer, backend)
+        if key is None:
+            return
+        with self.lock:
+            stack = self.free.setdefault(key, [])
+            if len(stack) < self.maxFree:
+                stack.append(buffer)
+
+    @contextmanager
+    def borrow(self, shape, format, backend=None):
+        buffer = self.acquire(shape, format, backend)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer, backend)
+
+    def clear(self):
+        with self.lock:
+            self.free.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'allocations': self.allocations,
+                'reuses': self.reuses,
+                'free': sum(len(stack) for stack in self.free.values()),
+            }
+
+
+class NumpyPool(BufferPool):
+    # Formats are numpy dtypes and the backend is always the cpu
+    def key(self, shape, format, backend) -> Hashable:
+        return (tuple(shape), np.dtype(format).str, None)
+
+    def keyOf(self, buffer:np.ndarray, backend) -> Hashable:
+        # Views borrow someone else's memory, only whole arrays go back in the pool
+        if not buffer.flags.owndata:
+            return None
+        return (buffer.shape, buffer.dtype.str, None)
+
+    def allocate(self, shape, format, backend) -> np.ndarray:
+        return np.empty(shape, dtype=format)
+
+
+class VPIPool(BufferPool):
+    # Shapes are VPI (width, height) sizes and formats are vpi.Format values
+    def __init__(self, maxFree:int=DEFAULT_MAX_FREE):
+        super(VPIPool, self).__init__(maxFree=maxFree)
+        import vpi
+        self.vpi = vpi
+
+    def keyOf(self, buffer, backend) -> Hashable:
+        return (tuple(buffer.size), buffer.format, backend)
+
+    def allocate(self, shape, format, backend):
+        return self.vpi.Image(tuple(shape), format)
+
+
+def benchPool(shapes=((1080, 1920, 3), (1080, 1920), (2464, 3280, 3)), iterations:int=200):
+    pool = NumpyPool()
+    for shape in shapes:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            buffer = np.empty(shape, dtype=np.uint8)
+            buffer.fill(0)
+        allocated = (time.perf_counter() - start) / iterations
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with pool.borrow(shape, np.uint8) as buffer:
+                buffer.fill(0)
+        pooled = (time.perf_counter() - start) / iterations
+        print(f'{str(shape):16s}: allocate {allocated*1e6:9.1f}us, pooled {pooled*1e6:9.1f}us')
+
+    stats = pool.stats()
+    assert stats['allocations'] == len(shapes)
+    print(f'{stats["allocations"]} allocations, {stats["reuses"]} reuses')
+
+
+if __name__ == '__main__':
+    benchPool()
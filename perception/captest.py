@@ -1,72 +1,81 @@
 import cv2 as cv
+import numpy as np
 import syscamera as camera
-import vpi
-import gc
+import disparity
+from bufferpool import NumpyPool
+from captureloop import AsyncWriter, CaptureLoop, FORMAT_PNG
+import sys
 import time
+import tracing
 
 
 START_CAP_FRAME = 10
 STOP_CAP_FRAME = 20
+CAPTURE_FPS = 31
 
 WINDOW_NAME = 'Disparity'
-PVA_NVENC_VIC = vpi.Backend.PVA | vpi.Backend.NVENC | vpi.Backend.VIC
 
 
 captures = []
-retVal = True
 
 for idx in range(2):
     config = camera.configurationString(idx, 1920, 1080, 30)
     captures.append(cv.VideoCapture(config, cv.CAP_GSTREAMER))
 
-frameCache = []
-cacheClr: int = 0
-frameNum: int = 0
-
-while retVal and len(frameCache) < (STOP_CAP_FRAME-START_CAP_FRAME):
-    if cacheClr % 5 == 0:
-        gc.collect()
-        vpi.clear_cache()
-    cacheClr = cacheClr + 1
-
-    frames = []
-    rawFrames = []
-    for cap in captures:
-        ret, frame = cap.read()
-        rawFrames.append(frame)
-        retVal = (retVal and ret)
-        if not retVal:
-            break
-        with vpi.Backend.CUDA:
-            gray = vpi.asimage(frame).convert(vpi.Format.Y16_ER).rescale((1920,1080))
-        with vpi.Backend.VIC:
-            grayBL = gray.convert(vpi.Format.Y16_ER_BL)
-        frames.append(grayBL)
-    frameNum = frameNum + 1
-    
-    frames = frames[::-1]
-    rawFrames = rawFrames[::-1]
-    confMap = vpi.Image(frames[0].size, vpi.Format.U16)
-    disp = vpi.stereodisp(frames[0], frames[1], out_confmap=confMap, backend=PVA_NVENC_VIC, window=5, maxdisp=256)
-    dispConv = disp.convert(vpi.Format.U8, backend=vpi.Backend.CUDA, scale=255.0/(32*256))
-    dispColor = cv.applyColorMap(dispConv.cpu(), cv.COLORMAP_JET)
-    
-    confMapConv = confMap.convert(vpi.Format.U8, backend=vpi.Backend.CUDA, scale=255.0/65535)
-    mask = cv.threshold(confMapConv.cpu(), 1, 255, cv.THRESH_BINARY)[1]
-    mask = cv.cvtColor(mask, cv.COLOR_GRAY2BGR)
-    dispColor = cv.bitwise_and(dispColor, mask)
-
-
-    if retVal:
-        if frameNum >= START_CAP_FRAME:
-            cv.imwrite(str(frameNum) + ".bmp", dispColor)
-            frameCache.append(dispColor)
-            print(f'savenum: {frameNum}')
-        else:
-            print(f'dropnum: {frameNum}')
-        
-        time.sleep(1./31)        
+# Both cameras capture on their own threads, the pairs are matched by capture time
+stereo = camera.StereoCapture.open(captures[0], captures[1]).start()
+# Every buffer of the loop is recycled through the pools instead of collected
+pool = NumpyPool()
+backend = disparity.createBackend(sys.argv[1] if len(sys.argv) > 1 else None, pool=pool)
 
+# Saved frames go out on the writer's threads and come back to the pool once written
+writer = AsyncWriter('.', format=FORMAT_PNG, release=pool.release)
+loop = CaptureLoop(CAPTURE_FPS, writer=writer)
+frameTimes = []
+savedFrames: int = 0
+
+def step(frameNum:int) -> bool:
+    global savedFrames
+    frameStart = time.perf_counter()
+    with tracing.span('readPair'):
+        pair = stereo.read_pair(timeout=1.)
+    if pair is None:
+        return False
+
+    # The second camera is the left eye, the frames are only borrowed until the disparity is back
+    dispColor = pool.acquire(pair.left.image.shape, np.uint8)
+    backend.process(pair.right.image, pair.left.image, out=dispColor)
+    stereo.release(pair)
+    frameTimes.append(time.perf_counter() - frameStart)
+
+    if frameNum >= START_CAP_FRAME:
+        writer.submit(dispColor, frameNum)
+        savedFrames = savedFrames + 1
+        print(f'savenum: {frameNum}')
+    else:
+        pool.release(dispColor)
+        print(f'dropnum: {frameNum}')
+    return savedFrames < (STOP_CAP_FRAME-START_CAP_FRAME)
+
+if tracing.STATE.enabled:
+    tracing.startSummaries()
+loopStats = loop.run(step, start=1)
+writer.close()
+
+
+stats = stereo.stats()
+print(f'pairs: {stats["pairs"]}, skew: {stats["skewMean"]*1e3:.2f}ms mean {stats["skewMax"]*1e3:.2f}ms max')
+print(f'loop: {loopStats["fps"]:.2f} fps, {loopStats["late"]} late, {loopStats["dropped"]} dropped, '
+    + f'{loopStats["writesDropped"]} writes dropped')
+frameTimes = np.array(frameTimes) * 1e3
+print(f'frame: {np.mean(frameTimes):.2f}ms mean {np.percentile(frameTimes, 99):.2f}ms p99, buffers: {pool.stats()}')
+stereo.stop()
+backend.close()
+
+if tracing.STATE.enabled:
+    tracing.stopSummaries()
+    print(tracing.summary())
+    tracing.exportChromeTrace('captest.trace.json')
 
 for cap in captures:
     cap.release()
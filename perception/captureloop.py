@@ -0,0 +1,243 @@
+import cv2 as cv
+import numpy as np
+
+import argparse
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+import tracing
+
+FORMAT_NPY = 'npy'
+FORMAT_PNG = 'png'
+FORMAT_VIDEO = 'video'
+DEFAULT_PNG_LEVEL = 1
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_WRITERS = 2
+DEFAULT_FOURCC = 'MJPG'
+SPIN_MARGIN = 0.0005
+
+
+class AsyncWriter(object):
+    """Writes frames on a pool of background threads behind a bounded queue, so disk
+    stalls never land on the capture loop.
+
+    The writer owns a frame from submit() until it's on disk, then hands it to the
+    release callback, which is where pooled buffers go back to their pool. A full
+    queue drops the frame and counts it rather than blocking the loop. Video goes
+    through a single thread to keep the frames in order.
+    """
+    def __init__(self, directory:str, format:str=FORMAT_PNG, workers:int=DEFAULT_WRITERS,
+        queueSize:int=DEFAULT_QUEUE_SIZE, pngLevel:int=DEFAULT_PNG_LEVEL, fps:float=30.,
+        fourcc:str=DEFAULT_FOURCC, release:Callable[[np.ndarray], None]=None, prefix:str=''):
+        assert format in (FORMAT_NPY, FORMAT_PNG, FORMAT_VIDEO)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.pngLevel = pngLevel
+        self.fps = fps
+        self.fourcc = fourcc
+        self.release = release
+        self.prefix = prefix
+        self.video = None
+
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        if format == FORMAT_VIDEO:
+            workers = 1
+        self.threads = [threading.Thread(target=self.writeLoop, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, frame:np.ndarray, index:int) -> bool:
+        try:
+            self.queue.put_nowait((frame, index))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            if self.release is not None:
+                self.release(frame)
+            return False
+
+    @tracing.traced('write')
+    def write(self, frame:np.ndarray, index:int):
+        path = os.path.join(self.directory, f'{self.prefix}{index}')
+        if self.format == FORMAT_NPY:
+            np.save(path + '.npy', frame)
+        elif self.format == FORMAT_PNG:
+            cv.imwrite(path + '.png', frame, [cv.IMWRITE_PNG_COMPRESSION, self.pngLevel])
+        else:
+            if self.video is None:
+                self.video = cv.VideoWriter(os.path.join(self.directory, f'{self.prefix}capture.avi'),
+                    cv.VideoWriter_fourcc(*self.fourcc), self.fps, (frame.shape[1], frame.shape[0]),
+                    frame.ndim == 3)
+            self.video.write(frame)
+
+    def writeLoop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            frame, index = item
+            try:
+                self.write(frame, index)
+                with self.lock:
+                    self.written += 1
+            except (cv.error, OSError):
+                with self.lock:
+                    self.errors += 1
+            finally:
+                if self.release is not None:
+                    self.release(frame)
+                self.queue.task_done()
+
+    def close(self):
+        # Everything already queued still gets written
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.video is not None:
+            self.video.release()
+            self.video = None
+
+
+class Pacer(object):
+    """Paces a loop to a frame rate against absolute deadlines, sleeping only for what
+    is left of each frame's budget.
+
+    An iteration that ends past its deadline is late. One that ends more than a whole
+    period past it has cost the loop frame slots, which are counted as dropped and
+    skipped so the loop realigns instead of bursting to catch up.
+    """
+    def __init__(self, fps:float):
+        self.period = 1. / fps
+        self.deadline = None
+        self.late = 0
+        self.dropped = 0
+
+    def start(self):
+        self.deadline = time.monotonic() + self.period
+
+    def wait(self):
+        if self.deadline is None:
+            self.start()
+        now = time.monotonic()
+        if now > self.deadline:
+            self.late += 1
+            behind = int((now - self.deadline) / self.period)
+            if behind > 0:
+                self.dropped += behind
+                self.deadline += behind * self.period
+        else:
+            # Sleep most of the way, then spin out the last bit the scheduler can't hit
+            remaining = self.deadline - now
+            if remaining > SPIN_MARGIN:
+                time.sleep(remaining - SPIN_MARGIN)
+            while time.monotonic() < self.deadline:
+                pass
+        self.deadline += self.period
+
+
+class CaptureLoop(object):
+    """Runs a capture step per frame period, with an optional writer for its output.
+    """
+    def __init__(self, fps:float, writer:AsyncWriter=None):
+        self.pacer = Pacer(fps)
+        self.writer = writer
+        self.frames = 0
+        self.periods = []
+
+    def run(self, step:Callable[[int], Optional[bool]], start:int=0, frames:int=None) -> dict:
+        """Call step with the frame number every period until it returns False or the
+        frame count is reached.
+        """
+        index = start
+        last = time.monotonic()
+        self.pacer.start()
+        while frames is None or self.frames < frames:
+            keepGoing = step(index)
+            self.frames += 1
+            index += 1
+            if keepGoing is False:
+                break
+            self.pacer.wait()
+            now = time.monotonic()
+            self.periods.append(now - last)
+            last = now
+        return self.stats()
+
+    def stats(self) -> dict:
+        periods = np.array(self.periods) if len(self.periods) > 0 else np.zeros(1)
+        error = np.abs(periods - self.pacer.period)
+        result = {
+            'frames': self.frames,
+            'late': self.pacer.late,
+            'dropped': self.pacer.dropped,
+            'fps': 1. / np.mean(periods) if np.mean(periods) > 0 else 0.,
+            'periodErrorMean': float(np.mean(error)),
+            'periodErrorP99': float(np.percentile(error, 99)),
+        }
+        if self.writer is not None:
+            result['written'] = self.writer.written
+            result['writesDropped'] = self.writer.dropped
+        return result
+
+
+class SyntheticSource(object):
+    # Frames after a jittered amount of simulated capture and processing work
+    def __init__(self, shape=(1080, 1920, 3), work:float=0.01, jitter:float=0.003, stallEvery:int=0,
+        stall:float=0.1, seed:int=0):
+        self.frame = np.random.RandomState(seed).randint(0, 256, shape, dtype=np.uint8)
+        self.work = work
+        self.jitter = jitter
+        self.stallEvery = stallEvery
+        self.stall = stall
+        self.rng = np.random.RandomState(seed)
+        self.count = 0
+
+    def read(self) -> np.ndarray:
+        self.count += 1
+        delay = max(self.work + self.rng.normal(0., self.jitter), 0.)
+        if self.stallEvery > 0 and self.count % self.stallEvery == 0:
+            delay += self.stall
+        time.sleep(delay)
+        return self.frame
+
+
+def checkPacing(fps:float=30., frames:int=150, format:str=FORMAT_PNG, directory:str=None, stallEvery:int=50):
+    import tempfile
+    source = SyntheticSource(stallEvery=stallEvery)
+    with tempfile.TemporaryDirectory() as scratch:
+        with AsyncWriter(directory or scratch, format=format, fps=fps) as writer:
+            loop = CaptureLoop(fps, writer=writer)
+            stats = loop.run(lambda index: writer.submit(np.copy(source.read()), index) or True, frames=frames)
+        stats['written'] = writer.written
+
+    print(f'{format:5s} @ {fps} fps: {stats["fps"]:6.2f} fps achieved, period error {stats["periodErrorMean"]*1e3:.3f}ms '
+        + f'mean {stats["periodErrorP99"]*1e3:.3f}ms p99, {stats["late"]} late, {stats["dropped"]} dropped, '
+        + f'{stats["written"]} written, {stats["writesDropped"]} writes dropped')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the pacing of the capture loop on synthetic frames.')
+    parser.add_argument('--fps', type=float, default=30.)
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--out', type=str, default=None, help='Keep the written frames here.')
+    args = parser.parse_args()
+
+    for format in (FORMAT_NPY, FORMAT_PNG, FORMAT_VIDEO):
+        checkPacing(fps=args.fps, frames=args.frames, format=format, directory=args.out)
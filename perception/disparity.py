@@ -0,0 +1,267 @@
+import cv2 as cv
+import numpy as np
+
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import tracing
+from bufferpool import NumpyPool, VPIPool
+
+DEFAULT_MAX_DISPARITY = 256
+DEFAULT_WINDOW = 5
+DEFAULT_CONFIDENCE_THRESHOLD = 1
+DEFAULT_STRIP_OVERLAP = 32
+BACKEND_ENV = 'DISPARITY_BACKEND'
+
+
+class DisparityBackend(object):
+    """The stereo pipeline of captest behind one interface.
+
+    compute() takes a BGR left and right frame and gives back the disparity as uint8,
+    255 being the max disparity, along with a uint8 confidence map. colorize() and
+    mask() turn those into the masked color view captest saves.
+
+    Intermediate buffers come out of, and go back to, the backend's pool, so the
+    buffers compute() returns may be handed to pool.release() once used.
+    """
+    name = None
+
+    def __init__(self, maxDisparity:int=DEFAULT_MAX_DISPARITY, window:int=DEFAULT_WINDOW, pool:NumpyPool=None):
+        self.maxDisparity = maxDisparity
+        self.window = window
+        self.pool = NumpyPool() if pool is None else pool
+
+    def compute(self, left:np.ndarray, right:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    @tracing.traced('colormap')
+    def colorize(self, disparity:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        return cv.applyColorMap(disparity, cv.COLORMAP_JET, dst=out)
+
+    @tracing.traced('confidenceMask')
+    def mask(self, color:np.ndarray, confidence:np.ndarray, threshold:int=DEFAULT_CONFIDENCE_THRESHOLD,
+        out:np.ndarray=None) -> np.ndarray:
+        with self.pool.borrow(confidence.shape, np.uint8) as valid:
+            cv.threshold(confidence, threshold, 255, cv.THRESH_BINARY, dst=valid)
+            # A masked and only writes the kept pixels, a recycled output needs clearing first
+            if out is None:
+                out = np.zeros_like(color)
+            else:
+                out.fill(0)
+            cv.bitwise_and(color, color, dst=out, mask=valid)
+        return out
+
+    def process(self, left:np.ndarray, right:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+        disparity, confidence = self.compute(left, right)
+        with self.pool.borrow(disparity.shape + (3,), np.uint8) as color:
+            self.colorize(disparity, out=color)
+            out = self.mask(color, confidence, out=out)
+        self.pool.release(disparity)
+        self.pool.release(confidence)
+        return out
+
+    def close(self):
+        pass
+
+
+class VPIDisparity(DisparityBackend):
+    name = 'vpi'
+
+    def __init__(self, maxDisparity:int=DEFAULT_MAX_DISPARITY, window:int=DEFAULT_WINDOW,
+        size:Tuple[int, int]=None, pool:NumpyPool=None, imagePool:VPIPool=None):
+        super(VPIDisparity, self).__init__(maxDisparity=maxDisparity, window=window, pool=pool)
+        import vpi
+        self.vpi = vpi
+        self.size = size
+        self.backend = vpi.Backend.PVA | vpi.Backend.NVENC | vpi.Backend.VIC
+        self.images = VPIPool() if imagePool is None else imagePool
+
+    def prepare(self, frame:np.ndarray):
+        vpi = self.vpi
+        size = (frame.shape[1], frame.shape[0]) if self.size is None else self.size
+        with tracing.span('y16Convert'), vpi.Backend.CUDA:
+            gray = self.images.acquire(size, vpi.Format.Y16_ER, vpi.Backend.CUDA)
+            if self.size is None:
+                vpi.asimage(frame).convert(vpi.Format.Y16_ER, out=gray)
+            else:
+                full = self.images.acquire((frame.shape[1], frame.shape[0]), vpi.Format.Y16_ER, vpi.Backend.CUDA)
+                vpi.asimage(frame).convert(vpi.Format.Y16_ER, out=full)
+                full.rescale(self.size, out=gray)
+                self.images.release(full, vpi.Backend.CUDA)
+        with tracing.span('blockLinearConvert'), vpi.Backend.VIC:
+            grayBL = self.images.acquire(size, vpi.Format.Y16_ER_BL, vpi.Backend.VIC)
+            gray.convert(vpi.Format.Y16_ER_BL, out=grayBL)
+        self.images.release(gray, vpi.Backend.CUDA)
+        return grayBL
+
+    def compute(self, left:np.ndarray, right:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        vpi = self.vpi
+        images = self.images
+        left, right = self.prepare(left), self.prepare(right)
+        confMap = images.acquire(left.size, vpi.Format.U16, self.backend)
+        disp = images.acquire(left.size, vpi.Format.S16, self.backend)
+        with tracing.span('stereodisp'):
+            vpi.stereodisp(left, right, out=disp, out_confmap=confMap, backend=self.backend,
+                window=self.window, maxdisp=self.maxDisparity)
+
+        # Disparity comes out in Q10.5 fixed point, confidence over the whole U16 range
+        dispConv = images.acquire(left.size, vpi.Format.U8, vpi.Backend.CUDA)
+        confConv = images.acquire(left.size, vpi.Format.U8, vpi.Backend.CUDA)
+        with tracing.span('disparityConvert'):
+            disp.convert(vpi.Format.U8, backend=vpi.Backend.CUDA, scale=255.0/(32*self.maxDisparity), out=dispConv)
+            confMap.convert(vpi.Format.U8, backend=vpi.Backend.CUDA, scale=255.0/65535, out=confConv)
+            result = (dispConv.cpu(), confConv.cpu())
+
+        for image in (left, right):
+            images.release(image, vpi.Backend.VIC)
+        for image in (confMap, disp):
+            images.release(image, self.backend)
+        for image in (dispConv, confConv):
+            images.release(image, vpi.Backend.CUDA)
+        return result
+
+
+class SGBMDisparity(DisparityBackend):
+    """Semi-global block matching on the CPU, optionally over horizontal strips matched
+    on a thread pool. The strips overlap so the path costs settle before the rows that
+    are kept. SGBM has no confidence output, so every pixel passing its uniqueness and
+    speckle checks gets full confidence and the rest none.
+    """
+    name = 'sgbm'
+
+    def __init__(self, maxDisparity:int=DEFAULT_MAX_DISPARITY, window:int=DEFAULT_WINDOW, strips:int=0,
+        overlap:int=DEFAULT_STRIP_OVERLAP, pool:NumpyPool=None):
+        super(SGBMDisparity, self).__init__(maxDisparity=maxDisparity, window=window, pool=pool)
+        assert maxDisparity % 16 == 0
+        self.strips = strips
+        self.overlap = overlap
+        # A matcher keeps scratch buffers between calls, so every strip gets its own
+        self.matchers = [cv.StereoSGBM_create(minDisparity=0, numDisparities=maxDisparity, blockSize=window,
+            P1=8*window*window, P2=32*window*window, uniquenessRatio=10, speckleWindowSize=100, speckleRange=2,
+            mode=cv.STEREO_SGBM_MODE_SGBM_3WAY) for _ in range(max(strips, 1))]
+        self.workers = ThreadPoolExecutor(max_workers=strips) if strips > 1 else None
+
+    def stripBounds(self, height:int) -> List[Tuple[int, int, int, int]]:
+        # (matched start, matched end, kept start, kept end) rows of every strip
+        edges = np.linspace(0, height, self.strips + 1).astype(int)
+        return [(max(start - self.overlap, 0), min(end + self.overlap, height), start, end)
+            for start, end in zip(edges[:-1], edges[1:])]
+
+    def match(self, strip:int, left:np.ndarray, right:np.ndarray) -> np.ndarray:
+        out = self.pool.acquire(left.shape, np.int16)
+        return self.matchers[strip].compute(left, right, disparity=out)
+
+    @tracing.traced('sgbm')
+    def compute(self, left:np.ndarray, right:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        pool = self.pool
+        grays = []
+        if left.ndim == 3:
+            grays = [pool.acquire(left.shape[:2], np.uint8), pool.acquire(right.shape[:2], np.uint8)]
+            left = cv.cvtColor(left, cv.COLOR_BGR2GRAY, dst=grays[0])
+            right = cv.cvtColor(right, cv.COLOR_BGR2GRAY, dst=grays[1])
+
+        if self.workers is None:
+            raw = self.match(0, left, right)
+        else:
+            raw = pool.acquire(left.shape, np.int16)
+            bounds = self.stripBounds(left.shape[0])
+            jobs = [self.workers.submit(self.match, idx, left[lo:hi], right[lo:hi])
+                for idx, (lo, hi, _, _) in enumerate(bounds)]
+            for (lo, _, keepLo, keepHi), job in zip(bounds, jobs):
+                strip = job.result()
+                raw[keepLo:keepHi] = strip[keepLo - lo:keepHi - lo]
+                pool.release(strip)
+
+        # Raw disparity is fixed point with 4 fractional bits, invalid pixels are negative
+        disparity = cv.convertScaleAbs(raw, dst=pool.acquire(left.shape, np.uint8), alpha=255.0/(16*self.maxDisparity))
+        confidence = cv.compare(raw, 0, cv.CMP_GE, dst=pool.acquire(left.shape, np.uint8))
+        for buffer in grays + [raw]:
+            pool.release(buffer)
+        return disparity, confidence
+
+    def close(self):
+        if self.workers is not None:
+            self.workers.shutdown()
+
+
+BACKENDS = {
+    VPIDisparity.name: VPIDisparity,
+    SGBMDisparity.name: SGBMDisparity,
+}
+
+def availableBackends() -> List[str]:
+    result = []
+    try:
+        import vpi
+        result.append(VPIDisparity.name)
+    except ImportError:
+        pass
+    result.append(SGBMDisparity.name)
+    return result
+
+def createBackend(name:str=None, **kwargs) -> DisparityBackend:
+    # Without a name, take the environment's choice, then the fastest one available
+    if name is None:
+        name = os.environ.get(BACKEND_ENV, availableBackends()[0])
+    if name not in BACKENDS:
+        raise ValueError(f'unknown disparity backend {name}, expected one of {list(BACKENDS)}')
+    return BACKENDS[name](**kwargs)
+
+
+def loadPairs(path:str) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # Recorded pairs are matching filenames under left/ and right/
+    result = []
+    for leftPath in sorted(glob.glob(os.path.join(path, 'left', '*'))):
+        rightPath = os.path.join(path, 'right', os.path.basename(leftPath))
+        if os.path.exists(rightPath):
+            result.append((cv.imread(leftPath, cv.IMREAD_COLOR), cv.imread(rightPath, cv.IMREAD_COLOR)))
+    return result
+
+def syntheticPairs(count:int=8, size:Tuple[int, int]=(1920, 1080), shift:int=24) -> List[Tuple[np.ndarray, np.ndarray]]:
+    rng = np.random.RandomState(0)
+    result = []
+    for _ in range(count):
+        texture = rng.randint(0, 256, (size[1], size[0] + shift), dtype=np.uint8)
+        texture = cv.cvtColor(cv.GaussianBlur(texture, (0, 0), 1.5), cv.COLOR_GRAY2BGR)
+        result.append((np.ascontiguousarray(texture[:, shift:]), np.ascontiguousarray(texture[:, :-shift])))
+    return result
+
+def benchDisparity(pairs:List[Tuple[np.ndarray, np.ndarray]], configs:Dict[str, dict],
+    resolutions=((960, 540), (1920, 1080)), repeats:int=3):
+    for width, height in resolutions:
+        scaled = [(cv.resize(left, (width, height), interpolation=cv.INTER_AREA),
+            cv.resize(right, (width, height), interpolation=cv.INTER_AREA)) for left, right in pairs]
+        for label, config in configs.items():
+            backend = createBackend(**config)
+            backend.process(*scaled[0])
+
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(repeats):
+                for left, right in scaled:
+                    frameStart = time.perf_counter()
+                    backend.process(left, right)
+                    latencies.append(time.perf_counter() - frameStart)
+            elapsed = time.perf_counter() - start
+            backend.close()
+
+            latencies = np.array(latencies) * 1e3
+            print(f'{width}x{height} {label:10s}: {len(latencies)/elapsed:7.2f} fps, '
+                + f'latency {np.mean(latencies):8.2f}ms mean {np.percentile(latencies, 99):8.2f}ms p99')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the disparity backends.')
+    parser.add_argument('--pairs', type=str, default=None, help='A directory of recorded left/ and right/ frames.')
+    parser.add_argument('--strips', type=int, default=os.cpu_count(), help='Strips of the tiled SGBM backend.')
+    args = parser.parse_args()
+
+    pairs = syntheticPairs() if args.pairs is None else loadPairs(args.pairs)
+    configs = {'sgbm': {'name': 'sgbm'}, 'sgbm-tiled': {'name': 'sgbm', 'strips': args.strips}}
+    if VPIDisparity.name in availableBackends():
+        configs['vpi'] = {'name': 'vpi'}
+    benchDisparity(pairs, configs)
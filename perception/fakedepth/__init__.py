@@ -1 +1,2 @@
 from .interop import *
+from .engine import DepthEngine
@@ -0,0 +1,149 @@
+import torch
+import numpy as np
+
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from .interop import loadModel
+
+DEFAULT_MAX_BATCH = 4
+DEFAULT_MAX_DELAY = 0.005
+
+
+class DepthEngine(object):
+    """Runs MiDaS over micro-batches of frames gathered from any number of cameras.
+
+    submit() queues a frame and hands back a Future of its depth map. A worker thread
+    takes the first waiting frame, gathers whatever else arrives within maxDelay up to
+    maxBatch frames, and runs every group of equally sized frames as one batch. The
+    preprocessing and the upsample back out both stay on the device, and outputScale
+    trims the output resolution for consumers that don't need it all.
+    """
+    def __init__(self, model:torch.nn.Module=None, transform:torch.nn.Module=None, device:torch.device=None,
+        maxBatch:int=DEFAULT_MAX_BATCH, maxDelay:float=DEFAULT_MAX_DELAY, outputScale:float=1.,
+        cacheDir:str=None):
+        if model is None:
+            model, transform = loadModel(device=device, cacheDir=cacheDir)
+        self.model = model
+        self.transform = transform
+        self.device = next(model.parameters()).device
+        self.maxBatch = maxBatch
+        self.maxDelay = maxDelay
+        self.outputScale = outputScale
+
+        self.requests = queue.Queue()
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> 'DepthEngine':
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.serve, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def outputSize(self, shape:Tuple[int, ...]) -> Tuple[int, int]:
+        return max(int(round(shape[0] * self.outputScale)), 1), max(int(round(shape[1] * self.outputScale)), 1)
+
+    def predict(self, images:List[np.ndarray]) -> List[np.ndarray]:
+        # Frames of one size go through the network together
+        results = [None] * len(images)
+        groups = {}
+        for idx, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(idx)
+
+        with torch.no_grad():
+            for shape, indices in groups.items():
+                batch = torch.from_numpy(np.stack([images[idx] for idx in indices]))
+                if self.device.type == 'cuda':
+                    batch = batch.pin_memory()
+                rawDepth = self.model(self.transform(batch))
+                depth = torch.nn.functional.interpolate(rawDepth.unsqueeze(1), size=self.outputSize(shape),
+                    mode="bicubic", align_corners=False).squeeze(1)
+                depth = depth.cpu().numpy()
+                for row, idx in enumerate(indices):
+                    results[idx] = depth[row]
+        return results
+
+    def submit(self, image:np.ndarray) -> Future:
+        assert self.thread is not None, 'start the engine before submitting frames'
+        future = Future()
+        self.requests.put((image, future))
+        return future
+
+    def gather(self, first) -> Tuple[List, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.maxDelay
+        while len(batch) < self.maxBatch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def serve(self):
+        stopping = False
+        while not stopping:
+            first = self.requests.get()
+            if first is None:
+                return
+            batch, stopping = self.gather(first)
+
+            live = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+            if len(live) == 0:
+                continue
+            try:
+                for (_, future), depth in zip(live, self.predict([image for image, _ in live])):
+                    future.set_result(depth)
+            except Exception as error:
+                for _, future in live:
+                    future.set_exception(error)
+
+
+def benchEngine(engine:DepthEngine, shape:Tuple[int, int, int]=(480, 640, 3), batchSizes=(1, 2, 4, 8),
+    frames:int=32):
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 256, shape, dtype=np.uint8) for _ in range(max(batchSizes))]
+    engine.predict(images[:1])
+
+    print(f'MiDaS_small on {engine.device}, {shape[1]}x{shape[0]} frames, output scale {engine.outputScale}')
+    for batchSize in batchSizes:
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(max(frames // batchSize, 1)):
+            batchStart = time.perf_counter()
+            engine.predict(images[:batchSize])
+            latencies.append(time.perf_counter() - batchStart)
+        elapsed = time.perf_counter() - start
+
+        latencies = np.array(latencies) * 1e3
+        print(f'  batch {batchSize:2d}: {len(latencies)*batchSize/elapsed:7.2f} frames/s, '
+            + f'latency {np.mean(latencies):8.2f}ms mean {np.percentile(latencies, 99):8.2f}ms p99')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark depth inference against batch size.')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--scale', type=float, default=1., help='Output resolution scale.')
+    parser.add_argument('--cache', type=str, default=None, help='The torch hub cache holding MiDaS.')
+    args = parser.parse_args()
+
+    benchEngine(DepthEngine(device=torch.device(args.device), outputScale=args.scale, cacheDir=args.cache))
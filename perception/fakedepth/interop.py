@@ -1,29 +1,96 @@
 import torch
 import numpy as np
-from os import listdir
-from os.path import isfile, join, dirname
+from os import listdir, environ
+from os.path import isfile, isdir, join, dirname
 import cv2 as cv
+from typing import Tuple
 
 from torch._C import dtype
 
-def loadModel() -> tuple(torch.nn.Module, torch.nn.Module):
-    INTEL_MIDAS = "intel-isl/MiDaS"
-    MIDAS_MODEL = "MiDaS_small"
+try:
+    import tracing
+except ImportError:
+    # Outside of perception/ there is nothing to record the spans into
+    from . import notrace as tracing
 
-    model = torch.hub.load(INTEL_MIDAS, MIDAS_MODEL).cuda().eval()
-    transform = torch.hub.load(INTEL_MIDAS, "transforms").small_transform.cuda().eval()
+INTEL_MIDAS = "intel-isl/MiDaS"
+MIDAS_MODEL = "MiDaS_small"
+MIDAS_REPO_DIR = "intel-isl_MiDaS_master"
+MIDAS_CACHE_ENV = "MIDAS_CACHE"
 
+# The small_transform of MiDaS: the long side fit to 256 as a multiple of 32, ImageNet normalization
+MIDAS_NET_SIZE = 256
+MIDAS_MULTIPLE = 32
+MIDAS_MEAN = (0.485, 0.456, 0.406)
+MIDAS_STD = (0.229, 0.224, 0.225)
+
+
+def defaultDevice() -> torch.device:
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+def netSize(height:int, width:int) -> Tuple[int, int]:
+    scale = min(MIDAS_NET_SIZE / height, MIDAS_NET_SIZE / width)
+    fit = lambda length: max(int(np.floor(length * scale / MIDAS_MULTIPLE)) * MIDAS_MULTIPLE, MIDAS_MULTIPLE)
+    return fit(height), fit(width)
+
+
+class MidasTransform(torch.nn.Module):
+    """The MiDaS small_transform done on-device over a whole batch of BGR uint8 frames.
+    """
+    def __init__(self):
+        super(MidasTransform, self).__init__()
+        self.register_buffer('mean', torch.tensor(MIDAS_MEAN).view(1, 3, 1, 1))
+        self.register_buffer('std', torch.tensor(MIDAS_STD).view(1, 3, 1, 1))
+
+    def forward(self, images) -> torch.Tensor:
+        if isinstance(images, np.ndarray):
+            images = torch.from_numpy(images)
+        if images.dim() == 3:
+            images = images.unsqueeze(0)
+        images = images.to(self.mean.device, non_blocking=True)
+
+        # [batch, height, width, BGR] bytes to [batch, RGB, height, width] floats
+        batch = images.permute(0, 3, 1, 2).flip(1).float().div_(255.)
+        batch = torch.nn.functional.interpolate(batch, size=netSize(*batch.shape[-2:]), mode="bicubic",
+            align_corners=False)
+        return (batch - self.mean) / self.std
+
+
+def midasCache(cacheDir:str=None) -> str:
+    if cacheDir is None:
+        cacheDir = environ.get(MIDAS_CACHE_ENV, torch.hub.get_dir())
+    return cacheDir
+
+def loadModel(device:torch.device=None, cacheDir:str=None, allowDownload:bool=False) -> Tuple[torch.nn.Module, torch.nn.Module]:
+    """Load MiDaS_small out of the local hub cache, only reaching for the network when
+    allowed and the cache is empty. The weights are looked for in the same cache.
+    """
+    device = defaultDevice() if device is None else torch.device(device)
+    cacheDir = midasCache(cacheDir)
+    torch.hub.set_dir(cacheDir)
+
+    repoDir = join(cacheDir, MIDAS_REPO_DIR)
+    if isdir(repoDir):
+        model = torch.hub.load(repoDir, MIDAS_MODEL, source='local')
+    elif allowDownload:
+        model = torch.hub.load(INTEL_MIDAS, MIDAS_MODEL)
+    else:
+        raise FileNotFoundError(f'no MiDaS checkout in {cacheDir}, load once with allowDownload to fill the cache')
+
+    model = model.to(device).eval()
+    transform = MidasTransform().to(device).eval()
     return model, transform
 
+@tracing.traced('fakedepth.pred')
 def pred(model:torch.nn.Module, transform:torch.nn.Module, image:np.ndarray) -> np.ndarray:
     with torch.no_grad():
-        embeddedImage = transform(image).cuda()
-        rawDepth = model(embeddedImage).cuda()
+        embeddedImage = transform(image)
+        rawDepth = model(embeddedImage)
         depth = torch.nn.functional.interpolate(
             rawDepth.unsqueeze(1),
             size=image.shape[:2],
             mode="bicubic",
             align_corners=False,
         ).squeeze()
-    
+
     return depth.cpu().numpy()
@@ -0,0 +1,402 @@
+import numpy as np
+
+import argparse
+import mmap
+import multiprocessing as mp
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import NamedTuple, Optional, Tuple
+
+# A single producer, many consumer ring of frames in POSIX shared memory. The bus file
+# lives in /dev/shm, so containers sharing the host's ipc namespace see the same bus.
+SHM_DIR = '/dev/shm'
+BUS_PREFIX = 'mime-bus-'
+BUS_MAGIC = b'MIMB'
+BUS_VERSION = 2
+MAX_DIMS = 4
+ALIGNMENT = 64
+DEFAULT_SLOTS = 8
+POLL_INTERVAL = 50e-6
+
+POLICY_DROP = 'drop'
+POLICY_BLOCK = 'block'
+
+# magic, version, slot count, padding, slot payload capacity, next sequence to publish
+BUS_HEADER = struct.Struct('<4sIIIQQ')
+HEAD_OFFSET = 24
+# sequence lock word, timestamp, dims, shape, dtype, checksum of the header fields and pixels
+SLOT_HEADER = struct.Struct(f'<QdI{MAX_DIMS}I8sI')
+SEQLOCK = struct.Struct('<Q')
+CHECKSUM = struct.Struct('<I')
+CHECKSUM_OFFSET = SLOT_HEADER.size - CHECKSUM.size
+
+
+def alignUp(value:int, alignment:int=ALIGNMENT) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+def busPath(name:str) -> str:
+    return os.path.join(SHM_DIR, BUS_PREFIX + name)
+
+def socketPath(name:str) -> str:
+    return busPath(name) + '.sock'
+
+
+class BusLayout(object):
+    def __init__(self, slots:int, slotBytes:int):
+        self.slots = slots
+        self.slotBytes = slotBytes
+        self.headerBytes = alignUp(BUS_HEADER.size)
+        self.slotHeaderBytes = alignUp(SLOT_HEADER.size)
+        self.slotStride = self.slotHeaderBytes + alignUp(slotBytes)
+        self.totalBytes = self.headerBytes + slots * self.slotStride
+
+    def slotOffset(self, sequence:int) -> int:
+        return self.headerBytes + (sequence % self.slots) * self.slotStride
+
+    def dataOffset(self, sequence:int) -> int:
+        return self.slotOffset(sequence) + self.slotHeaderBytes
+
+    def checksum(self, memory, sequence:int, frameBytes:int) -> int:
+        # Everything in the slot but the lock word and the checksum itself
+        view = memoryview(memory)
+        offset = self.slotOffset(sequence)
+        digest = zlib.crc32(view[offset + SEQLOCK.size:offset + CHECKSUM_OFFSET])
+        dataOffset = self.dataOffset(sequence)
+        return zlib.crc32(view[dataOffset:dataOffset + frameBytes], digest)
+
+
+class BusFrame(NamedTuple):
+    image: np.ndarray
+    sequence: int
+    timestamp: float
+
+
+class FrameBus(object):
+    """The producer end of a frame bus.
+
+    Every slot carries a fixed header of its sequence lock word, timestamp, shape and
+    dtype ahead of the pixels. The lock word is odd while a slot is being written and
+    2*(sequence+1) once it holds that sequence, so readers can tell a torn or recycled
+    slot from a good one without any lock.
+
+    Python has no atomics or memory fences to publish the lock word with, and on a
+    weakly ordered CPU like the ARM cores of the Jetson a reader may see the new lock word
+    before the pixels under it. The slot header therefore also carries a CRC32 of its
+    fields and pixels, and a reader only takes a slot once the checksum matches while the
+    lock word still does.
+
+    Readers subscribe over a unix socket next to the bus. The frames of drop subscribers
+    just get overwritten as the ring wraps, but the producer waits on the acks of block
+    subscribers before reusing their slots.
+    """
+    def __init__(self, name:str, slotBytes:int, slots:int=DEFAULT_SLOTS, blockTimeout:float=1.):
+        self.name = name
+        self.layout = BusLayout(slots, slotBytes)
+        self.blockTimeout = blockTimeout
+        self.sequence = 0
+        self.stalls = 0
+
+        fd = os.open(busPath(name), os.O_CREAT | os.O_TRUNC | os.O_RDWR, 0o666)
+        try:
+            os.ftruncate(fd, self.layout.totalBytes)
+            self.memory = mmap.mmap(fd, self.layout.totalBytes)
+        finally:
+            os.close(fd)
+        BUS_HEADER.pack_into(self.memory, 0, BUS_MAGIC, BUS_VERSION, slots, 0, slotBytes, 0)
+
+        # Subscribers that asked for backpressure and the last sequence each has finished
+        self.acks = {}
+        self.acked = threading.Condition()
+        self.selector = selectors.DefaultSelector()
+        if os.path.exists(socketPath(name)):
+            os.remove(socketPath(name))
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socketPath(name))
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(target=self.serveControl, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def serveControl(self):
+        buffers = {}
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                if key.fileobj is self.listener:
+                    client, _ = self.listener.accept()
+                    client.setblocking(False)
+                    buffers[client] = b''
+                    self.selector.register(client, selectors.EVENT_READ)
+                    continue
+
+                client = key.fileobj
+                try:
+                    data = client.recv(4096)
+                except OSError:
+                    data = b''
+                if not data:
+                    self.dropClient(client, buffers)
+                    continue
+                buffers[client] += data
+                while b'\n' in buffers[client]:
+                    line, buffers[client] = buffers[client].split(b'\n', 1)
+                    self.handleCommand(client, line.decode().split())
+
+    def handleCommand(self, client:socket.socket, words):
+        if len(words) == 0:
+            return
+        if words[0] == 'subscribe':
+            block = len(words) > 1 and words[1] == POLICY_BLOCK
+            if block:
+                with self.acked:
+                    # Nothing before the frame it joins at is the new subscriber's business
+                    self.acks[client] = self.sequence - 1
+                    self.acked.notify_all()
+            client.sendall(f'ok {self.layout.slots} {self.layout.slotBytes}\n'.encode())
+        elif words[0] == 'ack' and len(words) > 1:
+            with self.acked:
+                if client in self.acks:
+                    self.acks[client] = max(self.acks[client], int(words[1]))
+                    self.acked.notify_all()
+
+    def dropClient(self, client:socket.socket, buffers):
+        # A reader that goes away must never hold the producer up
+        self.selector.unregister(client)
+        buffers.pop(client, None)
+        with self.acked:
+            self.acks.pop(client, None)
+            self.acked.notify_all()
+        client.close()
+
+    def waitForSlot(self, sequence:int) -> bool:
+        # The slot last held sequence - slots, every blocking reader has to be past it
+        with self.acked:
+            deadline = time.monotonic() + self.blockTimeout
+            while len(self.acks) > 0 and min(self.acks.values()) < sequence - self.layout.slots:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.acked.wait(remaining)
+        return True
+
+    def reserve(self, shape:Tuple[int, ...], dtype) -> np.ndarray:
+        """A writable view of the next slot, for producers that can render in place.
+        The frame goes out on commit().
+        """
+        dtype = np.dtype(dtype)
+        assert len(shape) <= MAX_DIMS
+        assert int(np.prod(shape)) * dtype.itemsize <= self.layout.slotBytes
+        if not self.waitForSlot(self.sequence):
+            self.stalls += 1
+
+        offset = self.layout.slotOffset(self.sequence)
+        SEQLOCK.pack_into(self.memory, offset, 2 * self.sequence + 1)
+        self.reserved = (tuple(shape), dtype)
+        return np.ndarray(shape, dtype=dtype, buffer=self.memory, offset=self.layout.dataOffset(self.sequence))
+
+    def commit(self, timestamp:float=None) -> int:
+        shape, dtype = self.reserved
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        paddedShape = tuple(shape) + (0,) * (MAX_DIMS - len(shape))
+        offset = self.layout.slotOffset(self.sequence)
+        SLOT_HEADER.pack_into(self.memory, offset, 2 * self.sequence + 1, timestamp, len(shape), *paddedShape,
+            dtype.str.encode(), 0)
+        frameBytes = int(np.prod(shape)) * dtype.itemsize
+        CHECKSUM.pack_into(self.memory, offset + CHECKSUM_OFFSET, self.layout.checksum(self.memory, self.sequence, frameBytes))
+        SEQLOCK.pack_into(self.memory, offset, 2 * (self.sequence + 1))
+
+        # Under the ack lock, so a block subscriber joining now is seeded against this very head
+        with self.acked:
+            sequence = self.sequence
+            self.sequence += 1
+            SEQLOCK.pack_into(self.memory, HEAD_OFFSET, self.sequence)
+        return sequence
+
+    def publish(self, frame:np.ndarray, timestamp:float=None) -> int:
+        np.copyto(self.reserve(frame.shape, frame.dtype), frame)
+        return self.commit(timestamp)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+        for path in (busPath(self.name), socketPath(self.name)):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            self.memory.close()
+        except BufferError:
+            # Views handed out by reserve() are still around, the mapping goes with them
+            pass
+
+
+class FrameSubscriber(object):
+    """A reader of a frame bus, handing out zero-copy views of the shared slots.
+
+    Views are only good until the producer laps the ring, check frame validity with
+    valid() after using one. Block subscribers hold the producer off their unreleased
+    frames instead, so theirs stay good until release().
+    """
+    def __init__(self, name:str, block:bool=False):
+        self.name = name
+        self.block = block
+        self.control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.control.connect(socketPath(name))
+        self.control.sendall(f'subscribe {POLICY_BLOCK if block else POLICY_DROP}\n'.encode())
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = self.control.recv(256)
+            if not chunk:
+                raise ConnectionError('frame bus closed the control socket')
+            reply += chunk
+        _, slots, slotBytes = reply.decode().split()
+
+        self.layout = BusLayout(int(slots), int(slotBytes))
+        fd = os.open(busPath(name), os.O_RDONLY)
+        try:
+            self.memory = mmap.mmap(fd, self.layout.totalBytes, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        magic, version = BUS_HEADER.unpack_from(self.memory, 0)[:2]
+        assert magic == BUS_MAGIC and version == BUS_VERSION
+
+        self.next = self.head()
+        self.dropped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def head(self) -> int:
+        return SEQLOCK.unpack_from(self.memory, HEAD_OFFSET)[0]
+
+    def lockWord(self, sequence:int) -> int:
+        return SEQLOCK.unpack_from(self.memory, self.layout.slotOffset(sequence))[0]
+
+    def valid(self, frame:BusFrame) -> bool:
+        return self.lockWord(frame.sequence) == 2 * (frame.sequence + 1)
+
+    def read(self, timeout:float=None) -> Optional[BusFrame]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head = self.head()
+            if head > self.next:
+                # Anything the ring has already lapped is gone
+                oldest = max(head - self.layout.slots, 0)
+                if self.next < oldest:
+                    self.dropped += oldest - self.next
+                    self.next = oldest
+
+                sequence = self.next
+                offset = self.layout.slotOffset(sequence)
+                word, timestamp, dims, *header = SLOT_HEADER.unpack_from(self.memory, offset)
+                expected = 2 * (sequence + 1)
+                if word == expected:
+                    shape, dtype = tuple(header[:dims]), np.dtype(header[MAX_DIMS].rstrip(b'\0').decode())
+                    checksum = self.layout.checksum(self.memory, sequence, int(np.prod(shape)) * dtype.itemsize)
+                    if self.lockWord(sequence) == word:
+                        if checksum == header[MAX_DIMS + 1]:
+                            image = np.ndarray(shape, dtype=dtype, buffer=self.memory, offset=self.layout.dataOffset(sequence))
+                            self.next = sequence + 1
+                            return BusFrame(image, sequence, timestamp)
+                        # The lock word got here ahead of the rest of the slot, wait for it below
+                    else:
+                        self.dropped += 1
+                        self.next = sequence + 1
+                        continue
+                elif word > expected:
+                    # Torn by a lapping write, start over from the new head
+                    self.dropped += 1
+                    self.next = sequence + 1
+                    continue
+                # Otherwise the head got here ahead of the slot, and the write is still on its way
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, frame:BusFrame):
+        if self.block:
+            self.control.sendall(f'ack {frame.sequence}\n'.encode())
+
+    def close(self):
+        self.control.close()
+        try:
+            self.memory.close()
+        except BufferError:
+            pass
+
+
+def benchReader(name:str, frames:int, block:bool, ready, results):
+    latencies = np.zeros(frames, dtype=np.float64)
+    with FrameSubscriber(name, block=block) as subscriber:
+        ready.put(True)
+        count = 0
+        while count < frames:
+            frame = subscriber.read(timeout=2.)
+            if frame is None:
+                break
+            # Touch the pixels the way a consumer would before calling it done
+            int(frame.image.reshape(-1)[::4096].sum())
+            latencies[count] = time.monotonic() - frame.timestamp
+            count += 1
+            subscriber.release(frame)
+            if frame.sequence >= frames - 1:
+                break
+        results.put((count, subscriber.dropped, latencies[:count]))
+
+def benchBus(shapes=((480, 640, 3), (1080, 1920, 3), (2, 1080, 1920, 3)), readerCounts=(1, 2, 4), frames:int=300,
+    block:bool=True):
+    context = mp.get_context('fork')
+    for shape in shapes:
+        frameBytes = int(np.prod(shape))
+        frame = np.random.randint(0, 256, shape, dtype=np.uint8)
+        for readers in readerCounts:
+            name = f'bench-{os.getpid()}'
+            ready, results = context.Queue(), context.Queue()
+            with FrameBus(name, frameBytes) as bus:
+                procs = [context.Process(target=benchReader, args=(name, frames, block, ready, results))
+                    for _ in range(readers)]
+                for proc in procs:
+                    proc.start()
+                for _ in procs:
+                    ready.get()
+                # Give the control thread a moment to register the last subscription
+                time.sleep(0.05)
+
+                start = time.monotonic()
+                for _ in range(frames):
+                    bus.publish(frame)
+                elapsed = time.monotonic() - start
+                stats = [results.get() for _ in procs]
+                for proc in procs:
+                    proc.join()
+
+            latencies = np.concatenate([lat for _, _, lat in stats]) * 1e6
+            dropped = sum(drop for _, drop, _ in stats)
+            print(f'{str(shape):20s} x{readers}: {frames/elapsed:8.1f} frames/s {frames*frameBytes/elapsed/1e9:6.2f} GB/s, '
+                + f'latency {np.mean(latencies):8.1f}us mean {np.percentile(latencies, 99):8.1f}us p99, {dropped} dropped')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the shared memory frame bus.')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--drop', action='store_true', help='Readers drop frames instead of holding the producer back.')
+    args = parser.parse_args()
+    benchBus(frames=args.frames, block=not args.drop)
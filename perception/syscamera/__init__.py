@@ -1,4 +1,11 @@
 from . import config
-from .config import configurationString
+from .config import configurationString, testConfigurationString
+
+from . import calibration
+from .calibration import Calibration, loadCalibration, remapTables
 
 from . import capture
+from .capture import RetinalSystem, FrameGrabber, Frame
+
+from . import stereo
+from .stereo import StereoCapture, StereoPair
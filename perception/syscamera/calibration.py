@@ -0,0 +1,156 @@
+import cv2 as cv
+import numpy as np
+
+import hashlib
+import os
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+DISTORTION_TERMS = 5
+REMAP_SUFFIX = '.remap'
+
+
+class Calibration(NamedTuple):
+    intrinsic: np.ndarray
+    distortion: np.ndarray
+    rotation: Optional[np.ndarray] = None
+    projection: Optional[np.ndarray] = None
+    translation: Optional[np.ndarray] = None
+    path: Optional[str] = None
+
+    def key(self) -> str:
+        digest = hashlib.sha1()
+        for value in (self.intrinsic, self.distortion, self.rotation, self.projection):
+            digest.update(b'-' if value is None else np.ascontiguousarray(value, dtype=np.float64).tobytes())
+        return digest.hexdigest()[:16]
+
+
+def asCalibration(calib) -> Calibration:
+    if isinstance(calib, Calibration):
+        return calib
+    calib = np.asarray(calib, dtype=np.float64)
+    assert calib.shape == (3, 3)
+    return Calibration(calib, np.zeros(DISTORTION_TERMS))
+
+def loadCalibration(path:str) -> Calibration:
+    # A bare .npy is the original 3x3 intrinsic, a .npz can carry the distortion and
+    # the rectifying rotation/projection and extrinsic translation of a stereo pair
+    if path.endswith('.npz'):
+        with np.load(path) as archive:
+            fields = {name: archive[name].astype(np.float64) for name in archive.files}
+        intrinsic = fields['intrinsic']
+        distortion = fields.get('distortion', np.zeros(DISTORTION_TERMS)).ravel()
+        result = Calibration(intrinsic, distortion, fields.get('rotation'), fields.get('projection'),
+            fields.get('translation'), path)
+    else:
+        intrinsic = np.load(path).astype(np.float64)
+        result = Calibration(intrinsic, np.zeros(DISTORTION_TERMS), path=path)
+
+    assert result.intrinsic.shape == (3, 3)
+    return result
+
+def saveCalibration(path:str, calib:Calibration):
+    fields = {name: value for name, value in calib._asdict().items() if name != 'path' and value is not None}
+    np.savez(path, **fields)
+
+def stereoRectify(left:Calibration, right:Calibration, size:Tuple[int, int], rotation:np.ndarray,
+    translation:np.ndarray, alpha:float=0.) -> Tuple[Calibration, Calibration, np.ndarray]:
+    """Fill in the rectifying rotations and projections of a stereo pair from the
+    rotation and translation taking the left camera to the right one.
+
+    Returns the rectified calibrations and the disparity-to-depth matrix.
+    """
+    leftRot, rightRot, leftProj, rightProj, disparityToDepth, _, _ = cv.stereoRectify(
+        left.intrinsic, left.distortion, right.intrinsic, right.distortion, size, rotation, translation,
+        flags=cv.CALIB_ZERO_DISPARITY, alpha=alpha)
+    left = left._replace(rotation=leftRot, projection=leftProj, translation=np.zeros(3))
+    right = right._replace(rotation=rightRot, projection=rightProj, translation=np.ravel(translation))
+    return left, right, disparityToDepth
+
+
+def remapPath(calib:Calibration, size:Tuple[int, int], optimal:bool) -> Optional[str]:
+    if calib.path is None:
+        return None
+    stem = os.path.splitext(calib.path)[0]
+    return f'{stem}{REMAP_SUFFIX}-{calib.key()}-{size[0]}x{size[1]}{"-opt" if optimal else ""}.npz'
+
+def buildRemap(calib:Calibration, size:Tuple[int, int], optimal:bool=False) -> Tuple[np.ndarray, np.ndarray]:
+    projection = calib.projection
+    if projection is None:
+        projection = calib.intrinsic
+        if optimal:
+            projection, _ = cv.getOptimalNewCameraMatrix(calib.intrinsic, calib.distortion, size, 1, size)
+
+    # CV_16SC2 keeps the maps in fixed point, integer coordinates plus an interpolation
+    # table index, which is both smaller and faster to remap with than float maps
+    return cv.initUndistortRectifyMap(calib.intrinsic, calib.distortion, calib.rotation, projection,
+        size, cv.CV_16SC2)
+
+REMAP_CACHE: Dict[Tuple[str, Tuple[int, int], bool], Tuple[np.ndarray, np.ndarray]] = {}
+
+def remapTables(calib, size:Tuple[int, int], optimal:bool=False) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the combined undistort and rectify maps of a calibration at a (width, height),
+    from memory, then from the cache next to the calibration file, building them once.
+    """
+    calib = asCalibration(calib)
+    size = (int(size[0]), int(size[1]))
+    key = (calib.key(), size, optimal)
+    if key in REMAP_CACHE:
+        return REMAP_CACHE[key]
+
+    path = remapPath(calib, size, optimal)
+    maps = None
+    if path is not None and os.path.exists(path):
+        try:
+            with np.load(path) as archive:
+                maps = (archive['coords'], archive['interp'])
+        except (OSError, ValueError, KeyError):
+            maps = None
+
+    if maps is None:
+        maps = buildRemap(calib, size, optimal=optimal)
+        if path is not None:
+            # Write to the side and move it in so a crash never leaves a torn cache
+            partial = path + '.part'
+            try:
+                with open(partial, 'wb') as file:
+                    np.savez(file, coords=maps[0], interp=maps[1])
+                os.replace(partial, path)
+            except OSError:
+                pass
+
+    REMAP_CACHE[key] = maps
+    return maps
+
+def undistortFrame(frame:np.ndarray, calib, optimal:bool=False, out:np.ndarray=None) -> np.ndarray:
+    coords, interp = remapTables(calib, (frame.shape[1], frame.shape[0]), optimal=optimal)
+    return cv.remap(frame, coords, interp, cv.INTER_LINEAR, dst=out)
+
+
+def benchUndistort(sizes=((1920, 1080), (3280, 2464)), frames:int=20):
+    for width, height in sizes:
+        calib = Calibration(np.array([[0.9*width, 0., width/2.], [0., 0.9*width, height/2.], [0., 0., 1.]]),
+            np.array([-0.3, 0.1, 0.001, -0.001, -0.02]))
+        frame = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        out = np.empty_like(frame)
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            cv.undistort(frame, calib.intrinsic, calib.distortion, dst=out)
+        perFrame = (time.perf_counter() - start) / frames
+
+        REMAP_CACHE.clear()
+        start = time.perf_counter()
+        remapTables(calib, (width, height))
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(frames):
+            undistortFrame(frame, calib, out=out)
+        cached = (time.perf_counter() - start) / frames
+
+        print(f'{width}x{height}: undistort {perFrame*1e3:7.2f}ms/frame, cached remap {cached*1e3:7.2f}ms/frame '
+            + f'({build*1e3:.1f}ms to build the maps once)')
+
+
+if __name__ == '__main__':
+    benchUndistort()
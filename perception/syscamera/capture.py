@@ -2,17 +2,293 @@ import cv2 as cv
 import numpy as np
 import torch
 
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, NamedTuple, Optional, Tuple
+
+try:
+    import tracing
+except ImportError:
+    # Outside of perception/ there is nothing to record the spans into
+    from . import notrace as tracing
+
 from . import config
+from .calibration import asCalibration, undistortFrame
+
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+DEFAULT_RING_SLOTS = 4
+
+TIMESTAMP_DRIVER = 'driver'
+TIMESTAMP_MONOTONIC = 'monotonic'
+DRIVER_CLOCK_TOLERANCE = 1.
+
+SLOT_FREE = 0
+SLOT_FILLING = 1
+SLOT_READY = 2
+SLOT_BORROWED = 3
+
 
 class RetinalSystem(cv.VideoCapture):
-    def __init__(self, id:int, calib:np.ndarray, width:int=3280, height:int=2464, fps:int=21):
-        super(RetinalSystem, self).__init__(
-            config.configurationString(camID=id, width=width, height=height, fps=fps),
-            cv.CAP_GSTREAMER)
-        
+    def __init__(self, id:int, calib, width:int=3280, height:int=2464, fps:int=21,
+        source:str=None, apiPreference:int=None):
+        # Any other source (a file, a videotestsrc pipeline) stands in for the sensor
+        if source is None:
+            source = config.configurationString(camID=id, width=width, height=height, fps=fps)
+            apiPreference = cv.CAP_GSTREAMER
+        elif apiPreference is None:
+            apiPreference = cv.CAP_GSTREAMER if '!' in source else cv.CAP_ANY
+        super(RetinalSystem, self).__init__(source, apiPreference)
+
         assert calib is not None
-        self.intrinsic = calib
+        self.id = id
+        self.calibration = asCalibration(calib)
+        self.intrinsic = self.calibration.intrinsic
+
+    def undistort(self, frame:np.ndarray, optimal:bool=False, out:np.ndarray=None) -> np.ndarray:
+        # The remap tables are built once per resolution and cached next to the calibration
+        return undistortFrame(frame, self.calibration, optimal=optimal, out=out)
+
+    @tracing.traced('RetinalSystem.read')
+    def read(self, undist:bool=True, undistOptimal:bool=False) -> Tuple[bool, np.ndarray]:
+        ret, rawFrame = super(RetinalSystem, self).read()
+        if not ret or not undist:
+            return ret, rawFrame
+
+        return ret, self.undistort(rawFrame, optimal=undistOptimal)
+
+    def threaded(self, slots:int=DEFAULT_RING_SLOTS, policy:str=DROP_OLDEST, undist:bool=False,
+        undistOptimal:bool=False) -> 'FrameGrabber':
+        # Raw frames unless asked, then every frame is undistorted on the capture thread
+        transform = None
+        if undist:
+            transform = lambda frame, out: self.undistort(frame, optimal=undistOptimal, out=out)
+        return FrameGrabber(self, slots=slots, policy=policy, transform=transform)
+
+
+class Frame(NamedTuple):
+    image: np.ndarray
+    sequence: int
+    timestamp: float
+    slot: int
+
+
+class FrameGrabber(object):
+    """Captures on a background thread into a fixed ring of preallocated frames.
+
+    Frames handed out by read() are borrowed views into the ring, valid until they are
+    given back with release(). When every slot is full, the drop-oldest policy recycles
+    the oldest unread frame and the block policy stalls capture until a slot frees up.
+    Sequence numbers count every grabbed frame, so gaps show what was dropped.
+
+    Frame timestamps are on the time.monotonic() clock. The buffer timestamp the driver
+    reports through CAP_PROP_POS_MSEC is used when it is on that clock too, which is the
+    case for the V4L2 backend, so the time spent between the sensor and grab() returning
+    stays out of the pairing. Otherwise (the GStreamer backend reports stream time) the
+    clock is read right after grab(). The first frame decides, and timestampSource says
+    which one is in use.
+
+    Frames are the raw grab()/retrieve() output of the capture. A transform, called as
+    transform(frame, out=slot), is applied to every one of them (the first included)
+    on the capture thread and must keep the frame's shape.
+    """
+    def __init__(self, capture:cv.VideoCapture, slots:int=DEFAULT_RING_SLOTS, policy:str=DROP_OLDEST,
+        shape:Tuple[int, ...]=None, transform:Callable[[np.ndarray, np.ndarray], np.ndarray]=None):
+        assert slots >= 2
+        assert policy in (DROP_OLDEST, BLOCK)
+        self.capture = capture
+        self.policy = policy
+        self.transform = transform
+
+        # Size the ring off of the first frame if the caller doesn't know it, taken the
+        # same way as every later frame so a RetinalSystem's own read() doesn't sneak in
+        self.pending = None
+        self.timestampSource = None
+        if shape is None:
+            ret = capture.grab()
+            timestamp = self.grabTimestamp()
+            if ret:
+                ret, first = capture.retrieve()
+            if not ret:
+                raise RuntimeError('could not read a first frame to size the ring')
+            shape = first.shape
+            self.pending = (first, timestamp)
+
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(slots)]
+        self.scratch = np.empty(shape, dtype=np.uint8) if transform is not None else None
+        self.headers = [(0, 0.) for _ in range(slots)]
+        self.states = [SLOT_FREE] * slots
+        self.ready = deque()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+        self.sequence = 0
+        self.dropped = 0
+        self.copied = 0
+        self.finished = False
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> 'FrameGrabber':
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.captureLoop, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        with self.changed:
+            self.running = False
+            self.changed.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def grabTimestamp(self) -> float:
+        # Called right after a grab(), the driver's timestamp of it if on the monotonic clock
+        now = time.monotonic()
+        if self.timestampSource == TIMESTAMP_MONOTONIC:
+            return now
+        driver = self.capture.get(cv.CAP_PROP_POS_MSEC) / 1e3
+        if self.timestampSource is None:
+            if driver > 0. and abs(now - driver) < DRIVER_CLOCK_TOLERANCE:
+                self.timestampSource = TIMESTAMP_DRIVER
+            else:
+                self.timestampSource = TIMESTAMP_MONOTONIC
+                return now
+        return driver if driver > 0. else now
+
+    def acquireSlot(self) -> Optional[int]:
+        # Called with the lock held, hands back a slot to fill or None when stopped
+        while self.running:
+            for idx, state in enumerate(self.states):
+                if state == SLOT_FREE:
+                    return idx
+            if self.policy == DROP_OLDEST and len(self.ready) > 0:
+                self.dropped += 1
+                return self.ready.popleft()
+            self.changed.wait()
+        return None
+
+    def captureLoop(self):
+        while True:
+            with self.changed:
+                slot = self.acquireSlot()
+                if slot is None:
+                    return
+                self.states[slot] = SLOT_FILLING
+            buffer = self.buffers[slot]
+
+            if self.pending is not None:
+                image, timestamp = self.pending
+                self.pending = None
+                ret = True
+                if self.transform is None:
+                    np.copyto(buffer, image)
+            else:
+                # The timestamp is the grab, the decode into the slot (or scratch) comes after
+                ret = self.capture.grab()
+                timestamp = self.grabTimestamp()
+                if ret:
+                    target = buffer if self.transform is None else self.scratch
+                    ret, image = self.capture.retrieve(image=target)
+                    if ret and self.transform is None and not np.shares_memory(image, buffer):
+                        np.copyto(buffer, image)
+                        self.copied += 1
+            if ret and self.transform is not None:
+                transformed = self.transform(image, out=buffer)
+                if not np.shares_memory(transformed, buffer):
+                    np.copyto(buffer, transformed)
+                    self.copied += 1
+
+            with self.changed:
+                if not ret:
+                    self.states[slot] = SLOT_FREE
+                    self.finished = True
+                    self.running = False
+                    self.changed.notify_all()
+                    return
+                self.headers[slot] = (self.sequence, timestamp)
+                self.sequence += 1
+                self.states[slot] = SLOT_READY
+                self.ready.append(slot)
+                self.changed.notify_all()
+
+    def read(self, timeout:float=None) -> Optional[Frame]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.changed:
+            while len(self.ready) == 0:
+                if self.finished or not self.running:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+
+            slot = self.ready.popleft()
+            self.states[slot] = SLOT_BORROWED
+            sequence, timestamp = self.headers[slot]
+        return Frame(self.buffers[slot], sequence, timestamp, slot)
+
+    def release(self, frame:Frame):
+        with self.changed:
+            assert self.states[frame.slot] == SLOT_BORROWED
+            self.states[frame.slot] = SLOT_FREE
+            self.changed.notify_all()
+
+    @contextmanager
+    def borrow(self, timeout:float=None):
+        frame = self.read(timeout=timeout)
+        try:
+            yield frame
+        finally:
+            if frame is not None:
+                self.release(frame)
+
+
+def benchGrabber(capture:cv.VideoCapture, frames:int=300, slots:int=DEFAULT_RING_SLOTS, policy:str=DROP_OLDEST,
+    work:float=0.):
+    latencies = np.zeros(frames, dtype=np.float64)
+    with FrameGrabber(capture, slots=slots, policy=policy) as grabber:
+        start = time.monotonic()
+        count = 0
+        while count < frames:
+            with grabber.borrow(timeout=5.) as frame:
+                if frame is None:
+                    break
+                latencies[count] = time.monotonic() - frame.timestamp
+                count += 1
+                if work > 0:
+                    time.sleep(work)
+        elapsed = time.monotonic() - start
+
+    latencies = latencies[:count] * 1e3
+    print(f'{policy}, {slots} slots: {count/elapsed:7.1f} fps, latency {np.mean(latencies):6.2f}ms mean '
+        + f'{np.percentile(latencies, 99):6.2f}ms p99, {grabber.dropped} dropped, {grabber.copied} copied')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the threaded frame grabber.')
+    parser.add_argument('--source', type=str, default=None, help='A file or pipeline to read, videotestsrc if not given.')
+    parser.add_argument('--width', type=int, default=3280)
+    parser.add_argument('--height', type=int, default=2464)
+    parser.add_argument('--fps', type=int, default=21)
+    parser.add_argument('--work', type=float, default=0., help='Seconds of simulated work per frame.')
+    args = parser.parse_args()
 
-    def read(self, undist:bool=True, undistOptimal:bool=False):
-        rawFrame, ret = super(RetinalSystem, self).read()
-        
+    source = args.source
+    if source is None:
+        source = config.testConfigurationString(width=args.width, height=args.height, fps=args.fps)
+    for policy in (DROP_OLDEST, BLOCK):
+        capture = RetinalSystem(0, np.eye(3), source=source)
+        benchGrabber(capture, policy=policy, work=args.work)
+        capture.release()
@@ -1,6 +1,8 @@
 import cv2 as cv
 import numpy as np
 
+from .calibration import loadCalibration
+
 def configurationString(camID: int, width: int, height: int, fps: int) -> str:
     return f'nvarguscamerasrc sensor_id={camID} ! ' \
         + f'video/x-raw(memory:NVMM), width=(int){width}, height=(int){height}' \
@@ -9,12 +11,13 @@ def configurationString(camID: int, width: int, height: int, fps: int) -> str:
         + 'videoconvert ! video/x-raw, format=(string)BGR ! ' \
         + 'appsink'
 
+def testConfigurationString(width: int, height: int, fps: int, pattern: str = 'ball') -> str:
+    return f'videotestsrc is-live=true pattern={pattern} ! ' \
+        + f'video/x-raw, width=(int){width}, height=(int){height}' \
+        + f', framerate=(fraction){fps}/1 ! ' \
+        + 'videoconvert ! video/x-raw, format=(string)BGR ! ' \
+        + 'appsink'
+
 def setupCamera(camID:int, width:int=3280, height:int=2464, fps:int=21) -> cv.VideoCapture:
     config = configurationString(camID=camID, width=width, height=height, fps=fps)
     return cv.VideoCapture(config, cv.CAP_GSTREAMER)
-
-def loadCalibration(path:str) -> np.ndarray:
-    result = np.load(path)
-    assert result.shape == (3, 3)
-
-    return result
@@ -0,0 +1,23 @@
+# Stands in for perception/tracing.py when the package is imported from outside of
+# perception/, keeping the same span() and traced() calls as no-ops.
+
+
+class NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+def span(name:str):
+    return NULL_SPAN
+
+def traced(name:str=None):
+    def decorator(func):
+        return func
+    return decorator
@@ -0,0 +1,174 @@
+import cv2 as cv
+import numpy as np
+
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from .capture import Frame, FrameGrabber, DEFAULT_RING_SLOTS, DROP_OLDEST
+
+DEFAULT_SYNC_TOLERANCE = 0.01
+SKEW_HISTORY = 1024
+
+
+class StereoPair(NamedTuple):
+    left: Frame
+    right: Frame
+    skew: float
+
+
+class StereoCapture(object):
+    """Pairs the frames of two concurrently running grabbers by capture timestamp.
+
+    Each camera captures on its own thread into its own ring, so a slow sensor only
+    delays the pairs and never the other camera. A frame with no partner within the
+    tolerance is dropped in favor of the next one off of the same camera, and the
+    skew of the returned pairs is kept for stats().
+    """
+    def __init__(self, left:FrameGrabber, right:FrameGrabber, tolerance:float=DEFAULT_SYNC_TOLERANCE):
+        self.grabbers = (left, right)
+        self.tolerance = tolerance
+        self.pending = [None, None]
+        self.dropped = [0, 0]
+        self.pairs = 0
+        self.skews = np.zeros(SKEW_HISTORY, dtype=np.float64)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open(cls, left:cv.VideoCapture, right:cv.VideoCapture, tolerance:float=DEFAULT_SYNC_TOLERANCE,
+        slots:int=DEFAULT_RING_SLOTS, policy:str=DROP_OLDEST) -> 'StereoCapture':
+        return cls(FrameGrabber(left, slots=slots, policy=policy), FrameGrabber(right, slots=slots, policy=policy),
+            tolerance=tolerance)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> 'StereoCapture':
+        for grabber in self.grabbers:
+            grabber.start()
+        return self
+
+    def stop(self):
+        for grabber in self.grabbers:
+            grabber.stop()
+        for side in range(2):
+            self.dropPending(side, count=False)
+
+    def dropPending(self, side:int, count:bool=True):
+        if self.pending[side] is not None:
+            self.grabbers[side].release(self.pending[side])
+            self.pending[side] = None
+            if count:
+                self.dropped[side] += 1
+
+    def readPair(self, timeout:float=None) -> Optional[StereoPair]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while True:
+                for side in range(2):
+                    if self.pending[side] is None:
+                        remaining = None if deadline is None else max(deadline - time.monotonic(), 0.)
+                        self.pending[side] = self.grabbers[side].read(timeout=remaining)
+                        if self.pending[side] is None:
+                            return None
+
+                left, right = self.pending
+                skew = right.timestamp - left.timestamp
+                if abs(skew) <= self.tolerance:
+                    self.pending = [None, None]
+                    self.skews[self.pairs % SKEW_HISTORY] = skew
+                    self.pairs += 1
+                    return StereoPair(left, right, skew)
+
+                # The older frame can only pair with something captured even later, which
+                # will be further off still, so it has no partner left
+                self.dropPending(0 if skew > 0 else 1)
+
+    read_pair = readPair
+
+    def release(self, pair:StereoPair):
+        self.grabbers[0].release(pair.left)
+        self.grabbers[1].release(pair.right)
+
+    def stats(self) -> dict:
+        skews = np.abs(self.skews[:min(self.pairs, SKEW_HISTORY)])
+        hasSkews = len(skews) > 0
+        return {
+            'pairs': self.pairs,
+            'droppedLeft': self.dropped[0],
+            'droppedRight': self.dropped[1],
+            'skewMean': float(np.mean(skews)) if hasSkews else 0.,
+            'skewP99': float(np.percentile(skews, 99)) if hasSkews else 0.,
+            'skewMax': float(np.max(skews)) if hasSkews else 0.,
+        }
+
+
+class SyntheticCapture(object):
+    """A stand-in for a camera, producing frames at a nominal rate with a phase offset,
+    Gaussian timing jitter and the occasional missed frame.
+    """
+    def __init__(self, shape=(480, 640, 3), fps:float=30., phase:float=0., jitter:float=0.002,
+        missRate:float=0., frames:int=None, seed:int=0):
+        self.shape = shape
+        self.period = 1. / fps
+        self.jitter = jitter
+        self.missRate = missRate
+        self.frames = frames
+        self.rng = np.random.RandomState(seed)
+        self.start = time.monotonic() + phase
+        self.index = 0
+
+    def grab(self) -> bool:
+        if self.frames is not None and self.index >= self.frames:
+            return False
+        self.index += 1
+        while self.missRate > 0 and self.rng.uniform() < self.missRate:
+            self.index += 1
+
+        due = self.start + self.index * self.period + self.rng.normal(0., self.jitter)
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    def retrieve(self, image:np.ndarray=None, flag:int=0):
+        if image is None:
+            image = np.empty(self.shape, dtype=np.uint8)
+        image[...] = self.index % 256
+        return True, image
+
+    def read(self, image:np.ndarray=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        pass
+
+
+def checkSync(pairs:int=300, fps:float=30., phase:float=0.004, jitter:float=0.003, missRate:float=0.05,
+    tolerance:float=DEFAULT_SYNC_TOLERANCE):
+    left = SyntheticCapture(fps=fps, jitter=jitter, missRate=missRate, seed=0)
+    right = SyntheticCapture(fps=fps, phase=phase, jitter=jitter, missRate=missRate, seed=1)
+
+    mismatched = 0
+    with StereoCapture.open(left, right, tolerance=tolerance) as stereo:
+        for _ in range(pairs):
+            pair = stereo.read_pair(timeout=1.)
+            assert pair is not None
+            assert abs(pair.skew) <= tolerance
+            # Both synthetic cameras stamp their frame index into the pixels
+            mismatched += int(pair.left.image[0, 0, 0] != pair.right.image[0, 0, 0])
+            stereo.release(pair)
+        stats = stereo.stats()
+
+    print(f'{stats["pairs"]} pairs, {mismatched} off by a frame, dropped {stats["droppedLeft"]} left '
+        + f'{stats["droppedRight"]} right, skew {stats["skewMean"]*1e3:.2f}ms mean '
+        + f'{stats["skewP99"]*1e3:.2f}ms p99 {stats["skewMax"]*1e3:.2f}ms max')
+
+
+if __name__ == '__main__':
+    checkSync()
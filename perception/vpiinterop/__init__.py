@@ -1,8 +1,41 @@
+import importlib.util
 import os
+import sys
+import types
 
-# I had to do this type of JiT because CUDA is a closed source bitch
-os.system("(cd vpiinterop/build && \
-    cmake -Wno-dev -DTorch_DIR=/usr/local/lib/python3.6/dist-packages/torch/share/cmake/Torch/ . .. && \
-    make)")
+from . import aot
 
-from .build.vpiinterop import *
+# The extension is built ahead of time (python -m vpiinterop.aot) and only loaded the
+# first time something out of it is used, so importing the package never compiles.
+# Setting VPIINTEROP_JIT builds it on first use instead, for development.
+JIT_ENV = 'VPIINTEROP_JIT'
+
+
+class LazyExtension(types.ModuleType):
+    native = None
+
+    def load(self):
+        if LazyExtension.native is None:
+            import torch
+            path = aot.builtModule()
+            if path is None:
+                if not os.environ.get(JIT_ENV):
+                    raise ImportError('vpiinterop is not built for these sources, run python -m vpiinterop.aot '
+                        + f'or set {JIT_ENV}=1')
+                path = aot.buildExtension()
+            spec = importlib.util.spec_from_file_location(f'{__name__}.{aot.MODULE_NAME}', path)
+            native = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(native)
+            LazyExtension.native = native
+        return LazyExtension.native
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name != '__all__':
+            raise AttributeError(name)
+        native = self.load()
+        if name == '__all__':
+            return [attr for attr in dir(native) if not attr.startswith('_')]
+        return getattr(native, name)
+
+
+sys.modules[__name__].__class__ = LazyExtension
@@ -0,0 +1,116 @@
+import hashlib
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Ahead of time build of the native extension, run once per image or source change:
+#   python -m vpiinterop.aot
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(PACKAGE_DIR, 'build')
+LOCK_NAME = '.lock'
+MODULE_NAME = 'vpiinterop'
+SOURCES = ('CMakeLists.txt', 'denseFlow.cpp')
+
+
+def torchCMakeDir() -> str:
+    import torch.utils
+    return os.path.join(torch.utils.cmake_prefix_path, 'Torch')
+
+def pybindCMakeDir() -> str:
+    try:
+        import pybind11
+        return pybind11.get_cmake_dir()
+    except (ImportError, AttributeError):
+        return None
+
+def sourceKey() -> str:
+    # Anything that changes the binary: the sources, the interpreter and the torch it links against
+    import torch
+    digest = hashlib.sha256()
+    for name in SOURCES:
+        with open(os.path.join(PACKAGE_DIR, name), 'rb') as file:
+            digest.update(name.encode())
+            digest.update(file.read())
+    digest.update(sys.version.encode())
+    digest.update(torch.__version__.encode())
+    digest.update(torchCMakeDir().encode())
+    return digest.hexdigest()[:16]
+
+def builtModule(key:str=None) -> str:
+    key = sourceKey() if key is None else key
+    matches = glob.glob(os.path.join(BUILD_DIR, key, MODULE_NAME + '*.so'))
+    return matches[0] if len(matches) > 0 else None
+
+
+class BuildLock(object):
+    # An exclusive file lock, so concurrent first imports wait on one build
+    def __init__(self, path:str):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        import fcntl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        import fcntl
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+
+def buildExtension(force:bool=False, verbose:bool=True) -> str:
+    """Build the extension into a directory named by the hash of its inputs, reusing
+    whatever build already sits there.
+
+    Returns the path of the compiled module.
+    """
+    key = sourceKey()
+    with BuildLock(os.path.join(BUILD_DIR, LOCK_NAME)):
+        # Whoever held the lock before may have just finished the same build
+        existing = builtModule(key)
+        if existing is not None and not force:
+            return existing
+
+        # Build off to the side and move it in whole so no one loads half a build
+        workDir = tempfile.mkdtemp(prefix=key + '.', dir=BUILD_DIR)
+        try:
+            configure = ['cmake', '-Wno-dev', f'-DTorch_DIR={torchCMakeDir()}',
+                f'-DPYTHON_EXECUTABLE={sys.executable}', PACKAGE_DIR]
+            pybindDir = pybindCMakeDir()
+            if pybindDir is not None:
+                configure.insert(-1, f'-Dpybind11_DIR={pybindDir}')
+            output = None if verbose else subprocess.DEVNULL
+            subprocess.run(configure, cwd=workDir, check=True, stdout=output)
+            subprocess.run(['cmake', '--build', '.', '--', f'-j{os.cpu_count() or 1}'], cwd=workDir, check=True,
+                stdout=output)
+
+            target = os.path.join(BUILD_DIR, key)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            os.replace(workDir, target)
+        finally:
+            if os.path.isdir(workDir):
+                shutil.rmtree(workDir)
+
+        # Earlier builds are stale once the inputs change
+        for stale in os.listdir(BUILD_DIR):
+            path = os.path.join(BUILD_DIR, stale)
+            if stale != key and os.path.isdir(path) and '.' not in stale:
+                shutil.rmtree(path, ignore_errors=True)
+
+    return builtModule(key)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the vpiinterop extension ahead of time.')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if a matching build exists.')
+    args = parser.parse_args()
+    print(buildExtension(force=args.force))